@@ -1,56 +1,27 @@
 from datetime import datetime, timedelta, timezone
-from functools import wraps
 import pytz
 from dateutil.relativedelta import relativedelta
-from typing import Dict, List, Any, Callable, Type, get_type_hints
+from typing import Dict, List
 from db import MongoDB
+from identity_cache import IdentitySnapshot
+from block_cache import BlockResultCache
+from numpy_engine import NumpyBlockEngine
+from parallel_fetch import fetch_face_events
+from rollups import RollupBlockEngine
+from time_buckets import TimeBucketPipeline, bucket_event_faces, empty_block_stats, summarize_block_faces
+from topology_cache import CameraTopology
+from validation import ValidateParams
 import inspect
 
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime and isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                setattr(instance, key, value)
-            return func(instance, *args, **kwargs)
-        return wrapper
-
 class CustomerCountMetric:
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    param_startTime: datetime
+    param_dueTime: datetime
+    param_groupIds: list
+    # Fields read by this class, used as query projections
+    face_event_fields = {"_id": 0, "face_id": 1, "timestamp": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "first_seen": 1}
+
     def __init__(self):
         self.required_params = ["param_startTime", "param_dueTime", "param_groupIds", "host", "port"]
 
@@ -110,109 +81,106 @@ class CustomerCountMetric:
             return dt.replace(tzinfo=default_tz)
         return dt
     
-    @ValidateParams(lambda self: self.required_params)
-    def run(self, *args, **kwargs):
-        mongo_client = MongoDB()
-        mongo_client.setup_db(
-            username=kwargs["username"],
-            password=kwargs["password"],
-            host=kwargs["host"],
-            port=kwargs["port"],
-            auth=kwargs["auth"],
+    def stream_block_stats(self, mongo_client, db_name, camera_ids, time_blocks, start_datetime, due_datetime, batch_size=1000, with_faces=False, use_identity_cache=True, fetch_workers=1):
+        """Compute block stats client-side from a streamed event scan"""
+        # Stream events and keep only the face set of each block
+        face_events = fetch_face_events(
+            mongo_client, db_name, {"camera_id": {"$in": camera_ids}},
+            start_datetime, due_datetime, time_blocks,
+            projection=self.face_event_fields,
+            batch_size=batch_size,
+            workers=fetch_workers
         )
 
-        # Validate base_time
-        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
-        if kwargs["param_baseTime"] not in valid_base_times:
-            raise ValueError(f"Invalid base_time: {kwargs["param_baseTime"]}. Must be one of {valid_base_times}")
-        
-        start_datetime = datetime.fromisoformat(kwargs["param_startTime"].replace('Z', '+00:00'))
-        due_datetime = datetime.fromisoformat(kwargs["param_dueTime"].replace('Z', '+00:00'))
+        block_faces = bucket_event_faces(face_events, time_blocks)
         
-        time_blocks = self.generate_time_blocks(start_datetime, due_datetime, kwargs["param_baseTime"])
+        unique_face_ids = list(set().union(*block_faces))
+        if not unique_face_ids:
+            return empty_block_stats(len(time_blocks), with_faces)
 
-        camera_list = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="cameras",
-            query={
-                "group_id": {"$in": kwargs["param_groupIds"]}
-            }
-        )["result"]
-        camera_list = list(camera_list)
-        camera_ids = list(camera_list)
-        camera_ids = [camera["camera_id"] for camera in camera_ids]
+        if use_identity_cache:
+            face_identities = IdentitySnapshot.get_identities(mongo_client, db_name, unique_face_ids)
+        else:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": unique_face_ids}
+                },
+                projection=self.face_identity_fields
+            )['result']
+        return self.block_stats_from_faces(time_blocks, block_faces, face_identities, with_faces)
 
-        face_events = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_events",
-            query={
-                "camera_id": {"$in": camera_ids},
-                "timestamp": {"$gte": start_datetime, "$lte": due_datetime}
-            }
-        )["result"]
+    def block_stats_from_faces(self, time_blocks, block_faces, face_identities, with_faces=False):
+        """Reduce per-block face sets and their face_identities to block stats"""
+        face_first_seen_map = {
+            face["face_id"]: self.ensure_timezone(face.get("first_seen")) for face in face_identities
+        }
+        return summarize_block_faces(time_blocks, block_faces, face_first_seen_map, with_faces)
+
+    def compute_block_stats(self, mongo_client, db_name, camera_ids, time_blocks, base_time, engine="pipeline", use_rollups=True, batch_size=1000, with_faces=False, use_identity_cache=True, fetch_workers=1, block_workers=1):
+        """Compute stats of contiguous time blocks with the selected engine"""
+        if not time_blocks:
+            return empty_block_stats(0, with_faces)
+        start_datetime = time_blocks[0]["from"]
+        due_datetime = time_blocks[-1]["to"]
         
-        if len(face_events) == 0:
+        # Hour-aligned daily and longer blocks are served from hourly rollups when they are fresh
+        if use_rollups:
+            block_stats = RollupBlockEngine(
+                camera_ids, time_blocks, base_time, with_faces=with_faces, use_identity_cache=use_identity_cache
+            ).run(mongo_client, db_name, batch_size)
+            if block_stats is not None:
+                return block_stats
+        
+        # "pipeline" buckets events on the server, "numpy" and "stream" (and the fallback when the aggregation fails) on the client
+        if engine == "pipeline":
+            block_stats = TimeBucketPipeline(
+                camera_ids, time_blocks, base_time, with_faces=with_faces
+            ).run(mongo_client, db_name, batch_size)
+            if block_stats is not None:
+                return block_stats
+        if engine == "numpy":
+            return NumpyBlockEngine(
+                camera_ids, time_blocks, start_datetime, due_datetime, with_faces=with_faces, use_identity_cache=use_identity_cache,
+                fetch_workers=fetch_workers, block_workers=block_workers
+            ).run(mongo_client, db_name, batch_size)
+        return self.stream_block_stats(
+            mongo_client, db_name, camera_ids, time_blocks,
+            start_datetime, due_datetime, batch_size, with_faces, use_identity_cache, fetch_workers
+        )
+
+    def format_block_stats(self, time_blocks, block_stats, base_time):
+        """Build the metric response from block stats aligned with time_blocks"""
+        if not any(stats["count"] for stats in block_stats["blocks"]):
             return {
                 "results": [],
                 "metadata": {
                     "total_count": 0,
                     "total_new_customer": 0,
                     "last_updated": datetime.now(pytz.UTC).isoformat(),
-                    "base_time": kwargs["param_baseTime"]
+                    "base_time": base_time
                 }
             }
         
-        unique_face_ids = list(set(event["face_id"] for event in face_events))
-
-        face_identities = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_identities",
-            query={
-                "face_id": {"$in": unique_face_ids}
-            }
-        )['result']
-        
-        face_first_seen_map = {face["face_id"]: face["first_seen"] for face in face_identities}
-        
         results = []
         total_count = 0
         total_new_customer = 0
         
-        for block in time_blocks:
-            block_events = [
-                event for event in face_events
-                if block["from"] <= self.ensure_timezone(event["timestamp"]) < block["to"]
-            ]
-            
-            block_customers = list(set(event["face_id"] for event in block_events))
-            block_count = len(block_customers)
-            
-            new_customers = 0
-            old_customers = 0
-            
-            for face_id in block_customers:
-                first_seen = self.ensure_timezone(face_first_seen_map.get(face_id))
-                if first_seen is None:
-                    continue
-                
-                if block["from"] <= first_seen < block["to"]:
-                    new_customers += 1
-                elif first_seen < block["from"]:
-                    old_customers += 1
-            
+        for block, stats in zip(time_blocks, block_stats["blocks"]):
             block_result = {
                 "time_range": {
                     "from": block["from"].isoformat(),
                     "to": block["to"].isoformat(),
                 },
-                "count": block_count,
-                "new_customer": new_customers,
-                "old_customer": old_customers
+                "count": stats["count"],
+                "new_customer": stats["new"],
+                "old_customer": stats["old"]
             }
             
             results.append(block_result)
-            total_count += block_count
-            total_new_customer += new_customers
+            total_count += stats["count"]
+            total_new_customer += stats["new"]
         
         return {
             "results": results,
@@ -220,10 +188,54 @@ class CustomerCountMetric:
                 "total_count": total_count,
                 "total_new_customer": total_new_customer,
                 "last_updated": datetime.now(pytz.UTC).isoformat(),
-                "base_time": kwargs["param_baseTime"]
+                "base_time": base_time
             }
         }
 
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        mongo_client = MongoDB()
+        mongo_client.setup_db(
+            username=kwargs["username"],
+            password=kwargs["password"],
+            host=kwargs["host"],
+            port=kwargs["port"],
+            auth=kwargs["auth"],
+        )
+
+        # Validate base_time
+        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
+        if kwargs["param_baseTime"] not in valid_base_times:
+            raise ValueError(f"Invalid base_time: {kwargs['param_baseTime']}. Must be one of {valid_base_times}")
+        
+        start_datetime = kwargs["param_startTime"]
+        due_datetime = kwargs["param_dueTime"]
+        
+        time_blocks = self.generate_time_blocks(start_datetime, due_datetime, kwargs["param_baseTime"])
+
+        camera_ids = CameraTopology.camera_ids(mongo_client, kwargs["db"], kwargs["param_groupIds"])
+
+        # Closed blocks are served from the block cache, only missing and open blocks are computed
+        def compute(blocks):
+            return self.compute_block_stats(
+                mongo_client, kwargs["db"], camera_ids, blocks, kwargs["param_baseTime"],
+                engine=kwargs.get("engine", "pipeline"),
+                use_rollups=kwargs.get("use_rollups", True),
+                batch_size=kwargs.get("batch_size", 1000),
+                use_identity_cache=kwargs.get("use_identity_cache", True),
+                fetch_workers=kwargs.get("fetch_workers", 1),
+                block_workers=kwargs.get("block_workers", 1)
+            )
+        
+        if kwargs.get("use_cache", True):
+            block_stats = BlockResultCache.cached_block_stats(
+                kwargs["db"], self.__class__.__name__, camera_ids, time_blocks, kwargs["param_baseTime"], compute
+            )
+        else:
+            block_stats = compute(time_blocks)
+        
+        return self.format_block_stats(time_blocks, block_stats, kwargs["param_baseTime"])
+
 class ClassSerializer:
     @classmethod
     def serialize(cls, class_obj):
@@ -1,5 +1,4 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
+from typing import Dict, List
 import datetime
 import inspect
 import pytz
@@ -7,57 +6,25 @@ from dateutil.relativedelta import relativedelta
 import json
 import argparse
 from db import MongoDB
-
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime.datetime and isinstance(value, str):
-            try:
-                datetime.datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                    setattr(instance, key, value)
-                    
-            return func(instance, *args, **kwargs)
-        return wrapper
-
+from block_cache import BlockResultCache
+from numpy_engine import NumpyBlockEngine
+from parallel_fetch import fetch_face_events
+from rollups import RollupBlockEngine
+from time_buckets import TimeBucketPipeline, bucket_event_faces, empty_block_stats, summarize_block_faces
+from topology_cache import CameraTopology
+from validation import ValidateParams
 
 class EmployeeCountMetric:
     """
     Thống kê số lượng nhân viên theo khoảng thời gian
     """
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    param_startTime: datetime.datetime
+    param_dueTime: datetime.datetime
+    param_groupIds: list
+    # Fields read by this class, used as query projections
+    face_event_fields = {"_id": 0, "face_id": 1, "timestamp": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "first_seen": 1, "labels": 1}
     
     def __init__(self):
         """Initialize required parameters"""
@@ -124,93 +91,93 @@ class EmployeeCountMetric:
         
         return blocks
     
-    @ValidateParams(lambda self: self.required_params)
-    def run(self, *args, **kwargs):
-        """Run the employee count metric calculation"""
-        # Connect to MongoDB
-        mongo_client = MongoDB()
-        mongo_client.setup_db(
-            username=kwargs.get("username", ""),
-            password=kwargs.get("password", ""),
-            host=kwargs["host"],
-            port=kwargs["port"],
-            auth=kwargs.get("auth", "admin"),
-        )
-        
-        # Validate base_time parameter
-        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
-        base_time = kwargs["param_baseTime"]
-        if base_time not in valid_base_times:
-            raise ValueError(f"Invalid base_time: {base_time}. Must be one of {valid_base_times}")
-        
-        # Convert string timestamps to datetime objects
-        start_datetime = self.ensure_timezone(
-            datetime.datetime.fromisoformat(kwargs["param_startTime"].replace('Z', '+00:00'))
-        )
-        due_datetime = self.ensure_timezone(
-            datetime.datetime.fromisoformat(kwargs["param_dueTime"].replace('Z', '+00:00'))
-        )
-        
-        # Parse camera IDs
-        camera_ids = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="cameras",
-            query={
-                "group_id": {"$in": kwargs['param_groupIds']}
-            }
-        )["result"]
-        camera_ids = list(camera_ids)
-        camera_ids = [camera["camera_id"] for camera in camera_ids]
-        
-        # Generate time blocks
-        time_blocks = self.generate_time_blocks(start_datetime, due_datetime, base_time)
-        
-        # Get face events within the time range
-        face_events = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_events",
-            query={
-                "camera_id": {"$in": camera_ids},
-                "timestamp": {"$gte": start_datetime, "$lte": due_datetime}
-            }
+    def staff_identities(self, mongo_client, db_name):
+        """Identities labelled "staff", read through the labels index"""
+        return mongo_client.find(
+            db_name=db_name,
+            col_name="face_identities",
+            query={"labels": "staff"},
+            projection=self.face_identity_fields
         )["result"]
+    
+    def stream_block_stats(self, mongo_client, db_name, camera_ids, time_blocks, start_datetime, due_datetime, batch_size=1000, with_faces=False, staff_identities=None, fetch_workers=1):
+        """Compute staff block stats client-side from a streamed scan of staff events"""
+        if staff_identities is None:
+            staff_identities = self.staff_identities(mongo_client, db_name)
+        if not staff_identities:
+            return empty_block_stats(len(time_blocks), with_faces)
         
-        # If no events, return empty result
-        if len(face_events) == 0:
-            return {
-                "results": [],
-                "metadata": {
-                    "total_count": 0,
-                    "last_updated": datetime.datetime.now(pytz.UTC).isoformat(),
-                    "base_time": base_time
-                }
-            }
+        # Only staff events are returned, so no per-event membership check is needed
+        face_events = fetch_face_events(
+            mongo_client, db_name,
+            {
+                "face_id": {"$in": [face["face_id"] for face in staff_identities]},
+                "camera_id": {"$in": camera_ids}
+            },
+            start_datetime, due_datetime, time_blocks,
+            projection=self.face_event_fields,
+            batch_size=batch_size,
+            workers=fetch_workers
+        )
         
-        # Ensure all timestamps have timezone info
-        for event in face_events:
-            event["timestamp"] = self.ensure_timezone(event["timestamp"])
+        block_faces = bucket_event_faces(face_events, time_blocks)
+        return self.block_stats_from_faces(time_blocks, block_faces, staff_identities, with_faces)
+    
+    def block_stats_from_faces(self, time_blocks, block_faces, face_identities, with_faces=False):
+        """Reduce per-block face sets and their face_identities to staff block stats"""
+        # Keep only face_identities with "staff" label, mapped to first_seen
+        face_id_to_first_seen = {}
+        for face in face_identities:
+            if "staff" in face.get("labels", []):
+                face_id_to_first_seen[face["face_id"]] = self.ensure_timezone(face.get("first_seen"))
         
-        # Get unique face IDs from events
-        unique_face_ids = list(set(event["face_id"] for event in face_events))
+        employee_block_faces = [
+            block_face_ids & face_id_to_first_seen.keys() for block_face_ids in block_faces
+        ]
+        return summarize_block_faces(time_blocks, employee_block_faces, face_id_to_first_seen, with_faces)
+    
+    def compute_block_stats(self, mongo_client, db_name, camera_ids, time_blocks, base_time, engine="pipeline", use_rollups=True, batch_size=1000, with_faces=False, use_identity_cache=True, fetch_workers=1, block_workers=1):
+        """Compute stats of contiguous time blocks with the selected engine"""
+        if not time_blocks:
+            return empty_block_stats(0, with_faces)
+        start_datetime = time_blocks[0]["from"]
+        due_datetime = time_blocks[-1]["to"]
         
-        # Get face identities for these face IDs
-        face_identities = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_identities",
-            query={
-                "face_id": {"$in": unique_face_ids}
-            }
-        )["result"]
+        # Hour-aligned daily and longer blocks are served from hourly rollups when they are fresh
+        if use_rollups:
+            block_stats = RollupBlockEngine(
+                camera_ids, time_blocks, base_time, labels=["staff"], with_faces=with_faces, use_identity_cache=use_identity_cache
+            ).run(mongo_client, db_name, batch_size)
+            if block_stats is not None:
+                return block_stats
         
-        # Filter out only face_identities with "staff" label
-        employee_face_ids = []
-        for face in face_identities:
-            labels = face.get("labels", [])
-            if "staff" in labels:
-                employee_face_ids.append(face["face_id"])
+        # Staff faces are resolved first so every engine only reads staff events
+        staff_identities = self.staff_identities(mongo_client, db_name)
+        if not staff_identities:
+            return empty_block_stats(len(time_blocks), with_faces)
+        staff_face_ids = [face["face_id"] for face in staff_identities]
         
-        # If no staff members, return empty result
-        if len(employee_face_ids) == 0:
+        # "pipeline" buckets events on the server, "numpy" and "stream" (and the fallback when the aggregation fails) on the client
+        if engine == "pipeline":
+            block_stats = TimeBucketPipeline(
+                camera_ids, time_blocks, base_time, labels=["staff"], with_faces=with_faces, face_ids=staff_face_ids
+            ).run(mongo_client, db_name, batch_size)
+            if block_stats is not None:
+                return block_stats
+        if engine == "numpy":
+            return NumpyBlockEngine(
+                camera_ids, time_blocks, start_datetime, due_datetime, labels=["staff"], with_faces=with_faces, face_ids=staff_face_ids, use_identity_cache=use_identity_cache,
+                fetch_workers=fetch_workers, block_workers=block_workers
+            ).run(mongo_client, db_name, batch_size)
+        return self.stream_block_stats(
+            mongo_client, db_name, camera_ids, time_blocks,
+            start_datetime, due_datetime, batch_size, with_faces, staff_identities, fetch_workers
+        )
+
+    def format_block_stats(self, time_blocks, block_stats, base_time):
+        """Build the metric response from block stats aligned with time_blocks"""
+        # If no staff events, return empty result
+        if block_stats["distinct_faces"] == 0:
             return {
                 "results": [],
                 "metadata": {
@@ -220,74 +187,80 @@ class EmployeeCountMetric:
                 }
             }
         
-        # Filter only events from staff members
-        employee_events = [event for event in face_events if event["face_id"] in employee_face_ids]
-        
-        # Create mapping from face_id to first_seen to identify new employees
-        face_id_to_first_seen = {}
-        for face in face_identities:
-            if face["face_id"] in employee_face_ids:
-                first_seen = self.ensure_timezone(face["first_seen"])
-                face_id_to_first_seen[face["face_id"]] = first_seen
-        
         # Process data for each time block
         results = []
-        all_employees = set()  # Set of all employees that appeared
-        
-        for block in time_blocks:
-            # Filter events in current time block
-            block_events = []
-            for event in employee_events:
-                event_timestamp = event["timestamp"]
-                if block["from"] <= event_timestamp < block["to"]:
-                    block_events.append(event)
-            
-            # If no events in block, add block with zero values
-            if not block_events:
-                block_result = {
-                    "time_range": {
-                        "from": block["from"].isoformat(),
-                        "to": block["to"].isoformat()
-                    },
-                    "count": 0,
-                    "new_appear_employees": 0
-                }
-                results.append(block_result)
-                continue
-            
-            # Get unique employees in this block
-            block_employees = set(event["face_id"] for event in block_events)
-            
-            # Count new employees appearing in this block
-            new_employees = 0
-            for face_id in block_employees:
-                first_seen = face_id_to_first_seen.get(face_id)
-                if first_seen and block["from"] <= first_seen < block["to"]:
-                    new_employees += 1
-            
-            # Create result for this time block
+        for block, stats in zip(time_blocks, block_stats["blocks"]):
             block_result = {
                 "time_range": {
                     "from": block["from"].isoformat(),
                     "to": block["to"].isoformat()
                 },
-                "count": len(block_employees),
-                "new_appear_employees": new_employees
+                "count": stats["count"],
+                "new_appear_employees": stats["new"]
             }
-            
             results.append(block_result)
-            all_employees.update(block_employees)
         
         # Return results and metadata
         return {
             "results": results,
             "metadata": {
-                "total_count": len(all_employees),
+                "total_count": block_stats["distinct_faces"],
                 "last_updated": datetime.datetime.now(pytz.UTC).isoformat(),
                 "base_time": base_time
             }
         }
 
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        """Run the employee count metric calculation"""
+        # Connect to MongoDB
+        mongo_client = MongoDB()
+        mongo_client.setup_db(
+            username=kwargs.get("username", ""),
+            password=kwargs.get("password", ""),
+            host=kwargs["host"],
+            port=kwargs["port"],
+            auth=kwargs.get("auth", "admin"),
+        )
+        
+        # Validate base_time parameter
+        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
+        base_time = kwargs["param_baseTime"]
+        if base_time not in valid_base_times:
+            raise ValueError(f"Invalid base_time: {base_time}. Must be one of {valid_base_times}")
+        
+        # Timestamps arrive parsed by ValidateParams
+        start_datetime = self.ensure_timezone(kwargs["param_startTime"])
+        due_datetime = self.ensure_timezone(kwargs["param_dueTime"])
+        
+        # Parse camera IDs
+        camera_ids = CameraTopology.camera_ids(mongo_client, kwargs["db"], kwargs["param_groupIds"])
+        
+        # Generate time blocks
+        time_blocks = self.generate_time_blocks(start_datetime, due_datetime, base_time)
+        
+        # Closed blocks are served from the block cache, only missing and open blocks are computed
+        def compute(blocks):
+            return self.compute_block_stats(
+                mongo_client, kwargs["db"], camera_ids, blocks, base_time,
+                engine=kwargs.get("engine", "pipeline"),
+                use_rollups=kwargs.get("use_rollups", True),
+                batch_size=kwargs.get("batch_size", 1000),
+                use_identity_cache=kwargs.get("use_identity_cache", True),
+                fetch_workers=kwargs.get("fetch_workers", 1),
+                block_workers=kwargs.get("block_workers", 1),
+                with_faces=True
+            )
+        
+        if kwargs.get("use_cache", True):
+            block_stats = BlockResultCache.cached_block_stats(
+                kwargs["db"], self.__class__.__name__, camera_ids, time_blocks, base_time, compute
+            )
+        else:
+            block_stats = compute(time_blocks)
+        
+        return self.format_block_stats(time_blocks, block_stats, base_time)
+
 
 class ClassSerializer:
     @classmethod
@@ -1,58 +1,23 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
 import datetime
 import inspect
 import pytz
 import json
 import argparse
+import heapq
 from db import MongoDB
-
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime.datetime and isinstance(value, str):
-            try:
-                datetime.datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                    setattr(instance, key, value)
-                    
-            return func(instance, *args, **kwargs)
-        return wrapper
+from parallel_fetch import fetch_face_events
+from topology_cache import CameraTopology
+from validation import ValidateParams
 
 class TopCustomerMetric:
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    param_startTime: datetime.datetime
+    param_dueTime: datetime.datetime
+    param_groupIds: list
+    # Fields read by this class, used as query projections
+    face_event_fields = {"_id": 0, "face_id": 1, "timestamp": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "username": 1, "metadata.age": 1, "metadata.gender": 1}
+
     def __init__(self):
         """Initialize required parameters"""
         self.required_params = [
@@ -72,139 +37,134 @@ class TopCustomerMetric:
             return dt.replace(tzinfo=default_tz)
         return dt
     
-    @ValidateParams(lambda self: self.required_params)
-    def run(self, *args, **kwargs):
-        """Run the top customer metric calculation"""
-        # Connect to MongoDB
-        mongo_client = MongoDB()
-        mongo_client.setup_db(
-            username=kwargs.get("username", ""),
-            password=kwargs.get("password", ""),
-            host=kwargs["host"],
-            port=kwargs["port"],
-            auth=kwargs.get("auth", "admin"),
-        )
-        
-        # Validate base_time parameter
-        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
-        if kwargs["param_baseTime"] not in valid_base_times:
-            raise ValueError(f"Invalid base_time: {kwargs['param_baseTime']}. Must be one of {valid_base_times}")
+    def build_ranking_pipeline(self, camera_ids, start_datetime, due_datetime, limit):
+        """
+        Aggregation ranking customers by visits on the server
         
-        # Validate limit parameter
-        limit = int(kwargs.get("param_limit", 5))
-        if limit <= 0:
-            raise ValueError("Limit must be a positive number")
-        
-        # Convert string timestamps to datetime objects
-        start_datetime = self.ensure_timezone(
-            datetime.datetime.fromisoformat(kwargs["param_startTime"].replace('Z', '+00:00'))
-        )
-        due_datetime = self.ensure_timezone(
-            datetime.datetime.fromisoformat(kwargs["param_dueTime"].replace('Z', '+00:00'))
-        )
-        
-        # Parse camera IDs
-        camera_ids = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="cameras",
-            query={
-                "group_id": {"$in": kwargs['param_groupIds']}
-            }
-        )["result"]
-        camera_ids = list(camera_ids)
-        camera_ids = [camera["camera_id"] for camera in camera_ids]
-        
-        # Get face events within the time range
-        face_events = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_events",
-            query={
-                "camera_id": {"$in": camera_ids},
-                "timestamp": {"$gte": start_datetime, "$lte": due_datetime}
-            }
-        )["result"]
-        
-        # If no events, return empty result
-        if len(face_events) == 0:
-            return {
-                "results": [],
-                "metadata": {
-                    "current_month": start_datetime.replace(day=1).isoformat(),
-                    "last_updated": datetime.datetime.now(pytz.UTC).isoformat(),
-                    "has_more": False,
-                    "limit": limit
+        Only limit + 1 customers leave the server, the extra one tells whether
+        there are more. Identities are looked up for these winners only.
+        """
+        return [
+            {
+                "$match": {
+                    "camera_id": {"$in": camera_ids},
+                    "timestamp": {"$gte": start_datetime, "$lte": due_datetime}
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$face_id",
+                    "visit_count": {"$sum": 1},
+                    "visit_days": {"$addToSet": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}}},
+                    "last_visit": {"$max": "$timestamp"}
+                }
+            },
+            {
+                "$project": {
+                    "visit_count": 1,
+                    "visit_days": {"$size": "$visit_days"},
+                    "last_visit": 1
+                }
+            },
+            # face_id breaks ties so the ranking is deterministic
+            {"$sort": {"visit_count": -1, "visit_days": -1, "_id": 1}},
+            {"$limit": limit + 1},
+            {
+                "$lookup": {
+                    "from": "face_identities",
+                    "localField": "_id",
+                    "foreignField": "face_id",
+                    "pipeline": [{"$project": self.face_identity_fields}],
+                    "as": "identity"
                 }
             }
+        ]
+    
+    def add_visit(self, customer_stats, event):
+        """Count one event into customer_stats, keyed by face_id"""
+        face_id = event["face_id"]
+        # Events may be shared with other metrics, so they are not modified in place
+        timestamp = self.ensure_timezone(event["timestamp"])
         
-        # Ensure all timestamps have timezone info
-        for event in face_events:
-            event["timestamp"] = self.ensure_timezone(event["timestamp"])
-        
-        # Get unique face IDs from events
-        unique_face_ids = list(set(event["face_id"] for event in face_events))
-        
-        # Get face identities for these face IDs
-        face_identities = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_identities",
-            query={
-                "face_id": {"$in": unique_face_ids}
+        if face_id not in customer_stats:
+            customer_stats[face_id] = {
+                "visit_count": 0, 
+                "visit_days": set(), 
+                "last_visit": None
             }
-        )["result"]
         
-        # Create mapping for quick lookup
-        face_id_to_identity = {face["face_id"]: face for face in face_identities}
+        # Update stats
+        customer_stats[face_id]["visit_count"] += 1
+        customer_stats[face_id]["visit_days"].add(timestamp.date())
         
-        # Compute visit statistics for each face ID
+        # Update last visit
+        last_visit = customer_stats[face_id]["last_visit"]
+        if last_visit is None or timestamp > last_visit:
+            customer_stats[face_id]["last_visit"] = timestamp
+    
+    def customer_visit_stats(self, face_events):
+        """Visit count, visit days and last visit of each face_id in face_events"""
         customer_stats = {}
         for event in face_events:
-            face_id = event["face_id"]
-            timestamp = event["timestamp"]
-            
-            if face_id not in customer_stats:
-                customer_stats[face_id] = {
-                    "visit_count": 0, 
-                    "visit_days": set(), 
-                    "last_visit": None
-                }
-            
-            # Update stats
-            customer_stats[face_id]["visit_count"] += 1
-            customer_stats[face_id]["visit_days"].add(timestamp.date())
-            
-            # Update last visit
-            last_visit = customer_stats[face_id]["last_visit"]
-            if last_visit is None or timestamp > last_visit:
-                customer_stats[face_id]["last_visit"] = timestamp
+            self.add_visit(customer_stats, event)
+        return customer_stats
+    
+    def top_customers(self, customer_stats, limit):
+        """
+        Keep the limit best customers with a bounded heap instead of a full sort
         
-        # Sort customers by visit count (descending)
-        sorted_customers = sorted(
+        Returns:
+        - (ranked customers, whether more customers exist)
+        """
+        # Same order as the $sort of build_ranking_pipeline, face_id breaking ties
+        top = heapq.nsmallest(
+            limit + 1,
             customer_stats.items(),
-            key=lambda x: (x[1]["visit_count"], len(x[1]["visit_days"])),
-            reverse=True
+            key=lambda x: (-x[1]["visit_count"], -len(x[1]["visit_days"]), x[0])
         )
+        ranked = [
+            {
+                "face_id": face_id,
+                "visit_count": stats["visit_count"],
+                "visit_days": len(stats["visit_days"]),
+                "last_visit": stats["last_visit"]
+            }
+            for face_id, stats in top[:limit]
+        ]
+        return ranked, len(top) > limit
+    
+    def format_ranking(self, ranked, face_identities, has_more, limit, start_datetime):
+        """
+        Build the metric response from ranked customers
         
-        # Limit number of customers returned
-        top_customers = sorted_customers[:limit]
-        has_more = len(sorted_customers) > limit
+        Parameters:
+        - ranked: Customers in rank order with face_id, visit_count, visit_days and last_visit
+        - face_identities: Identities of (at least) the ranked faces
+        - has_more: Whether customers beyond limit exist
+        - limit: Number of customers requested
+        - start_datetime: Start of the query range
+        """
+        # Create mapping for quick lookup
+        face_id_to_identity = {face["face_id"]: face for face in face_identities}
         
         # Format results
         results = []
-        for face_id, stats in top_customers:
+        for customer in ranked:
             # Get customer info from face_identities
-            identity = face_id_to_identity.get(face_id, {})
+            identity = face_id_to_identity.get(customer["face_id"], {})
+            last_visit = self.ensure_timezone(customer["last_visit"])
             
             # Create customer info object
             customer_info = {
-                "user_id": face_id,
+                "user_id": customer["face_id"],
                 "name": identity.get("username", "Unknown"),
                 "age": identity.get("metadata", {}).get("age", 30),
                 "gender": identity.get("metadata", {}).get("gender", 0),
                 "visits": {
-                    "count": stats["visit_count"],
-                    "days": len(stats["visit_days"])
+                    "count": customer["visit_count"],
+                    "days": customer["visit_days"]
                 },
-                "last_visit": stats["last_visit"].isoformat() if stats["last_visit"] else None
+                "last_visit": last_visit.isoformat() if last_visit else None
             }
             
             results.append(customer_info)
@@ -222,6 +182,107 @@ class TopCustomerMetric:
             "results": results,
             "metadata": metadata
         }
+    
+    def rank_customers(self, customer_stats, face_identities, limit, start_datetime):
+        """
+        Rank customers by visits client-side and build the metric response
+        
+        Parameters:
+        - customer_stats: Visit stats of the query range from customer_visit_stats
+        - face_identities: Identities of (at least) the faces in customer_stats
+        - limit: Number of customers to return
+        - start_datetime: Start of the query range
+        """
+        ranked, has_more = self.top_customers(customer_stats, limit)
+        return self.format_ranking(ranked, face_identities, has_more, limit, start_datetime)
+    
+    def pipeline_ranking(self, mongo_client, db_name, camera_ids, start_datetime, due_datetime, limit):
+        """Rank customers with build_ranking_pipeline, None if the aggregation fails"""
+        rows = mongo_client.aggregate(
+            db_name=db_name,
+            col_name="face_events",
+            query=self.build_ranking_pipeline(camera_ids, start_datetime, due_datetime, limit)
+        )
+        if not rows["status"]:
+            return None
+        rows = rows["result"]
+        ranked = [
+            {
+                "face_id": row["_id"],
+                "visit_count": row["visit_count"],
+                "visit_days": row["visit_days"],
+                "last_visit": row["last_visit"]
+            }
+            for row in rows[:limit]
+        ]
+        face_identities = [row["identity"][0] for row in rows[:limit] if row["identity"]]
+        return self.format_ranking(ranked, face_identities, len(rows) > limit, limit, start_datetime)
+    
+    def stream_ranking(self, mongo_client, db_name, camera_ids, start_datetime, due_datetime, limit, batch_size=1000, fetch_workers=1):
+        """Rank customers client-side from a streamed event scan, reading identities of the winners only"""
+        face_events = fetch_face_events(
+            mongo_client, db_name, {"camera_id": {"$in": camera_ids}},
+            start_datetime, due_datetime,
+            projection=self.face_event_fields,
+            batch_size=batch_size,
+            workers=fetch_workers
+        )
+        ranked, has_more = self.top_customers(self.customer_visit_stats(face_events), limit)
+        
+        face_identities = []
+        if ranked:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": [customer["face_id"] for customer in ranked]}
+                },
+                projection=self.face_identity_fields
+            )["result"]
+        return self.format_ranking(ranked, face_identities, has_more, limit, start_datetime)
+    
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        """Run the top customer metric calculation"""
+        # Connect to MongoDB
+        mongo_client = MongoDB()
+        mongo_client.setup_db(
+            username=kwargs.get("username", ""),
+            password=kwargs.get("password", ""),
+            host=kwargs["host"],
+            port=kwargs["port"],
+            auth=kwargs.get("auth", "admin"),
+        )
+        
+        # Validate base_time parameter
+        valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
+        if kwargs["param_baseTime"] not in valid_base_times:
+            raise ValueError(f"Invalid base_time: {kwargs['param_baseTime']}. Must be one of {valid_base_times}")
+        
+        # Validate limit parameter
+        limit = int(kwargs.get("param_limit", 5))
+        if limit <= 0:
+            raise ValueError("Limit must be a positive number")
+        
+        # Timestamps arrive parsed by ValidateParams
+        start_datetime = self.ensure_timezone(kwargs["param_startTime"])
+        due_datetime = self.ensure_timezone(kwargs["param_dueTime"])
+        
+        # Parse camera IDs
+        camera_ids = CameraTopology.camera_ids(mongo_client, kwargs["db"], kwargs["param_groupIds"])
+        
+        # "pipeline" ranks on the server, "stream" (and the fallback when the aggregation fails) on the client
+        result = None
+        if kwargs.get("engine", "pipeline") == "pipeline":
+            result = self.pipeline_ranking(
+                mongo_client, kwargs["db"], camera_ids, start_datetime, due_datetime, limit
+            )
+        if result is None:
+            result = self.stream_ranking(
+                mongo_client, kwargs["db"], camera_ids, start_datetime, due_datetime, limit,
+                kwargs.get("batch_size", 1000), kwargs.get("fetch_workers", 1)
+            )
+        return result
 
 
 class ClassSerializer:
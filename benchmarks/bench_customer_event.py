@@ -0,0 +1,97 @@
+"""
+Page latency of the CustomerEvent listings by page size
+
+Runs script.CustomerEvent and employee_event.CustomerEvent against a live
+MongoDB and reports, per page size, the median latency and the number of
+face_events finds issued for one page. With the batched last-event lookup
+the find count stays at one per 500 identities instead of one per identity.
+
+Usage:
+    python benchmarks/bench_customer_event.py --host localhost --port 27017 --groups CG-1 CG-2
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import MongoDB
+import employee_event
+import script
+
+
+class FindCounter:
+    """Count MongoDB.find calls on face_events while active"""
+
+    def __init__(self):
+        self.count = 0
+        self.find = MongoDB.find
+
+    def __enter__(self):
+        find = self.find
+
+        def counting_find(cls, *args, **kwargs):
+            if kwargs.get("col_name") == "face_events":
+                self.count += 1
+            return find.__func__(cls, *args, **kwargs)
+
+        MongoDB.find = classmethod(counting_find)
+        return self
+
+    def __exit__(self, *exc):
+        MongoDB.find = self.find
+
+
+def bench(module, params, page_sizes, repeat):
+    for page_size in page_sizes:
+        page_params = dict(params, params_page=1, params_pageSize=page_size)
+        module.CustomerEvent().run(**page_params)
+        latencies = []
+        with FindCounter() as counter:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                module.CustomerEvent().run(**page_params)
+                latencies.append(time.perf_counter() - started)
+        print(
+            f"{module.__name__:<16} page_size={page_size:<5} "
+            f"median={statistics.median(latencies) * 1000:8.1f} ms  "
+            f"face_events finds/page={counter.count / repeat:.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CustomerEvent page latency")
+    parser.add_argument("--host", default="localhost", help="MongoDB host")
+    parser.add_argument("--port", type=int, default=27017, help="MongoDB port")
+    parser.add_argument("--db", default="distill_db", help="Database name")
+    parser.add_argument("--username", default="", help="MongoDB username")
+    parser.add_argument("--password", default="", help="MongoDB password")
+    parser.add_argument("--groups", nargs="+", default=["CG-1"], help="Camera group ids")
+    parser.add_argument("--date-from", default="2024-01-01T00:00:00", help="Visit range start")
+    parser.add_argument("--date-to", default="2025-12-31T23:59:59", help="Visit range end")
+    parser.add_argument("--page-sizes", nargs="+", type=int, default=[10, 50, 100, 200])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per page size")
+    args = parser.parse_args()
+
+    params = {
+        "username": args.username,
+        "password": args.password,
+        "host": args.host,
+        "port": args.port,
+        "db": args.db,
+        "auth": "admin",
+        "params_search": "",
+        "params_sortBy": "visit_count",
+        "params_order": "desc",
+        "params_groupIds": args.groups,
+        "params_visitDateFrom": args.date_from,
+        "params_visitDateTo": args.date_to
+    }
+    for module in (script, employee_event):
+        bench(module, params, args.page_sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Per-call overhead of ValidateParams
+
+Times a decorated no-op run() with the parameters of a metric call, once
+with the validator compiled and cached per class and once compiling it on
+every call, as the per-module decorators did with get_type_hints. No MongoDB
+is needed.
+
+Usage:
+    python benchmarks/bench_validation.py --calls 100000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import ValidateParams
+
+
+class Report:
+    param_startTime: datetime.datetime
+    param_dueTime: datetime.datetime
+    param_groupIds: list
+
+    def __init__(self):
+        self.required_params = ["param_startTime", "param_dueTime", "param_groupIds", "host", "port"]
+
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        return kwargs["param_startTime"]
+
+
+class UncachedValidateParams(ValidateParams):
+    """Compiles the validator on every call"""
+
+    def validator(self, instance):
+        self.validators.clear()
+        return super().validator(instance)
+
+
+class UncachedReport(Report):
+    @UncachedValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        return kwargs["param_startTime"]
+
+
+def bench(name, report, params, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        report.run(**params)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {elapsed / calls * 1e6:8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ValidateParams per-call overhead")
+    parser.add_argument("--calls", type=int, default=100000, help="Timed calls per variant")
+    args = parser.parse_args()
+
+    params = {
+        "host": "localhost",
+        "port": 27017,
+        "db": "distill_db",
+        "param_groupIds": ["CG-1", "CG-2"],
+        "param_baseTime": "daily",
+        "param_startTime": "2025-02-15T23:59:59.999Z",
+        "param_dueTime": "2025-02-21T23:59:59.999Z"
+    }
+    bench("cached", Report(), params, args.calls)
+    bench("uncached", UncachedReport(), params, args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Iterable, Optional, Tuple
+import datetime
+import threading
+
+from db import MongoDB
+from time_buckets import as_utc
+
+
+class BlockResultCache:
+    """
+    Process-wide cache of per-block stats for closed time blocks
+
+    A block whose end lies in the past (plus a grace period for ingestion lag)
+    never changes, so its stats are cached under (database key, metric,
+    canonical camera set, block from, block to, base_time) and only
+    the blocks that are still open or not cached yet are recomputed. Entries
+    are evicted least recently used beyond max_entries and dropped by
+    invalidate() when late-arriving events are ingested for a closed block;
+    writes to face_events, and to the face_identities fields the stats
+    depend on, are invalidated automatically via invalidate_on_write.
+    """
+    max_entries = 50000
+    # Blocks are only cached once they ended at least this long ago
+    closed_grace = datetime.timedelta(minutes=5)
+    # face_identities fields the cached stats depend on -> metrics reading them, None for all
+    identity_dependencies = {
+        "first_seen": None,
+        "labels": ("EmployeeCountMetric",),
+    }
+
+    _entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, max_entries: Optional[int] = None, closed_grace: Optional[datetime.timedelta] = None):
+        """Set the cache size and the grace period before a block counts as closed"""
+        with cls._lock:
+            if max_entries is not None:
+                cls.max_entries = max_entries
+            if closed_grace is not None:
+                cls.closed_grace = closed_grace
+            while len(cls._entries) > cls.max_entries:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def make_key(cls, db_name: str, metric: str, camera_ids: Iterable[str], block: Dict[str, datetime.datetime], base_time: str) -> Tuple:
+        return (
+            MongoDB.database_key(db_name),
+            metric,
+            tuple(sorted(set(camera_ids))),
+            as_utc(block["from"], naive=True),
+            as_utc(block["to"], naive=True),
+            base_time
+        )
+
+    @classmethod
+    def is_closed(cls, block: Dict[str, datetime.datetime], now: Optional[datetime.datetime] = None) -> bool:
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return as_utc(block["to"], naive=False) + cls.closed_grace <= as_utc(now, naive=False)
+
+    @classmethod
+    def get(cls, key: Tuple) -> Optional[Dict[str, Any]]:
+        with cls._lock:
+            block_stats = cls._entries.get(key)
+            if block_stats is not None:
+                cls._entries.move_to_end(key)
+            return block_stats
+
+    @classmethod
+    def put(cls, key: Tuple, block_stats: Dict[str, Any]):
+        with cls._lock:
+            cls._entries[key] = block_stats
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > cls.max_entries:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def cached_block_stats(
+            cls,
+            db_name: str,
+            metric: str,
+            camera_ids: List[str],
+            time_blocks: List[Dict[str, datetime.datetime]],
+            base_time: str,
+            compute: Callable[[List[Dict[str, datetime.datetime]]], Dict[str, Any]]
+        ) -> Dict[str, Any]:
+        """
+        Block stats for time_blocks, computing only the blocks missing from the cache
+
+        Engines take contiguous blocks, so one compute() call covers the span
+        from the first to the last missing block; in the common "last N days"
+        refresh that span is just the open block.
+
+        Parameters:
+        - db_name: Database the events are read from
+        - metric: Name of the metric, usually its class name
+        - camera_ids: Cameras whose events are counted
+        - time_blocks: Blocks from generate_time_blocks
+        - base_time: Time unit the blocks were generated with
+        - compute: Callable returning block stats for a contiguous sub-list of time_blocks
+
+        Returns:
+        - Block stats in the same shape as TimeBucketPipeline.run. distinct_faces
+          is the size of the union of the block faces when the engine returns
+          them and None otherwise, since it cannot be merged from counts.
+        """
+        keys = [cls.make_key(db_name, metric, camera_ids, block, base_time) for block in time_blocks]
+        blocks = [cls.get(key) for key in keys]
+        missing = [index for index, block_stats in enumerate(blocks) if block_stats is None]
+
+        computed = None
+        if missing:
+            first, last = missing[0], missing[-1] + 1
+            computed = compute(time_blocks[first:last])
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for offset, block_stats in enumerate(computed["blocks"]):
+                index = first + offset
+                blocks[index] = block_stats
+                if cls.is_closed(time_blocks[index], now):
+                    cls.put(keys[index], block_stats)
+
+        if computed is not None and len(missing) == len(time_blocks):
+            distinct_faces = computed["distinct_faces"]
+        elif all("faces" in block_stats for block_stats in blocks):
+            distinct_faces = len(set().union(*(block_stats["faces"] for block_stats in blocks)))
+        else:
+            distinct_faces = None
+        return {
+            "blocks": [dict(block_stats) for block_stats in blocks],
+            "distinct_faces": distinct_faces
+        }
+
+    @classmethod
+    def invalidate(
+            cls,
+            camera_ids: Optional[Iterable[str]] = None,
+            since: Optional[datetime.datetime] = None,
+            until: Optional[datetime.datetime] = None,
+            metric: Optional[str] = None,
+            db_name: Optional[str] = None
+        ) -> int:
+        """
+        Drop cached blocks, e.g. after late events were ingested
+
+        Parameters:
+        - camera_ids: Only blocks whose camera set contains one of these cameras
+        - since / until: Only blocks overlapping [since, until]
+        - metric: Only blocks of this metric
+        - db_name: Only blocks of this database on the connected target
+
+        Returns:
+        - Number of dropped entries
+        """
+        database_key = MongoDB.database_key(db_name) if db_name is not None else None
+        camera_ids = set(camera_ids) if camera_ids is not None else None
+        since = as_utc(since, naive=True) if since is not None else None
+        until = as_utc(until, naive=True) if until is not None else None
+        with cls._lock:
+            stale = [
+                key for key in cls._entries
+                if (database_key is None or key[0] == database_key)
+                and (metric is None or key[1] == metric)
+                and (camera_ids is None or not camera_ids.isdisjoint(key[2]))
+                and (since is None or key[4] > since)
+                and (until is None or key[3] <= until)
+            ]
+            for key in stale:
+                del cls._entries[key]
+        return len(stale)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def invalidate_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """
+        MongoDB write listener dropping blocks touched by face_events writes
+
+        Inserted events invalidate the blocks of their camera and timestamp.
+        Updates and deletes are matched by query and cannot be located, so
+        they drop every cached block of the database. face_identities writes
+        are handled by invalidate_identities.
+        """
+        if col_name == "face_identities":
+            cls.invalidate_identities(db_name, query, documents)
+            return
+        if col_name != "face_events":
+            return
+        if query is None and documents:
+            for document in documents:
+                timestamp = document.get("timestamp")
+                if not isinstance(timestamp, datetime.datetime):
+                    cls.invalidate(db_name=db_name)
+                    return
+                camera_ids = [document["camera_id"]] if document.get("camera_id") is not None else None
+                cls.invalidate(camera_ids=camera_ids, since=timestamp, until=timestamp, db_name=db_name)
+            return
+        cls.invalidate(db_name=db_name)
+
+    @classmethod
+    def invalidate_identities(cls, db_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """
+        Drop the blocks of the metrics reading the written face_identities fields
+
+        A relabelled face or a changed first_seen can move a face between
+        new, returning and staff in any block, so updates drop every block of
+        the dependent metrics. An inserted identity only affects blocks from
+        its first_seen on. Deletes carry no documents and drop every block of
+        the database.
+        """
+        if not documents:
+            cls.invalidate(db_name=db_name)
+            return
+        for document in documents:
+            fields = {key.split(".")[0] for key in document} & cls.identity_dependencies.keys()
+            if not fields:
+                continue
+            first_seen = document.get("first_seen")
+            since = first_seen if query is None and isinstance(first_seen, datetime.datetime) else None
+            metrics = [cls.identity_dependencies[field] for field in fields]
+            if None in metrics:
+                cls.invalidate(since=since, db_name=db_name)
+                continue
+            for metric in set().union(*metrics):
+                cls.invalidate(since=since, metric=metric, db_name=db_name)
+
+
+MongoDB.add_write_listener(BlockResultCache.invalidate_on_write)
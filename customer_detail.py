@@ -1,55 +1,18 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
 import datetime
 import inspect
 from db import MongoDB
+from detail_events import group_events
+from topology_cache import CameraTopology
+from validation import ValidateParams
 
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-    
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime and isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-    
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                    setattr(instance, key, value)
-                    
-            return func(instance, *args, **kwargs)
-        return wrapper
-    
 class CustomerDetail:
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    visitDateFrom: datetime.datetime
+    visitDateTo: datetime.datetime
+    groupIds: list
+    # Fields read by this class, used as query projections
+    face_identity_fields = {"_id": 0, "last_seen": 1}
+
     def __init__(self):
         self.required_params = ["id", "trackId", "groupIds", "host", "port"]
 
@@ -64,29 +27,13 @@ class CustomerDetail:
             auth=kwargs["auth"]
         )
         
-        # Query groups
-        group_list = []
-        for group_id in kwargs.get("groupIds", []):
-            group_query = mongo_client.find(
-                db_name= kwargs["db"],
-                col_name= "cam_groups",
-                query= {
-                    "group_id": group_id
-                }
-            )["result"]
-            group_list.extend(list(group_query))
-
-        # Query cameras
+        # Query groups and cameras from the topology cache
+        group_list = CameraTopology.groups(mongo_client, kwargs["db"], kwargs.get("groupIds", []))
+        group_camera_ids = CameraTopology.group_camera_ids(mongo_client, kwargs["db"], kwargs.get("groupIds", []))
+
         cameras_group_lists = []
         for group_id in kwargs.get("groupIds", []):
-            cameras_query = mongo_client.find(
-                db_name=kwargs["db"],
-                col_name="cameras",
-                query={
-                    "group_id": group_id
-                }
-            )["result"]
-            cameras_list = list(cameras_query)
+            cameras_list = [{"camera_id": camera_id} for camera_id in group_camera_ids[group_id]]
             for group in group_list:
                 if group.get("group_id") == group_id:
                     group_name = group.get("name")
@@ -103,40 +50,53 @@ class CustomerDetail:
             "dates": []
         }
 
-        # Query events
+        # Query this face's events and visits of all groups at once, optionally one page per group
+        gap = None
+        if kwargs.get("visitGapMinutes") is not None:
+            gap = datetime.timedelta(minutes=float(kwargs.get("visitGapMinutes")))
+        event_page_size = kwargs.get("eventPageSize")
+        skip, limit = 0, None
+        if event_page_size is not None:
+            limit = int(event_page_size)
+            skip = (int(kwargs.get("eventPage", 1)) - 1) * limit
+        events_by_group, visits = group_events(
+            mongo_client,
+            kwargs["db"],
+            kwargs.get("id"),
+            {
+                cameras_group_list.get('group_id'): [camera.get("camera_id") for camera in cameras_group_list.get('cameras')]
+                for cameras_group_list in cameras_group_lists
+            },
+            kwargs.get("visitDateFrom"),
+            kwargs.get("visitDateTo"),
+            skip,
+            limit,
+            gap
+        )
         for cameras_group_list in cameras_group_lists:
-            cameras_list = cameras_group_list.get('cameras')
-            camera_ids = [camera.get("camera_id") for camera in cameras_list]
-            face_events_query = mongo_client.find(
-                db_name=kwargs["db"],
-                col_name="face_events",
-                query={
-                    "camera_id": {"$in": camera_ids},
-                    "timestamp": {
-                        "$gte": datetime.datetime.fromisoformat(kwargs.get("visitDateFrom")),
-                        "$lte": datetime.datetime.fromisoformat(kwargs.get("visitDateTo"))
-                    }
-                }
-            )['result']
-            face_events_query = list(face_events_query)
-
-            for face_event in face_events_query:
-                face_event["timestamp"] = face_event.get("timestamp").strftime("%Y-%m-%d %H:%M:%S")
-
-            result["visitCount"] += len(face_events_query)
+            events = events_by_group[cameras_group_list.get('group_id')]
+
+            result["visitCount"] += events["count"]
             result["dates"].append({
                 "groupId": cameras_group_list.get('group_id'),
                 "groupName": cameras_group_list.get('group_name'),
-                'events': face_events_query
+                "eventCount": events["count"],
+                'events': events["events"]
             })
 
+        # Average visit duration from the face's events split into visits
+        if visits["count"]:
+            average_seconds = visits["dwell_seconds"] / visits["count"]
+            result["averageVisit"] = f"{round(average_seconds / 60)} minutes"
+
         # Query face identity
         face_identity_query = mongo_client.find(
             db_name=kwargs["db"],
             col_name="face_identities",
             query={
                 "face_id": kwargs.get("id")
-            }
+            },
+            projection=self.face_identity_fields
         )['result']
 
         face_identity_query = list(face_identity_query)
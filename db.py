@@ -1,13 +1,218 @@
+import atexit
+import hashlib
+import threading
+import time
 import pymongo
 import traceback
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from pymongo import MongoClient
 
 
+class MongoClientRegistry:
+    """Process-wide registry of long-lived pooled MongoClient instances.
+
+    One client is kept per (host, port, username, password digest, authSource)
+    target so that repeated metric runs reuse warm connections instead of
+    paying the TCP, handshake and SCRAM auth cost on every request. Clients
+    handed out are counted in use until released and are never evicted
+    while in use.
+    """
+    pool_options = {
+        "maxPoolSize": 100,
+        "minPoolSize": 0,
+        "maxIdleTimeMS": 300000,
+    }
+    idle_timeout = 1800
+    _clients: Dict[Tuple, MongoClient] = {}
+    _last_used: Dict[Tuple, float] = {}
+    _in_use: Dict[Tuple, int] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(
+            cls,
+            max_pool_size: Optional[int] = None,
+            min_pool_size: Optional[int] = None,
+            max_idle_time_ms: Optional[int] = None,
+            idle_timeout: Optional[float] = None
+        ):
+        """Configure pool sizes and idle eviction for clients created afterwards.
+
+        Args:
+            max_pool_size (int): Maximum connections per client pool
+            min_pool_size (int): Connections kept open per client pool
+            max_idle_time_ms (int): Idle time before a pooled connection is closed
+            idle_timeout (float): Seconds a client may go unused before it is evicted
+        """
+        if max_pool_size is not None:
+            cls.pool_options["maxPoolSize"] = max_pool_size
+        if min_pool_size is not None:
+            cls.pool_options["minPoolSize"] = min_pool_size
+        if max_idle_time_ms is not None:
+            cls.pool_options["maxIdleTimeMS"] = max_idle_time_ms
+        if idle_timeout is not None:
+            cls.idle_timeout = idle_timeout
+
+    @classmethod
+    def get_client(
+            cls,
+            host: str,
+            port: int,
+            username: str,
+            password: str,
+            auth: str
+        ) -> MongoClient:
+        """Return the pooled client for a target, creating it on first use.
+
+        The client counts as in use until it is passed to release().
+
+        Args:
+            host (str): MongoDB host
+            port (int): MongoDB port
+            username (str): MongoDB username
+            password (str): MongoDB password
+            auth (str): Authentication database, None to use the default
+
+        Returns:
+            MongoClient: Shared client for the target
+        """
+        # Only a digest of the password is kept, a changed password gets a new client
+        password_digest = hashlib.sha256((password or "").encode()).hexdigest()
+        key = (host, port, username, password_digest, auth)
+        now = time.monotonic()
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                options = dict(cls.pool_options)
+                if auth is not None:
+                    options["authSource"] = auth
+                client = MongoClient(host=host,
+                                     port=port,
+                                     username=username,
+                                     password=password,
+                                     **options)
+                cls._clients[key] = client
+            cls._last_used[key] = now
+            cls._in_use[key] = cls._in_use.get(key, 0) + 1
+            cls._evict_idle_locked(now)
+        return client
+
+    @classmethod
+    def release(cls, client: MongoClient):
+        """Stop using a client from get_client, its idle time starts now.
+
+        Args:
+            client (MongoClient): Client returned by get_client
+        """
+        with cls._lock:
+            for key, pooled_client in cls._clients.items():
+                if pooled_client is not client:
+                    continue
+                if cls._in_use.get(key, 0) > 1:
+                    cls._in_use[key] -= 1
+                else:
+                    cls._in_use.pop(key, None)
+                cls._last_used[key] = time.monotonic()
+                return
+
+    @classmethod
+    def evict_idle(cls, idle_timeout: Optional[float] = None) -> int:
+        """Close clients not in use that have been idle for idle_timeout seconds.
+
+        Args:
+            idle_timeout (float): Override for the configured idle timeout
+
+        Returns:
+            int: Number of evicted clients
+        """
+        with cls._lock:
+            return cls._evict_idle_locked(time.monotonic(), idle_timeout=idle_timeout)
+
+    @classmethod
+    def _evict_idle_locked(
+            cls,
+            now: float,
+            idle_timeout: Optional[float] = None
+        ) -> int:
+        timeout = cls.idle_timeout if idle_timeout is None else idle_timeout
+        expired = [
+            key for key, last_used in cls._last_used.items()
+            if now - last_used > timeout
+            and key not in cls._in_use
+        ]
+        for key in expired:
+            cls._last_used.pop(key)
+            cls._clients.pop(key).close()
+        return len(expired)
+
+    @classmethod
+    def close_all(cls):
+        """Close every pooled client. Registered as an atexit shutdown hook."""
+        with cls._lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients.clear()
+            cls._last_used.clear()
+            cls._in_use.clear()
+        MongoDB.client = None
+        MongoDB.target = None
+
+
 class MongoDB:
     client = None
+    # (host, port) the client is connected to
+    target = None
     logger = None
+    # Callables notified after successful writes as listener(db_name, col_name, query, documents)
+    write_listeners = []
+    # Serializes swapping the shared client in setup_db
+    _setup_lock = threading.Lock()
+
+    @classmethod
+    def add_write_listener(cls, listener):
+        if listener not in cls.write_listeners:
+            cls.write_listeners.append(listener)
+
+    @classmethod
+    def remove_write_listener(cls, listener):
+        if listener in cls.write_listeners:
+            cls.write_listeners.remove(listener)
+
+    @classmethod
+    def database_key(cls, db_name: str) -> Tuple:
+        """Key of db_name on the connected target, for caches shared by several targets
+
+        Args:
+            db_name (str): Database name
+
+        Returns:
+            Tuple: (host, port, db_name)
+        """
+        host, port = cls.target if cls.target is not None else (None, None)
+        return (host, port, db_name)
+
+    @classmethod
+    def notify_write(
+            cls,
+            db_name: str,
+            col_name: str,
+            query: Optional[dict] = None,
+            documents: Optional[List[dict]] = None
+        ):
+        """Call the write listeners, a failing listener never fails the write
+
+        Args:
+            db_name (str): Database written to
+            col_name (str): Collection written to
+            query (dict): Filter of an update or delete, None for inserts
+            documents (List[dict]): Inserted documents or $set values
+        """
+        for listener in list(cls.write_listeners):
+            try:
+                listener(db_name, col_name, query, documents)
+            except Exception:
+                print(f"Write listener failed: {traceback.format_exc()}")
 
     def setup_db(
             self,
@@ -26,28 +231,23 @@ class MongoDB:
             port (int): _description_
             auth (str): _description_
         """        
-        if auth is None:
-            try:
-                self.__class__.client = MongoClient(host=host,
-                                                    port=port,
-                                                    username=username,
-                                                    password=password)
-                self.logger.success("Initialize mongodb success")
-            except Exception as e:
-                print(f"Initialize mongodb fail with following error: {e}")
-                
-                # self.logger.error(f"Initialize mongodb fail with following error: {e}")
-        else:
-            try:
-                self.__class__.client = MongoClient(host=host,
-                                                    port=port,
-                                                    username=username,
-                                                    password=password,
-                                                    authSource=auth)
+        try:
+            with self._setup_lock:
+                previous_client = self.__class__.client
+                self.__class__.client = MongoClientRegistry.get_client(host=host,
+                                                                       port=port,
+                                                                       username=username,
+                                                                       password=password,
+                                                                       auth=auth)
+                self.__class__.target = (host, port)
+                # The previous client stays pooled but may now be evicted when idle
+                if previous_client is not None:
+                    MongoClientRegistry.release(previous_client)
+            if self.logger is not None:
                 self.logger.success("Initialize mongodb success")
-            except Exception as e:
-                print(f"Initialize mongodb fail with following error: {e}")
-                # self.logger.error(f"Initialize mongodb fail with following error: {e}")   
+        except Exception as e:
+            print(f"Initialize mongodb fail with following error: {e}")
+            # self.logger.error(f"Initialize mongodb fail with following error: {e}")
 
     @classmethod
     def insert_one(
@@ -69,6 +269,7 @@ class MongoDB:
         col = self.client[db_name][col_name]
         try:
             col.insert_one(document)
+            self.notify_write(db_name, col_name, documents=[document])
             return {
                 "status": True
             }
@@ -99,6 +300,7 @@ class MongoDB:
         col = self.client[db_name][col_name]
         try:
             col.insert_many(documents)
+            self.notify_write(db_name, col_name, documents=documents)
             return {
                 "status": True,
             }
@@ -164,6 +366,7 @@ class MongoDB:
             if col_name in collection_names:
                 col = self.client[db_name][col_name]
                 x = col.delete_one(query) 
+                self.notify_write(db_name, col_name, query=query)
                 return {
                     "status": True
                 }
@@ -199,6 +402,7 @@ class MongoDB:
             if col_name in collection_names:
                 col = self.client[db_name][col_name]
                 x = col.delete_many(query)    
+                self.notify_write(db_name, col_name, query=query)
                 return {
                     "status": True
                 }
@@ -217,7 +421,8 @@ class MongoDB:
             self,
             db_name: str,
             col_name: str,
-            query: str
+            query: str,
+            projection: dict = None
         ):
         """_summary_
 
@@ -225,13 +430,14 @@ class MongoDB:
             db_name (str): _description_
             col_name (str): _description_
             query (str): _description_
+            projection (dict): Fields to return, defaults to the whole document
 
         Returns:
             _type_: _description_
         """        
         try:
             col = self.client[db_name][col_name]
-            result = col.find_one(query)
+            result = col.find_one(query, projection)
             if result:
                 return {
                     "status": True,
@@ -255,7 +461,8 @@ class MongoDB:
             db_name: str,
             col_name: str,
             query: str,
-            sort_data: list = None
+            sort_data: list = None,
+            projection: dict = None
         ):
         """_summary_
 
@@ -263,16 +470,20 @@ class MongoDB:
             db_name (str): _description_
             col_name (str): _description_
             query (str): _description_
+            sort_data (list): Sort specification as (key, direction) pairs
+            projection (dict): Fields to return, defaults to excluding _id
 
         Returns:
             _type_: _description_
         """        
         try:
             col = self.client[db_name][col_name]
+            if projection is None:
+                projection = {"_id": 0}
             if sort_data is not None and len(sort_data)>0:
-                result = list(col.find(query, {"_id": 0}).sort(sort_data))
+                result = list(col.find(query, projection).sort(sort_data))
             else:
-                result = list(col.find(query, {"_id": 0}))
+                result = list(col.find(query, projection))
             if result:
                 return {
                     "status": True,
@@ -290,6 +501,59 @@ class MongoDB:
                 "error": e
             }
         
+    @classmethod
+    def find_iter(
+            self,
+            db_name: str,
+            col_name: str,
+            query: dict,
+            projection: dict = None,
+            sort_data: list = None,
+            batch_size: int = 1000,
+            no_cursor_timeout: bool = False
+        ):
+        """Stream documents from a find cursor instead of materializing a list.
+
+        Args:
+            db_name (str): Database name
+            col_name (str): Collection name
+            query (dict): Filter document
+            projection (dict): Fields to return, defaults to excluding _id
+            sort_data (list): Sort specification as (key, direction) pairs
+            batch_size (int): Documents fetched per getMore round trip
+            no_cursor_timeout (bool): Keep the server cursor alive while a slow
+                consumer works through it. The cursor is always closed once the
+                iterator is exhausted or discarded.
+
+        Returns:
+            dict: status and a lazy iterator of documents in result
+        """
+        try:
+            col = self.client[db_name][col_name]
+            cursor = col.find(query,
+                              projection if projection is not None else {"_id": 0},
+                              no_cursor_timeout=no_cursor_timeout,
+                              batch_size=batch_size)
+            if sort_data is not None and len(sort_data)>0:
+                cursor = cursor.sort(sort_data)
+            return {
+                "status": True,
+                "result": self._iter_cursor(cursor)
+            }
+        except Exception as e:
+            # self.logger.error(f"An exception occurred: {traceback.format_exc()}")
+            return {
+                "status": False,
+                "error": e
+            }
+
+    @staticmethod
+    def _iter_cursor(cursor):
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
     @classmethod
     def aggregate(
             self,
@@ -327,6 +591,48 @@ class MongoDB:
                 "error": e
             }
 
+    @classmethod
+    def aggregate_iter(
+            self,
+            db_name: str,
+            col_name: str,
+            query: List,
+            projection: dict = None,
+            batch_size: int = 1000,
+            allow_disk_use: bool = False
+        ):
+        """Stream aggregation results instead of materializing a list.
+
+        Args:
+            db_name (str): Database name
+            col_name (str): Collection name
+            query (List): Aggregation pipeline
+            projection (dict): Optional $project stage appended to the pipeline
+            batch_size (int): Documents fetched per getMore round trip
+            allow_disk_use (bool): Let blocking stages spill to disk on the server
+
+        Returns:
+            dict: status and a lazy iterator of documents in result
+        """
+        try:
+            col = self.client[db_name][col_name]
+            pipeline = list(query)
+            if projection is not None:
+                pipeline.append({"$project": projection})
+            cursor = col.aggregate(pipeline,
+                                   batchSize=batch_size,
+                                   allowDiskUse=allow_disk_use)
+            return {
+                "status": True,
+                "result": self._iter_cursor(cursor)
+            }
+        except Exception as e:
+            # self.logger.error(f"An exception occurred: {traceback.format_exc()}")
+            return {
+                "status": False,
+                "error": e
+            }
+
     @classmethod
     def update_one(
             self,
@@ -350,6 +656,7 @@ class MongoDB:
         try:
             newvalues = { "$set": document }
             col.update_one(query, newvalues)
+            self.notify_write(db_name, col_name, query=query, documents=[document])
             return {
                 "status": True
             }
@@ -364,20 +671,22 @@ class MongoDB:
     def get_all_data(
             self,
             db_name: str,
-            col_name: str
+            col_name: str,
+            projection: dict = None
         ):         
         """_summary_
 
         Args:
             db_name (str): _description_
             col_name (str): _description_
+            projection (dict): Fields to return, defaults to the whole document
 
         Returns:
             _type_: _description_
         """        
         try:
             col = self.client[db_name][col_name]  
-            result = list(col.find())
+            result = list(col.find({}, projection))
             return result
         except Exception as e:
             # self.logger.error(f"An exception occurred get_all_data: {traceback.format_exc()}")
@@ -408,6 +717,7 @@ class MongoDB:
             if result is not None:
                 newvalues = { "$set": document }
                 col.update_one(query, newvalues)
+                self.notify_write(db_name, col_name, query=query, documents=[document])
                 return True
             else:
                 self.insert_one(db_name=db_name, col_name=col_name, document=document)
@@ -430,6 +740,7 @@ class MongoDB:
             if result is not None:
                 newvalues = { "$set": document }
                 col.update_many(query, newvalues)
+                self.notify_write(db_name, col_name, query=query, documents=[document])
                 return {
                     "status": True
                 }
@@ -466,4 +777,12 @@ def initialize_mongodb(
                  password=password,
                  host=host,
                  port=port,
-                 auth=auth)
\ No newline at end of file
+                 auth=auth)
+
+
+def close_mongodb():
+    """Close all pooled MongoDB clients held by this process."""
+    MongoClientRegistry.close_all()
+
+
+atexit.register(close_mongodb)
@@ -0,0 +1,130 @@
+from typing import Dict, List, Any, Optional, Tuple
+import datetime
+
+from sessionize import Sessionizer, build_session_pipeline
+
+
+# Format of the event timestamps returned by the detail endpoints
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def group_events(
+        mongo_client,
+        db_name: str,
+        face_id: str,
+        group_camera_ids: Dict[str, List[str]],
+        visit_date_from: datetime.datetime,
+        visit_date_to: datetime.datetime,
+        skip: int = 0,
+        limit: Optional[int] = None,
+        gap: Optional[datetime.timedelta] = None
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Events and visits of one face on every group's cameras, read with one query
+
+    The match leads with face_id so only this person's events are read, in
+    timestamp order from the (face_id, timestamp) index. One aggregation
+    returns every group's events from a $facet per group, optionally cut to
+    a page, with timestamps formatted by $dateToString, next to facets with
+    the event count per camera and the visit totals of build_session_pipeline.
+
+    When that aggregation fails, e.g. before MongoDB 5.0 or when a group's
+    events outgrow the 16MB result document, the events are streamed from a
+    sorted find instead, split by group, fed to a Sessionizer and formatted
+    on the client.
+
+    Parameters:
+    - group_camera_ids: {group_id: camera_ids}, a camera listed in several
+      groups belongs to the first one
+    - skip / limit: Page of each group's events, all events when limit is None
+    - gap: Longest pause between two events of the same visit
+
+    Returns:
+    - ({group_id: {"count": number of events, "events": [...]}},
+      {"count": number of visits, "dwell_seconds": total dwell of the visits})
+    """
+    events = {group_id: {"count": 0, "events": []} for group_id in group_camera_ids}
+    visits = {"count": 0, "dwell_seconds": 0}
+    camera_groups = {}
+    for group_id, camera_ids in group_camera_ids.items():
+        for camera_id in camera_ids:
+            camera_groups.setdefault(camera_id, group_id)
+    if not camera_groups:
+        return events, visits
+
+    match = {
+        "face_id": face_id,
+        "camera_id": {"$in": list(camera_groups)},
+        "timestamp": {
+            "$gte": visit_date_from,
+            "$lte": visit_date_to
+        }
+    }
+    sort = {"timestamp": 1, "_id": 1}
+
+    group_ids = list(group_camera_ids)
+    facets = {}
+    for index, group_id in enumerate(group_ids):
+        group_pipeline = [
+            {"$match": {"camera_id": {"$in": [camera_id for camera_id, camera_group in camera_groups.items() if camera_group == group_id]}}},
+            {"$sort": sort}
+        ]
+        if limit is not None:
+            group_pipeline += [{"$skip": skip}, {"$limit": limit}]
+        group_pipeline += [
+            {"$project": {"_id": 0}},
+            {"$set": {"timestamp": {"$dateToString": {"format": TIMESTAMP_FORMAT, "date": "$timestamp"}}}}
+        ]
+        facets[f"group_{index}"] = group_pipeline
+    facets["counts"] = [
+        {"$group": {"_id": "$camera_id", "count": {"$sum": 1}}}
+    ]
+    # The session stages without their leading $match, reduced to totals
+    facets["visits"] = build_session_pipeline(match, gap)[1:] + [
+        {"$group": {"_id": None, "count": {"$sum": 1}, "dwell_seconds": {"$sum": "$dwell_seconds"}}}
+    ]
+    face_events_query = mongo_client.aggregate(
+        db_name=db_name,
+        col_name="face_events",
+        query=[{"$match": match}, {"$facet": facets}]
+    )
+    if face_events_query["status"]:
+        result = face_events_query["result"][0]
+        for camera in result["counts"]:
+            events[camera_groups[camera["_id"]]]["count"] += camera["count"]
+        for index, group_id in enumerate(group_ids):
+            events[group_id]["events"] = result[f"group_{index}"]
+        for totals in result["visits"]:
+            visits = {"count": totals["count"], "dwell_seconds": totals["dwell_seconds"]}
+        return events, visits
+
+    return stream_group_events(mongo_client, db_name, match, sort, camera_groups, events, visits, skip, limit, gap)
+
+
+def stream_group_events(mongo_client, db_name, match, sort, camera_groups, events, visits, skip, limit, gap):
+    """Fallback of group_events reading the events through one sorted find"""
+    face_events_query = mongo_client.find_iter(
+        db_name=db_name,
+        col_name="face_events",
+        query=match,
+        projection={"_id": 0},
+        sort_data=list(sort.items())
+    )
+    if not face_events_query["status"]:
+        raise RuntimeError(f"Failed to read face_events: {face_events_query.get('error')}")
+    sessionizer = Sessionizer(gap)
+
+    def add_visits(closed_visits):
+        for visit in closed_visits:
+            visits["count"] += 1
+            visits["dwell_seconds"] += visit["dwell_seconds"]
+
+    for event in face_events_query["result"]:
+        add_visits(sessionizer.feed(event))
+        group = events[camera_groups[event["camera_id"]]]
+        group["count"] += 1
+        if limit is None or skip < group["count"] <= skip + limit:
+            event["timestamp"] = event["timestamp"].strftime(TIMESTAMP_FORMAT)
+            group["events"].append(event)
+    add_visits(sessionizer.flush())
+    return events, visits
@@ -5,6 +5,7 @@ from pymongo import MongoClient, ASCENDING, DESCENDING
 from pymongo.errors import CollectionInvalid
 from datetime import datetime
 from base import MongoConfig, MongoDB
+from identity_search import IdentitySearch
 
 # Setup logging
 logging.basicConfig(
@@ -55,6 +56,9 @@ def init_face_identities_collection(db: MongoDB):
     collection.create_index([("total_visits", DESCENDING)])
     collection.create_index([("labels", ASCENDING)])
     collection.create_index([("metadata", ASCENDING)])
+    # Multikey index of the metadata search tokens, see IdentitySearch
+    collection.create_index([(IdentitySearch.field, ASCENDING)])
+    IdentitySearch.backfill(collection)
     
     logger.info("Face identities collection initialized")
 
@@ -69,6 +73,9 @@ def init_face_events_collection(db: MongoDB):
     collection.create_index([("face_id", ASCENDING)])
     collection.create_index([("camera_id", ASCENDING)])
     collection.create_index([("timestamp", DESCENDING)])
+    # Per-face range scans, e.g. the staff events of EmployeeCountMetric, the
+    # batched last-event lookups of CustomerEvent and the detail endpoints
+    collection.create_index([("face_id", ASCENDING), ("timestamp", ASCENDING)])
     collection.create_index([("confidence", DESCENDING)])
     collection.create_index([("track_id", ASCENDING)])
     
@@ -90,6 +97,19 @@ def init_daily_stats_collection(db: MongoDB):
     
     logger.info("Daily stats collection initialized")
 
+def init_hourly_rollups_collection(db: MongoDB):
+    """Initialize hourly rollups collection"""
+    collection = db.db['distill_db']['hourly_rollups']
+    
+    # Create indexes
+    collection.create_index([("camera_id", ASCENDING), ("hour", ASCENDING)], unique=True)
+    collection.create_index([("hour", DESCENDING)])
+    
+    # Refresh watermarks per rollup collection
+    db.db['distill_db']['rollup_state'].create_index([("name", ASCENDING)], unique=True)
+    
+    logger.info("Hourly rollups collection initialized")
+
 def init_collections(db: MongoDB) -> bool:
     """Initialize all collections for Distill DB"""
     try:
@@ -99,6 +119,7 @@ def init_collections(db: MongoDB) -> bool:
         init_face_identities_collection(db)
         init_face_events_collection(db)
         init_daily_stats_collection(db)
+        init_hourly_rollups_collection(db)
         
         logger.info("All collections initialized successfully")
         return True
@@ -1,58 +1,123 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
 import datetime
 import inspect
 from db import MongoDB
+from identity_search import IdentitySearch
+from keyset_cursor import decode_cursor, encode_cursor, face_id_bound, keyset_match
+from topology_cache import CameraTopology
+from validation import ValidateParams
 
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime and isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                    setattr(instance, key, value)
-                    
-            return func(instance, *args, **kwargs)
-        return wrapper
-    
 class CustomerEvent:
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    params_visitDateFrom: datetime.datetime
+    params_visitDateTo: datetime.datetime
+    params_groupIds: list
+    # Fields read by this class, used as query projections
+    face_event_fields = {"_id": 0, "face_id": 1, "track_id": 1, "event_id": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "username": 1, "last_seen": 1, "labels": 1, "metadata": 1}
+    # Identities per batched last-event query
+    last_event_batch_size = 500
+
     def __init__(self):
         self.required_params = ["params_visitDateFrom", "params_visitDateTo", "host", "port"]
 
+    def last_events(self, mongo_client, db_name, face_identities):
+        """
+        Event at last_seen of each face identity, keyed by face_id
+
+        One $or query per last_event_batch_size identities replaces a find
+        per identity, every branch is served by the (face_id, timestamp) index.
+        """
+        last_events = {}
+        for offset in range(0, len(face_identities), self.last_event_batch_size):
+            batch = face_identities[offset:offset + self.last_event_batch_size]
+            face_events = mongo_client.find(
+                db_name=db_name,
+                col_name="face_events",
+                query={
+                    "$or": [
+                        {
+                            "face_id": face_identity.get("face_id"),
+                            "timestamp": face_identity.get("last_seen")
+                        }
+                        for face_identity in batch
+                    ]
+                },
+                projection=self.face_event_fields
+            )["result"]
+            for face_event in face_events:
+                # First match wins, as with the former per-identity find
+                last_events.setdefault(face_event.get("face_id"), face_event)
+        return last_events
+
+    def build_rows_pipeline(self, group_camera_ids, visit_date_from, visit_date_to, face_id=None):
+        """
+        Stages producing one row per (face_id, group_id) with its visit count
+
+        The events of all cameras are matched once and grouped by (face_id,
+        group_id), the group of each event coming from a camera -> group
+        mapping inlined into the pipeline. face_id is an optional condition
+        on the events' face_id.
+        """
+        match = {
+            "camera_id": {"$in": [camera_id for camera_ids in group_camera_ids.values() for camera_id in camera_ids]},
+            "timestamp": {
+                "$gte": visit_date_from,
+                "$lte": visit_date_to
+            }
+        }
+        if face_id:
+            match["face_id"] = face_id
+        camera_group = {
+            "$switch": {
+                "branches": [
+                    {"case": {"$in": ["$camera_id", camera_ids]}, "then": group_id}
+                    for group_id, camera_ids in group_camera_ids.items()
+                    if camera_ids
+                ],
+                "default": None
+            }
+        }
+        return [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {"face_id": "$face_id", "group_id": camera_group},
+                    "visit_count": {"$sum": 1}
+                }
+            },
+            {"$project": {"_id": "$_id.face_id", "group_id": "$_id.group_id", "visit_count": 1}}
+        ]
+
+    def build_listing_pipeline(self, group_camera_ids, visit_date_from, visit_date_to, sort_by, order, skip, limit, cursor=None, face_ids=None):
+        """
+        One aggregation listing the faces of every group, sorted and paged on the server
+
+        The rows of build_rows_pipeline are sorted with face_id and group_id
+        breaking ties, and $skip/$limit follow the $sort directly so the
+        server keeps only the top skip + limit rows while sorting. With a
+        decoded keyset cursor the page starts after the cursor's row instead
+        of at skip. face_ids restricts the listing to these faces.
+        """
+        face_id = {}
+        if face_ids is not None:
+            face_id["$in"] = face_ids
+        face_id.update(face_id_bound(sort_by, order, cursor) or {})
+        pipeline = self.build_rows_pipeline(group_camera_ids, visit_date_from, visit_date_to, face_id)
+
+        direction = -1 if order == "desc" else 1
+        sort = {sort_by: direction}
+        sort.setdefault("_id", 1)
+        sort.setdefault("group_id", 1)
+        if cursor is not None:
+            pipeline.append({"$match": keyset_match(sort_by, order, cursor)})
+        pipeline.extend([{"$sort": sort}, {"$skip": skip}, {"$limit": limit}])
+        return pipeline
+
+    def build_total_pipeline(self, group_camera_ids, visit_date_from, visit_date_to, face_ids=None):
+        """Aggregation counting the rows listed by build_listing_pipeline without a cursor"""
+        face_id = {"$in": face_ids} if face_ids is not None else None
+        return self.build_rows_pipeline(group_camera_ids, visit_date_from, visit_date_to, face_id) + [{"$count": "count"}]
+
     @ValidateParams(lambda self: self.required_params)
     def run(self, *args, **kwargs):
         mongo_client = MongoDB()
@@ -64,64 +129,76 @@ class CustomerEvent:
             auth=kwargs["auth"],
         )
 
-        # Query groups
-        group_list = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="cam_groups",
-            query={
-                "group_id": {
-                    "$in": kwargs.get("params_groupIds", [])
-                }
-            }
-        )["result"]
+        # Query groups and cameras from the topology cache
+        group_list = CameraTopology.groups(mongo_client, kwargs["db"], kwargs.get("params_groupIds", []))
+        group_camera_ids = CameraTopology.group_camera_ids(mongo_client, kwargs["db"], kwargs.get("params_groupIds", []))
 
-        # Query cameras
-        camera_group_lists = [
-            {
-                "camera": [
-                    camera for camera in mongo_client.find(
+        # Sorting, pagination and the total run on the server, only the requested page is returned
+        # params_cursor switches to keyset pagination, "" requests the first page
+        cursor_mode = "params_cursor" in kwargs
+        cursor = None
+        next_cursor = None
+        face_events_list = []
+        total = 0
+        if any(group_camera_ids.values()):
+            # Search runs on the indexed search tokens and narrows the listing before pagination
+            search = IdentitySearch.match(kwargs.get("params_search"))
+            face_ids = None
+            if search is not None:
+                face_ids = [
+                    face_identity.get("face_id")
+                    for face_identity in mongo_client.find(
                         db_name=kwargs["db"],
-                        col_name="cameras",
-                        query={"group_id": {"$in": [group_id]}}
+                        col_name="face_identities",
+                        query=search,
+                        projection={"_id": 0, "face_id": 1}
                     )["result"]
-                ], 
-                "group_id": group_id
-            }
-            for group_id in kwargs.get("params_groupIds", [])
-        ]
+                ]
 
-        face_events_list = []
-        total = 0
-        for camera_group_list in camera_group_lists:
-            camera_list = camera_group_list.get("camera")
-            camera_ids = [camera.get("camera_id") for camera in camera_list]
-            face_events_query = mongo_client.aggregate(
+            page_size = int(kwargs.get("params_pageSize"))
+            sort_by = kwargs.get("params_sortBy")
+            order = kwargs.get("params_order")
+            if cursor_mode:
+                if kwargs.get("params_cursor"):
+                    cursor = decode_cursor(kwargs.get("params_cursor"), sort_by, order)
+                # One extra row tells whether there is a next page
+                skip, limit = 0, page_size + 1
+            else:
+                skip, limit = (int(kwargs.get("params_page")) - 1) * page_size, page_size
+            face_events_list = mongo_client.aggregate(
                 db_name=kwargs["db"],
                 col_name="face_events",
-                query=[
-                    {
-                        "$match": {
-                            "camera_id": {"$in": camera_ids},
-                            "timestamp": {
-                                "$gte": datetime.datetime.fromisoformat(kwargs.get("params_visitDateFrom")),
-                                "$lte": datetime.datetime.fromisoformat(kwargs.get("params_visitDateTo"))
-                            }
-                        }
-                    },
-                    {
-                        "$group": {
-                            "_id": "$face_id",
-                            "visit_count": {"$sum": 1},
-                            "group_id": {"$first": camera_group_list.get("group_id")},
-                        }
-                    }
-                ]
+                query=self.build_listing_pipeline(
+                    group_camera_ids,
+                    kwargs.get("params_visitDateFrom"),
+                    kwargs.get("params_visitDateTo"),
+                    sort_by,
+                    order,
+                    skip,
+                    limit,
+                    cursor,
+                    face_ids
+                )
             )["result"]
-            face_events_list.extend(daily_stat for daily_stat in face_events_query)
-
-        total = len(face_events_list)
-        face_events_list.sort(key=lambda x: x.get(kwargs.get("params_sortBy")), reverse=kwargs.get("params_order") == "desc")
-        face_events_list = face_events_list[0:int(kwargs.get("params_pageSize")) * int(kwargs.get("params_page"))]
+            # The rows before a cursor are not read, so keyset pages have no total
+            if cursor is not None:
+                total = None
+            else:
+                totals = mongo_client.aggregate(
+                    db_name=kwargs["db"],
+                    col_name="face_events",
+                    query=self.build_total_pipeline(
+                        group_camera_ids,
+                        kwargs.get("params_visitDateFrom"),
+                        kwargs.get("params_visitDateTo"),
+                        face_ids
+                    )
+                )["result"]
+                if totals:
+                    total = totals[0]["count"]
+            if cursor_mode and len(face_events_list) > page_size:
+                face_events_list = face_events_list[:page_size]
+                next_cursor = encode_cursor(sort_by, order, face_events_list[-1])
         face_id_lists = [daily_stat.get("_id") for daily_stat in face_events_list]
         face_identities_list = mongo_client.find(
             db_name=kwargs["db"],
@@ -130,30 +207,15 @@ class CustomerEvent:
                 "face_id": {
                     "$in": face_id_lists
                 }
-            }
+            },
+            projection=self.face_identity_fields
         )["result"]
 
-        if kwargs.get('params_search') != '':
-            for face_identity in face_identities_list:
-                check = False
-                for value in face_identity.get('metadata').values():
-                    if value == kwargs.get('params_search'):
-                        check = True
-                        break
-                if not check:
-                    face_identities_list.remove(face_identity)
-
+        last_events = self.last_events(mongo_client, kwargs["db"], face_identities_list)
         for face_identity in face_identities_list:
-            face_events_query= mongo_client.find(
-                db_name=kwargs["db"],
-                col_name="face_events",
-                query={
-                    "face_id": face_identity.get("face_id"),
-                    "timestamp": face_identity.get("last_seen")
-                }
-            )["result"][0]
-            face_identity['track_id'] = face_events_query.get('track_id')
-            face_identity['event_id'] = face_events_query.get('event_id')
+            last_event = last_events.get(face_identity.get("face_id"), {})
+            face_identity['track_id'] = last_event.get('track_id')
+            face_identity['event_id'] = last_event.get('event_id')
 
         results_face_event = face_events_list.copy()
         for item in results_face_event:
@@ -180,12 +242,15 @@ class CustomerEvent:
                     item['notes'] = face_identity.get('metadata').get('notes')
                     break
 
-        return {
+        response = {
             "items": results_face_event,
             "total": total,
             "page": kwargs.get("params_page"),
             "pageSize": kwargs.get("params_pageSize")
         }
+        if cursor_mode:
+            response["nextCursor"] = next_cursor
+        return response
 
 
 class ClassSerializer:
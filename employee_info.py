@@ -1,60 +1,50 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
+from typing import Dict, Any, Optional
 import datetime
 import inspect
 from db import MongoDB
+from profile_cache import ProfileCache
+from validation import ValidateParams
 
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime and isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                    setattr(instance, key, value)
-                    
-            return func(instance, *args, **kwargs)
-        return wrapper
-    
 class EmployeeInfo:
+    # Parameter types checked by ValidateParams
+    ids: list
+    # Fields read by this class, used as query projections
+    face_identity_fields = {"_id": 0, "face_id": 1, "username": 1, "labels": 1, "metadata": 1}
+
     def __init__(self):
-        self.required_params = ["id", "host", "port"]
+        self.required_params = ["host", "port"]
+
+    def format_profile(self, face: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Response of one face_identities profile, None for an unknown face"""
+        result = {}
+        if face is not None:
+            metadata = face.get("metadata")
+            result = {
+                "face_id": face.get("face_id"),
+                "username": face.get("username"),
+                "tags": face.get("labels")
+            }
+            result.update(metadata or {})
+        result["id"] = result.pop("face_id", None)
+        result['fullName'] = result.pop('username', None)
+        return result
 
     @ValidateParams(lambda self: self.required_params)
     def run(self, *args, **kwargs):
+        """
+        Profile of one face, or of many at once
+
+        Parameters:
+        - id: face_id of a single lookup
+        - ids: face_ids of a batch lookup, e.g. the rows of a staff table
+        - use_cache: Serve profiles from ProfileCache (default True)
+
+        Returns:
+        - The profile of id, or {face_id: profile} for ids
+        """
+        if "id" not in kwargs and "ids" not in kwargs:
+            raise ValueError("Missing required parameters: id")
+
         mongo_client = MongoDB()
         mongo_client.setup_db(
             username=kwargs["username"],
@@ -63,31 +53,28 @@ class EmployeeInfo:
             port=kwargs["port"],
             auth=kwargs["auth"],
         )
-        
-        # Insert data into MongoDB
 
-        face_query = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="face_identities",
-            query={
-                "face_id": kwargs.get("id")
-            },
-        )["result"]
-        face_list = list(face_query)
+        face_ids = list(kwargs["ids"]) if "ids" in kwargs else [kwargs.get("id")]
+        if kwargs.get("use_cache", True):
+            faces = ProfileCache.get_profiles(mongo_client, kwargs["db"], face_ids)
+        else:
+            # Read every face with one query
+            faces = {face_id: None for face_id in face_ids}
+            face_query = mongo_client.find_iter(
+                db_name=kwargs["db"],
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": face_ids}
+                },
+                projection=self.face_identity_fields
+            )["result"]
+            for face in face_query:
+                if faces.get(face["face_id"]) is None:
+                    faces[face["face_id"]] = face
 
-        result = {}
-        if len(face_list) > 0:
-            face = face_list[0]
-            metadata = face.get("metadata")
-            result = {
-                "face_id": face.get("face_id"),
-                "username": face.get("username"),
-                "tags": face.get("labels")
-            }
-            result.update(metadata)
-        result["id"] = result.pop("face_id", None)
-        result['fullName'] = result.pop('username', None)
-        return result
+        if "ids" not in kwargs:
+            return self.format_profile(faces[face_ids[0]])
+        return {face_id: self.format_profile(face) for face_id, face in faces.items()}
     
 class ClassSerializer:
     @classmethod
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import datetime
+import threading
+import time
+
+from db import MongoDB
+
+
+class IdentitySnapshot:
+    """
+    Process-wide face_id -> (first_seen, labels) snapshot of face_identities
+
+    Metrics only need first_seen and labels of the faces they count, so the
+    snapshot keeps that pair per face_id and serves lookups from memory. Faces
+    missing from the snapshot are loaded with one $in over the misses, faces
+    without an identity are remembered as such. Every refresh_interval
+    seconds the cached entries are refreshed incrementally from the identities
+    whose last_seen or first_seen passed the watermark, and each database
+    holds at most max_entries faces, evicted least recently used.
+    """
+    max_entries = 200000
+    refresh_interval = 60.0
+    # Re-read a little before the watermark to absorb clock skew with the server
+    refresh_overlap = datetime.timedelta(seconds=5)
+    fields = {"_id": 0, "face_id": 1, "first_seen": 1, "last_seen": 1, "labels": 1}
+
+    # Keyed by MongoDB.database_key, same-named databases of other targets stay apart
+    _snapshots: Dict[Tuple, "OrderedDict[str, Optional[tuple]]"] = {}
+    _watermarks: Dict[Tuple, datetime.datetime] = {}
+    _refreshed_at: Dict[Tuple, float] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def configure(cls, max_entries: Optional[int] = None, refresh_interval: Optional[float] = None):
+        with cls._lock:
+            if max_entries is not None:
+                cls.max_entries = max_entries
+            if refresh_interval is not None:
+                cls.refresh_interval = refresh_interval
+            for snapshot in cls._snapshots.values():
+                while len(snapshot) > cls.max_entries:
+                    snapshot.popitem(last=False)
+
+    @classmethod
+    def _now(cls) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    @classmethod
+    def _entry(cls, face: Dict[str, Any]) -> tuple:
+        return (face.get("first_seen"), tuple(face.get("labels") or ()))
+
+    @classmethod
+    def _store(cls, snapshot: "OrderedDict[str, Optional[tuple]]", face_id: str, entry: Optional[tuple]):
+        snapshot[face_id] = entry
+        snapshot.move_to_end(face_id)
+        while len(snapshot) > cls.max_entries:
+            snapshot.popitem(last=False)
+
+    @classmethod
+    def refresh(cls, mongo_client, db_name: str, force: bool = False) -> int:
+        """
+        Apply identity changes since the watermark to the cached entries
+
+        Returns:
+        - Number of cached entries updated
+        """
+        key = MongoDB.database_key(db_name)
+        with cls._lock:
+            if key not in cls._snapshots:
+                cls._snapshots[key] = OrderedDict()
+                cls._watermarks[key] = cls._now()
+                cls._refreshed_at[key] = time.monotonic()
+                return 0
+            if not force and time.monotonic() - cls._refreshed_at[key] < cls.refresh_interval:
+                return 0
+            since = cls._watermarks[key] - cls.refresh_overlap
+            watermark = cls._now()
+
+        changed = mongo_client.find_iter(
+            db_name=db_name,
+            col_name="face_identities",
+            query={"$or": [{"last_seen": {"$gt": since}}, {"first_seen": {"$gt": since}}]},
+            projection=cls.fields
+        )
+        if not changed["status"]:
+            return 0
+
+        updated = 0
+        with cls._lock:
+            snapshot = cls._snapshots.setdefault(key, OrderedDict())
+            for face in changed["result"]:
+                # Only faces already cached are kept current, others load lazily
+                if face["face_id"] in snapshot:
+                    snapshot[face["face_id"]] = cls._entry(face)
+                    updated += 1
+            cls._watermarks[key] = watermark
+            cls._refreshed_at[key] = time.monotonic()
+        return updated
+
+    @classmethod
+    def get_identities(cls, mongo_client, db_name: str, face_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        Identities of face_ids as {"face_id", "first_seen", "labels"} documents
+
+        A drop-in replacement for a face_identities find with a face_id $in,
+        faces without an identity are left out as they would be by the query.
+        """
+        cls.refresh(mongo_client, db_name)
+        key = MongoDB.database_key(db_name)
+        face_ids = list(face_ids)
+
+        found = {}
+        with cls._lock:
+            snapshot = cls._snapshots[key]
+            for face_id in face_ids:
+                if face_id in snapshot:
+                    snapshot.move_to_end(face_id)
+                    found[face_id] = snapshot[face_id]
+        misses = [face_id for face_id in face_ids if face_id not in found]
+
+        if misses:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": misses}
+                },
+                projection=cls.fields
+            )
+            if not face_identities["status"]:
+                raise RuntimeError(f"Failed to load face_identities: {face_identities.get('error')}")
+            loaded = {face["face_id"]: cls._entry(face) for face in face_identities["result"]}
+            with cls._lock:
+                snapshot = cls._snapshots[key]
+                for face_id in misses:
+                    found[face_id] = loaded.get(face_id)
+                    cls._store(snapshot, face_id, found[face_id])
+
+        return [
+            {"face_id": face_id, "first_seen": entry[0], "labels": list(entry[1])}
+            for face_id, entry in found.items()
+            if entry is not None
+        ]
+
+    @classmethod
+    def invalidate(cls, db_name: Optional[str] = None, face_ids: Optional[Iterable[str]] = None):
+        """Drop cached faces, all of them unless face_ids is given"""
+        with cls._lock:
+            keys = [MongoDB.database_key(db_name)] if db_name is not None else list(cls._snapshots)
+            for key in keys:
+                snapshot = cls._snapshots.get(key)
+                if snapshot is None:
+                    continue
+                if face_ids is None:
+                    snapshot.clear()
+                    continue
+                for face_id in face_ids:
+                    snapshot.pop(face_id, None)
+
+    @classmethod
+    def invalidate_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """MongoDB write listener dropping faces changed through face_identities writes"""
+        if col_name != "face_identities":
+            return
+        if query is not None:
+            face_id = query.get("face_id")
+            cls.invalidate(db_name, [face_id] if isinstance(face_id, str) else None)
+            return
+        face_ids = [document.get("face_id") for document in documents or []]
+        if None in face_ids:
+            cls.invalidate(db_name)
+            return
+        cls.invalidate(db_name, face_ids)
+
+
+MongoDB.add_write_listener(IdentitySnapshot.invalidate_on_write)
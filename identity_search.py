@@ -0,0 +1,119 @@
+from typing import Dict, List, Any, Optional
+import re
+
+from pymongo import UpdateOne
+
+from db import MongoDB
+
+
+class IdentitySearch:
+    """
+    Indexed metadata search over face_identities
+
+    Each identity carries search_tokens, the lowercase words of its metadata
+    values plus every whole value, in a multikey index. A search matches the
+    identities holding all words of the search text, so it is answered by the
+    index instead of scanning metadata client-side. Writes through MongoDB
+    that touch metadata refresh the tokens of the written identities.
+    """
+    field = "search_tokens"
+    batch_size = 1000
+    word = re.compile(r"\w+")
+
+    @classmethod
+    def tokens(cls, metadata: Any) -> List[str]:
+        """Sorted search tokens of a metadata document"""
+        tokens = set()
+        values = [metadata]
+        while values:
+            value = values.pop()
+            if isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                values.extend(value)
+            elif value is not None and not isinstance(value, bool):
+                text = str(value).strip().lower()
+                if text:
+                    tokens.add(text)
+                    tokens.update(cls.word.findall(text))
+        return sorted(tokens)
+
+    @classmethod
+    def match(cls, text: str) -> Optional[Dict[str, Any]]:
+        """
+        face_identities filter of a search text, None for an empty search
+
+        Identities with search_tokens match when they hold every word of the
+        text, in any case. Identities written without them, e.g. before the
+        backfill, keep the previous rule: one of their metadata values equals
+        the text exactly.
+        """
+        terms = cls.word.findall((text or "").lower())
+        if not terms:
+            return None
+        return {
+            "$or": [
+                {cls.field: {"$all": terms}},
+                {
+                    cls.field: {"$exists": False},
+                    "$expr": {
+                        "$in": [text, {
+                            "$map": {
+                                "input": {"$objectToArray": {"$ifNull": ["$metadata", {}]}},
+                                "in": "$$this.v"
+                            }
+                        }]
+                    }
+                }
+            ]
+        }
+
+    @classmethod
+    def refresh(cls, collection, query: Dict[str, Any]) -> int:
+        """
+        Recompute search_tokens of the identities matching query
+
+        Parameters:
+        - collection: pymongo face_identities collection, written directly so
+          the token updates do not notify the write listeners again
+
+        Returns:
+        - Number of identities whose tokens changed
+        """
+        updates = []
+        changed = 0
+        for identity in collection.find(query, {"_id": 1, "metadata": 1, cls.field: 1}):
+            tokens = cls.tokens(identity.get("metadata"))
+            if identity.get(cls.field) == tokens:
+                continue
+            updates.append(UpdateOne({"_id": identity["_id"]}, {"$set": {cls.field: tokens}}))
+            if len(updates) == cls.batch_size:
+                changed += collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            changed += collection.bulk_write(updates, ordered=False).modified_count
+        return changed
+
+    @classmethod
+    def backfill(cls, collection) -> int:
+        """Compute search_tokens of every identity, e.g. after creating the index"""
+        return cls.refresh(collection, {})
+
+    @classmethod
+    def refresh_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """MongoDB write listener refreshing tokens of face_identities written with metadata"""
+        if col_name != "face_identities" or MongoDB.client is None:
+            return
+        if not any(
+            key == "metadata" or key.startswith("metadata.")
+            for document in documents or []
+            for key in document
+        ):
+            return
+        if query is None:
+            # Inserts, refreshed by face_id
+            query = {"face_id": {"$in": [document.get("face_id") for document in documents]}}
+        cls.refresh(MongoDB.client[db_name][col_name], query)
+
+
+MongoDB.add_write_listener(IdentitySearch.refresh_on_write)
@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from random import randint, choice
 from pymongo import MongoClient
 from faker import Faker
+from identity_search import IdentitySearch
 
 client = MongoClient("mongodb://localhost:28000/")
 db = client["distill_db"]
@@ -83,6 +84,8 @@ face_identities = [
     }
     for i, face_id in enumerate(face_events_dict.keys(), start=1)
 ]
+for face_identity in face_identities:
+    face_identity[IdentitySearch.field] = IdentitySearch.tokens(face_identity["metadata"])
 
 daily_stats = [
     {
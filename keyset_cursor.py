@@ -0,0 +1,66 @@
+from typing import Dict, Any, Optional
+import base64
+import binascii
+import json
+
+
+def encode_cursor(sort_by: str, order: Optional[str], row: Dict[str, Any]) -> str:
+    """
+    Opaque continuation token for the listing row after which the next page starts
+
+    The token carries the sort it was issued for and the row's
+    (sort key, face_id, group_id), the full ordering key of the listings.
+    """
+    payload = {
+        "sort_by": sort_by,
+        "order": order or "asc",
+        "value": row.get(sort_by),
+        "face_id": row["_id"],
+        "group_id": row.get("group_id")
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(token: str, sort_by: str, order: Optional[str]) -> Dict[str, Any]:
+    """Payload of a token from encode_cursor, which must belong to the same sort"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or not {"sort_by", "order", "value", "face_id", "group_id"} <= set(payload):
+        raise ValueError("Invalid cursor")
+    if payload["sort_by"] != sort_by or payload["order"] != (order or "asc"):
+        raise ValueError("Cursor was issued for a different sort")
+    return payload
+
+
+def keyset_match(sort_by: str, order: Optional[str], cursor: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    $match keeping the listing rows after cursor
+
+    Rows are ordered by sort_by in order, then by whichever of _id and
+    group_id ascending is not the sort key itself.
+    """
+    cursor_values = {sort_by: cursor["value"], "_id": cursor["face_id"], "group_id": cursor["group_id"]}
+    keys = [(sort_by, "$lt" if order == "desc" else "$gt")]
+    keys.extend((key, "$gt") for key in ("_id", "group_id") if key != sort_by)
+
+    # Row is after the cursor when it equals it on a key prefix and is past it on the next key
+    branches = []
+    for index, (key, after) in enumerate(keys):
+        branch = {equal_key: cursor_values[equal_key] for equal_key, _ in keys[:index]}
+        branch[key] = {after: cursor_values[key]}
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def face_id_bound(sort_by: str, order: Optional[str], cursor: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    face_events face_id condition implied by cursor, None when there is none
+
+    Only listings sorted by face_id can skip events before grouping, the
+    bound then narrows the (face_id, timestamp) index scan to unseen faces.
+    """
+    if cursor is None or sort_by != "_id":
+        return None
+    return {"$lte" if order == "desc" else "$gte": cursor["face_id"]}
@@ -0,0 +1,174 @@
+from typing import Dict, List, Any
+import datetime
+import pytz
+
+from db import MongoDB
+from CustomerCount import CustomerCountMetric
+from CustomerReturnRate import CustomerReturnRateMetric
+from EmployeeCount import EmployeeCountMetric
+from TopCustomer import TopCustomerMetric
+from parallel_fetch import fetch_face_events
+from time_buckets import BlockBucketer
+from topology_cache import CameraTopology
+from validation import ValidateParams
+
+
+class MetricBatchExecutor:
+    """
+    Run several metrics over one shared scope from a single data fetch
+
+    A dashboard page asks for several metrics of the same groupIds and time
+    range. Instead of every metric resolving cameras and querying face_events
+    and face_identities on its own, cameras, events and identities are read
+    once and handed to each metric's in-memory computation. The events are
+    streamed once and reduced while reading to the per-block face sets of
+    every base_time and the visit stats of the ranking, so they are never
+    held in memory.
+    """
+    metrics = {
+        metric.__name__: metric for metric in [
+            CustomerCountMetric,
+            CustomerReturnRateMetric,
+            EmployeeCountMetric,
+            TopCustomerMetric,
+        ]
+    }
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    param_startTime: datetime.datetime
+    param_dueTime: datetime.datetime
+    param_groupIds: list
+    param_requests: list
+    valid_base_times = ['hourly', 'daily', 'weekly', 'monthly', 'yearly']
+    # Union of the fields read by the metrics above
+    face_event_fields = {"_id": 0, "face_id": 1, "camera_id": 1, "timestamp": 1}
+    face_identity_fields = {
+        "_id": 0, "face_id": 1, "first_seen": 1, "labels": 1,
+        "username": 1, "metadata.age": 1, "metadata.gender": 1
+    }
+
+    def __init__(self):
+        self.required_params = ["param_startTime", "param_dueTime", "param_groupIds", "param_requests", "host", "port"]
+
+    def ensure_timezone(self, dt, default_tz=pytz.UTC):
+        """Ensure datetime has timezone information"""
+        if dt.tzinfo is None:
+            return dt.replace(tzinfo=default_tz)
+        return dt
+
+    def validate_requests(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Check the metric requests and give each one a unique result key
+
+        Each request is {"metric": <metric class name>, "key": <optional result key>,
+        "params": {"param_baseTime": ..., "param_limit": ...}}.
+        """
+        validated = []
+        keys = set()
+        for request in requests:
+            metric = request.get("metric")
+            if metric not in self.metrics:
+                raise ValueError(f"Invalid metric: {metric}. Must be one of {list(self.metrics)}")
+            params = request.get("params", {})
+            base_time = params.get("param_baseTime")
+            if base_time not in self.valid_base_times:
+                raise ValueError(f"Invalid base_time: {base_time}. Must be one of {self.valid_base_times}")
+            if metric == TopCustomerMetric.__name__ and int(params.get("param_limit", 5)) <= 0:
+                raise ValueError("Limit must be a positive number")
+            key = request.get("key", metric)
+            if key in keys:
+                raise ValueError(f"Duplicate metric request key: {key}")
+            keys.add(key)
+            validated.append({"metric": metric, "key": key, "params": params})
+        return validated
+
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, *args, **kwargs):
+        """
+        Run every requested metric over the shared scope
+
+        Returns:
+        - {"results": {key: metric response}, "metadata": {...}}
+        """
+        requests = self.validate_requests(kwargs["param_requests"])
+
+        mongo_client = MongoDB()
+        mongo_client.setup_db(
+            username=kwargs.get("username", ""),
+            password=kwargs.get("password", ""),
+            host=kwargs["host"],
+            port=kwargs["port"],
+            auth=kwargs.get("auth", "admin"),
+        )
+        db_name = kwargs["db"]
+        # Timestamps arrive parsed by ValidateParams
+        start_datetime = self.ensure_timezone(kwargs["param_startTime"])
+        due_datetime = self.ensure_timezone(kwargs["param_dueTime"])
+
+        # Shared scope: cameras, events and identities are read once
+        camera_ids = CameraTopology.camera_ids(mongo_client, db_name, kwargs["param_groupIds"])
+
+        # Blocks of each base_time, bucketed while the events stream
+        time_blocks = {}
+        bucketers = {}
+        for request in requests:
+            base_time = request["params"]["param_baseTime"]
+            metric = self.metrics[request["metric"]]
+            if metric is TopCustomerMetric or base_time in time_blocks:
+                continue
+            time_blocks[base_time] = metric().generate_time_blocks(start_datetime, due_datetime, base_time)
+            bucketers[base_time] = BlockBucketer(time_blocks[base_time])
+        ranking = None
+        if any(request["metric"] == TopCustomerMetric.__name__ for request in requests):
+            ranking = TopCustomerMetric()
+        customer_stats = {}
+
+        face_events = fetch_face_events(
+            mongo_client, db_name, {"camera_id": {"$in": camera_ids}},
+            start_datetime, due_datetime,
+            projection=self.face_event_fields,
+            batch_size=kwargs.get("batch_size", 1000),
+            workers=kwargs.get("fetch_workers", 1)
+        )
+        event_count = 0
+        unique_face_ids = set()
+        for event in face_events:
+            event_count += 1
+            unique_face_ids.add(event["face_id"])
+            for bucketer in bucketers.values():
+                bucketer.feed(event)
+            if ranking is not None:
+                ranking.add_visit(customer_stats, event)
+
+        face_identities = []
+        if unique_face_ids:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": list(unique_face_ids)}
+                },
+                projection=self.face_identity_fields
+            )["result"]
+
+        results = {}
+        for request in requests:
+            metric = self.metrics[request["metric"]]()
+            params = request["params"]
+            base_time = params["param_baseTime"]
+
+            if isinstance(metric, TopCustomerMetric):
+                limit = int(params.get("param_limit", 5))
+                results[request["key"]] = metric.rank_customers(customer_stats, face_identities, limit, start_datetime)
+                continue
+
+            block_faces = bucketers[base_time].block_faces
+            block_stats = metric.block_stats_from_faces(time_blocks[base_time], block_faces, face_identities)
+            results[request["key"]] = metric.format_block_stats(time_blocks[base_time], block_stats, base_time)
+
+        return {
+            "results": results,
+            "metadata": {
+                "event_count": event_count,
+                "last_updated": datetime.datetime.now(pytz.UTC).isoformat()
+            }
+        }
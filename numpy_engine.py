@@ -0,0 +1,388 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import atexit
+import datetime
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from identity_cache import IdentitySnapshot
+from parallel_fetch import fetch_face_events
+from time_buckets import as_utc, empty_block_stats
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The numpy engine requires numpy, install it with `pip install numpy`")
+
+
+def to_epoch_ms(values: List[datetime.datetime]):
+    """Convert datetimes (naive UTC or aware) to an int64 epoch-ms array"""
+    naive = [value if value.tzinfo is None else as_utc(value, naive=True) for value in values]
+    return np.array(naive, dtype="datetime64[ms]").astype(np.int64)
+
+
+class EventColumns:
+    """
+    face_events of a query held as columnar arrays
+
+    Attributes:
+    - timestamps: int64 epoch milliseconds
+    - face_codes: int32 dictionary codes into face_ids
+    - camera_codes: int32 dictionary codes into camera_ids
+    - face_ids / camera_ids: code -> original id
+    """
+
+    def __init__(self, timestamps, face_codes, camera_codes, face_ids: List[str], camera_ids: List[str]):
+        self.timestamps = timestamps
+        self.face_codes = face_codes
+        self.camera_codes = camera_codes
+        self.face_ids = face_ids
+        self.camera_ids = camera_ids
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_events(cls, events: Iterable[Dict[str, Any]]) -> "EventColumns":
+        """Dictionary-encode an event stream into columns"""
+        require_numpy()
+        face_dictionary: Dict[str, int] = {}
+        camera_dictionary: Dict[str, int] = {}
+        timestamps, face_codes, camera_codes = [], [], []
+        for event in events:
+            timestamps.append(event["timestamp"])
+            face_codes.append(face_dictionary.setdefault(event["face_id"], len(face_dictionary)))
+            camera_codes.append(camera_dictionary.setdefault(event.get("camera_id"), len(camera_dictionary)))
+        return cls(
+            timestamps=to_epoch_ms(timestamps) if timestamps else np.empty(0, dtype=np.int64),
+            face_codes=np.array(face_codes, dtype=np.int32),
+            camera_codes=np.array(camera_codes, dtype=np.int32),
+            face_ids=list(face_dictionary),
+            camera_ids=list(camera_dictionary)
+        )
+
+
+def block_bounds(time_blocks: List[Dict[str, datetime.datetime]]):
+    """Block starts and ends as int64 epoch-ms arrays"""
+    starts = to_epoch_ms([block["from"] for block in time_blocks])
+    ends = to_epoch_ms([block["to"] for block in time_blocks])
+    return starts, ends
+
+
+def block_face_pairs(timestamps, face_codes, starts, ends, face_count: int):
+    """
+    Distinct (block, face) pairs of the events
+
+    Returns:
+    - (block index array, face code array) of every distinct pair
+    """
+    blocks = np.searchsorted(starts, timestamps, side="right") - 1
+    in_range = (blocks >= 0) & (timestamps < ends[-1])
+    keys = blocks[in_range].astype(np.int64) * face_count + face_codes[in_range]
+    keys = np.unique(keys)
+    return keys // face_count, keys % face_count
+
+
+def face_pair_stats(pair_blocks, pair_faces, first_seen, has_first_seen, starts, ends, face_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Reduce distinct (block, face) pairs to block stats
+
+    Parameters:
+    - pair_blocks / pair_faces: Output of block_face_pairs
+    - first_seen: int64 epoch-ms first_seen per face code
+    - has_first_seen: bool mask of face codes with a known first_seen
+    - starts / ends: Output of block_bounds
+    - face_ids: Dictionary of face codes, also returns the face_ids of each block when given
+    """
+    block_count = len(starts)
+    stats = empty_block_stats(block_count, face_ids is not None)
+    if len(pair_blocks) == 0:
+        return stats
+
+    pair_first_seen = first_seen[pair_faces]
+    pair_known = has_first_seen[pair_faces]
+    pair_from = starts[pair_blocks]
+    is_new = pair_known & (pair_first_seen >= pair_from) & (pair_first_seen < ends[pair_blocks])
+    is_old = pair_known & (pair_first_seen < pair_from)
+
+    counts = np.bincount(pair_blocks, minlength=block_count)
+    new = np.bincount(pair_blocks, weights=is_new, minlength=block_count)
+    old = np.bincount(pair_blocks, weights=is_old, minlength=block_count)
+    for index, block_stats in enumerate(stats["blocks"]):
+        block_stats.update(count=int(counts[index]), new=int(new[index]), old=int(old[index]))
+    if face_ids is not None:
+        # Pairs come out of np.unique sorted by block, so each block is one slice
+        offsets = np.searchsorted(pair_blocks, np.arange(block_count + 1))
+        for index, block_stats in enumerate(stats["blocks"]):
+            block_stats["faces"] = [face_ids[code] for code in pair_faces[offsets[index]:offsets[index + 1]]]
+    stats["distinct_faces"] = int(len(np.unique(pair_faces)))
+    return stats
+
+
+def share_array(array) -> Tuple[shared_memory.SharedMemory, Tuple[str, tuple, str]]:
+    """Copy array into a new shared memory segment, returns it with its (name, shape, dtype) spec"""
+    segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def chunk_face_pairs(timestamps_spec, face_codes_spec, event_from: int, event_to: int, starts, ends, block_offset: int, face_count: int):
+    """
+    Process pool task: block_face_pairs of one chunk of blocks
+
+    The chunk's events are the [event_from, event_to) rows of the shared,
+    timestamp sorted columns. Block indexes are returned relative to the
+    whole block list.
+    """
+    segments = [shared_memory.SharedMemory(name=spec[0]) for spec in (timestamps_spec, face_codes_spec)]
+    try:
+        timestamps, face_codes = [
+            np.ndarray(spec[1], dtype=spec[2], buffer=segment.buf)[event_from:event_to]
+            for spec, segment in zip((timestamps_spec, face_codes_spec), segments)
+        ]
+        pair_blocks, pair_faces = block_face_pairs(timestamps, face_codes, starts, ends, face_count)
+        return pair_blocks + block_offset, pair_faces
+    finally:
+        # Views into the buffers must be gone before the segments close
+        timestamps = face_codes = None
+        for segment in segments:
+            segment.close()
+
+
+class BlockProcessPool:
+    """
+    Spread block_face_pairs of long block lists over worker processes
+
+    Distinct counting per block is the costly part of a year of hourly blocks
+    and is bound to one core in process. The events are sorted by timestamp
+    once and placed in shared memory, the blocks are cut into contiguous
+    chunks and every worker reduces the events of its chunks to distinct
+    (block, face) pairs. As chunks do not overlap, concatenating their pairs
+    in chunk order gives exactly the single-process result.
+
+    Pools are created lazily per worker count and reused across calls. A pool
+    broken by a dying worker, e.g. killed for memory, is replaced and the
+    chunks are retried once, then computed in process.
+    """
+    # Shorter block lists are computed in process, the pool overhead would dominate
+    min_blocks = 256
+    chunks_per_worker = 4
+
+    _pools: Dict[int, ProcessPoolExecutor] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, min_blocks: Optional[int] = None, chunks_per_worker: Optional[int] = None):
+        if min_blocks is not None:
+            cls.min_blocks = min_blocks
+        if chunks_per_worker is not None:
+            cls.chunks_per_worker = chunks_per_worker
+
+    @classmethod
+    def get(cls, workers: int) -> ProcessPoolExecutor:
+        with cls._lock:
+            if workers not in cls._pools:
+                # spawn keeps the workers clear of the parent's MongoDB client and threads
+                cls._pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            return cls._pools[workers]
+
+    @classmethod
+    def discard(cls, workers: int, pool: ProcessPoolExecutor):
+        """Drop a broken pool, unless another caller already replaced it, and shut it down"""
+        with cls._lock:
+            if cls._pools.get(workers) is pool:
+                del cls._pools[workers]
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            for pool in cls._pools.values():
+                pool.shutdown(cancel_futures=True)
+            cls._pools.clear()
+
+    @classmethod
+    def face_pairs(cls, timestamps, face_codes, starts, ends, face_count: int, workers: int):
+        """Same result as block_face_pairs, computed by workers processes"""
+        order = np.argsort(timestamps, kind="stable")
+        segments = []
+        try:
+            timestamps_segment, timestamps_spec = share_array(timestamps[order])
+            segments.append(timestamps_segment)
+            face_codes_segment, face_codes_spec = share_array(face_codes[order])
+            segments.append(face_codes_segment)
+            sorted_timestamps = np.ndarray(timestamps_spec[1], dtype=timestamps_spec[2], buffer=timestamps_segment.buf)
+
+            chunk_count = min(len(starts), workers * cls.chunks_per_worker)
+            edges = [index * len(starts) // chunk_count for index in range(chunk_count + 1)]
+            tasks = []
+            for first, last in zip(edges, edges[1:]):
+                event_from, event_to = np.searchsorted(sorted_timestamps, [starts[first], ends[last - 1]], side="left")
+                tasks.append((
+                    timestamps_spec, face_codes_spec, int(event_from), int(event_to),
+                    starts[first:last], ends[first:last], first, face_count
+                ))
+            sorted_timestamps = None
+
+            pairs = None
+            for _ in range(2):
+                pool = cls.get(workers)
+                try:
+                    futures = [pool.submit(chunk_face_pairs, *task) for task in tasks]
+                    pairs = [future.result() for future in futures]
+                    break
+                except BrokenProcessPool:
+                    cls.discard(workers, pool)
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+        if pairs is None:
+            return block_face_pairs(timestamps, face_codes, starts, ends, face_count)
+        return (
+            np.concatenate([pair[0] for pair in pairs]),
+            np.concatenate([pair[1] for pair in pairs])
+        )
+
+
+atexit.register(BlockProcessPool.shutdown)
+
+
+class NumpyBlockEngine:
+    """
+    Compute time-block stats with vectorized NumPy kernels
+
+    Events are loaded once into EventColumns and every per-block count is
+    derived with np.searchsorted, np.unique and boolean masks, replacing the
+    per-event Python set and timezone work of the stream engine.
+    """
+    face_event_fields = {"_id": 0, "face_id": 1, "camera_id": 1, "timestamp": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "first_seen": 1, "labels": 1}
+
+    def __init__(
+            self,
+            camera_ids: List[str],
+            time_blocks: List[Dict[str, datetime.datetime]],
+            start_datetime: datetime.datetime,
+            due_datetime: datetime.datetime,
+            labels: Optional[List[str]] = None,
+            with_faces: bool = False,
+            face_ids: Optional[List[str]] = None,
+            use_identity_cache: bool = True,
+            fetch_workers: int = 1,
+            block_workers: int = 1
+        ):
+        """
+        Parameters:
+        - camera_ids: Cameras whose events are counted
+        - time_blocks: Blocks from generate_time_blocks
+        - start_datetime / due_datetime: Query range
+        - labels: Only count faces whose identity carries all of these labels
+        - with_faces: Also return the face_ids of each block
+        - face_ids: Only load events of these faces
+        - use_identity_cache: Read first_seen and labels from IdentitySnapshot
+        - fetch_workers: Read the events as this many concurrent time slices
+        - block_workers: Count distinct faces of long block lists in this many processes
+        """
+        require_numpy()
+        self.camera_ids = camera_ids
+        self.time_blocks = time_blocks
+        self.start_datetime = start_datetime
+        self.due_datetime = due_datetime
+        self.labels = labels
+        self.with_faces = with_faces
+        self.face_ids = face_ids
+        self.use_identity_cache = use_identity_cache
+        self.fetch_workers = fetch_workers
+        self.block_workers = block_workers
+
+    def load_events(self, mongo_client, db_name: str, batch_size: int = 1000) -> EventColumns:
+        """Stream the query's face_events into columns"""
+        query = {"camera_id": {"$in": self.camera_ids}}
+        if self.face_ids is not None:
+            query["face_id"] = {"$in": self.face_ids}
+        face_events = fetch_face_events(
+            mongo_client, db_name, query,
+            self.start_datetime, self.due_datetime, self.time_blocks,
+            projection=self.face_event_fields,
+            batch_size=batch_size,
+            workers=self.fetch_workers
+        )
+        return EventColumns.from_events(face_events)
+
+    def identity_columns(self, face_ids: List[str], face_identities: Iterable[Dict[str, Any]]):
+        """
+        first_seen per face code plus masks of known first_seen and allowed faces
+
+        Faces without an identity count towards block totals unless labels are
+        required, in which case they are excluded like unlabelled faces.
+        """
+        face_codes = {face_id: code for code, face_id in enumerate(face_ids)}
+        first_seen = np.zeros(len(face_ids), dtype=np.int64)
+        has_first_seen = np.zeros(len(face_ids), dtype=bool)
+        allowed = np.full(len(face_ids), not self.labels, dtype=bool)
+        known_codes, known_first_seen = [], []
+        for face in face_identities:
+            code = face_codes.get(face["face_id"])
+            if code is None:
+                continue
+            if self.labels and set(self.labels).issubset(face.get("labels") or []):
+                allowed[code] = True
+            if face.get("first_seen") is not None:
+                known_codes.append(code)
+                known_first_seen.append(face["first_seen"])
+        if known_codes:
+            first_seen[known_codes] = to_epoch_ms(known_first_seen)
+            has_first_seen[known_codes] = True
+        return first_seen, has_first_seen, allowed
+
+    def compute(self, columns: EventColumns, face_identities: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Block stats for preloaded event columns and identities"""
+        if not self.time_blocks or len(columns) == 0:
+            return empty_block_stats(len(self.time_blocks), self.with_faces)
+
+        starts, ends = block_bounds(self.time_blocks)
+        first_seen, has_first_seen, allowed = self.identity_columns(columns.face_ids, face_identities)
+        keep = allowed[columns.face_codes]
+        if self.block_workers > 1 and len(self.time_blocks) >= BlockProcessPool.min_blocks:
+            pair_blocks, pair_faces = BlockProcessPool.face_pairs(
+                columns.timestamps[keep], columns.face_codes[keep], starts, ends, len(columns.face_ids), self.block_workers
+            )
+        else:
+            pair_blocks, pair_faces = block_face_pairs(
+                columns.timestamps[keep], columns.face_codes[keep], starts, ends, len(columns.face_ids)
+            )
+        return face_pair_stats(
+            pair_blocks, pair_faces, first_seen, has_first_seen, starts, ends,
+            columns.face_ids if self.with_faces else None
+        )
+
+    def run(self, mongo_client, db_name: str, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Load events and identities and compute block stats
+
+        Returns:
+        - Block stats in the same shape as TimeBucketPipeline.run
+        """
+        columns = self.load_events(mongo_client, db_name, batch_size)
+        if len(columns) == 0:
+            return empty_block_stats(len(self.time_blocks), self.with_faces)
+
+        if self.use_identity_cache:
+            face_identities = IdentitySnapshot.get_identities(mongo_client, db_name, columns.face_ids)
+        else:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": columns.face_ids}
+                },
+                projection=self.face_identity_fields
+            )["result"]
+        return self.compute(columns, face_identities)
@@ -0,0 +1,162 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+import datetime
+
+
+def slice_bounds(
+        time_blocks: List[Dict[str, datetime.datetime]],
+        slice_count: int
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split the span of time_blocks into contiguous ranges on block boundaries
+
+    Parameters:
+    - time_blocks: Contiguous blocks from generate_time_blocks
+    - slice_count: Maximum number of ranges, each holds a whole number of blocks
+
+    Returns:
+    - [(from, to), ...] in time order
+    """
+    if not time_blocks:
+        return []
+    slice_count = max(1, min(slice_count, len(time_blocks)))
+    bounds = []
+    for index in range(slice_count):
+        first = index * len(time_blocks) // slice_count
+        last = (index + 1) * len(time_blocks) // slice_count - 1
+        bounds.append((time_blocks[first]["from"], time_blocks[last]["to"]))
+    return bounds
+
+
+def split_range(start: datetime.datetime, due: datetime.datetime, count: int) -> List[Dict[str, datetime.datetime]]:
+    """Even blocks covering [start, due), for callers that have no time blocks"""
+    count = max(1, count)
+    step = (due - start) / count
+    edges = [start + step * index for index in range(count)] + [due]
+    return [{"from": edges[index], "to": edges[index + 1]} for index in range(count)]
+
+
+class ParallelEventFetcher:
+    """
+    Read face_events of a time range over several connections at once
+
+    The range is cut into slices aligned on block boundaries and each slice
+    is read by its own find on the timestamp index from a thread pool, so
+    long ranges are not bound by the throughput of a single cursor. At most
+    `workers` slices are in flight, results are yielded in time order.
+    """
+    # Slices per worker, more slices balance uneven event density better
+    slices_per_worker = 4
+
+    def __init__(
+            self,
+            mongo_client,
+            db_name: str,
+            query: Dict[str, Any],
+            projection: Optional[Dict[str, Any]] = None,
+            batch_size: int = 1000,
+            workers: int = 4
+        ):
+        """
+        Parameters:
+        - query: face_events filter without the timestamp condition
+        - projection: Fields to return
+        - batch_size: Cursor batch size of each slice
+        - workers: Number of concurrent slice reads
+        """
+        self.mongo_client = mongo_client
+        self.db_name = db_name
+        self.query = query
+        self.projection = projection
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+
+    def fetch_slice(self, since: datetime.datetime, until: datetime.datetime, inclusive: bool) -> List[Dict[str, Any]]:
+        query = dict(self.query)
+        query["timestamp"] = {"$gte": since, "$lte" if inclusive else "$lt": until}
+        face_events = self.mongo_client.find_iter(
+            db_name=self.db_name,
+            col_name="face_events",
+            query=query,
+            batch_size=self.batch_size,
+            # Each slice gets its own projection, drivers may normalize it in place
+            projection=dict(self.projection) if self.projection is not None else None
+        )
+        if not face_events["status"]:
+            raise RuntimeError(f"Failed to read face_events slice: {face_events.get('error')}")
+        return list(face_events["result"])
+
+    def iter_events(self, bounds: List[Tuple[datetime.datetime, datetime.datetime]]) -> Iterator[Dict[str, Any]]:
+        """
+        Events of each (from, to) range of bounds, in order
+
+        Ranges are half-open except the last, whose end is inclusive to match
+        the $lte of the single-cursor queries.
+        """
+        last = len(bounds) - 1
+        slices = iter(enumerate(bounds))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for index, (since, until) in slices:
+                pending.append(pool.submit(self.fetch_slice, since, until, index == last))
+                if len(pending) == self.workers:
+                    break
+            while pending:
+                events = pending.popleft().result()
+                for index, (since, until) in slices:
+                    pending.append(pool.submit(self.fetch_slice, since, until, index == last))
+                    break
+                yield from events
+
+
+def fetch_face_events(
+        mongo_client,
+        db_name: str,
+        query: Dict[str, Any],
+        start_datetime: datetime.datetime,
+        due_datetime: datetime.datetime,
+        time_blocks: Optional[List[Dict[str, datetime.datetime]]] = None,
+        projection: Optional[Dict[str, Any]] = None,
+        batch_size: int = 1000,
+        workers: int = 1
+    ) -> Iterable[Dict[str, Any]]:
+    """
+    face_events matching query with start_datetime <= timestamp <= due_datetime
+
+    With one worker this is a single streaming cursor. With more, the range
+    is cut on the boundaries of time_blocks (or evenly when there are none)
+    and read concurrently by ParallelEventFetcher.
+
+    Parameters:
+    - query: face_events filter without the timestamp condition
+    - start_datetime / due_datetime: Query range
+    - time_blocks: Blocks from generate_time_blocks covering the range
+    - projection: Fields to return
+    - batch_size: Cursor batch size
+    - workers: Number of concurrent reads
+    """
+    if workers <= 1:
+        query = dict(query)
+        query["timestamp"] = {"$gte": start_datetime, "$lte": due_datetime}
+        face_events = mongo_client.find_iter(
+            db_name=db_name,
+            col_name="face_events",
+            query=query,
+            batch_size=batch_size,
+            projection=projection
+        )
+        if not face_events["status"]:
+            raise RuntimeError(f"Failed to read face_events: {face_events.get('error')}")
+        return face_events["result"]
+
+    slice_count = workers * ParallelEventFetcher.slices_per_worker
+    if not time_blocks:
+        time_blocks = split_range(start_datetime, due_datetime, slice_count)
+    bounds = slice_bounds(time_blocks, slice_count)
+    # The outer slices follow the query range rather than the block edges
+    bounds[0] = (start_datetime, bounds[0][1])
+    bounds[-1] = (bounds[-1][0], due_datetime)
+    return ParallelEventFetcher(
+        mongo_client, db_name, query, projection, batch_size, workers
+    ).iter_events(bounds)
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import threading
+import time
+
+from db import MongoDB
+
+
+class ProfileCache:
+    """
+    Read-through LRU cache of face_identities profiles
+
+    Profile lookups come one per row of a staff or customer table, so cached
+    profiles are served from memory and all misses of a lookup are read with
+    a single face_id $in. Faces without an identity are cached as None. An
+    entry expires ttl seconds after it was read, each database holds at most
+    max_entries faces, evicted least recently used, and writes to
+    face_identities through MongoDB drop the written faces.
+
+    Profiles are shared between callers and must not be modified.
+    """
+    max_entries = 10000
+    ttl = 300.0
+    fields = {"_id": 0, "face_id": 1, "username": 1, "labels": 1, "metadata": 1}
+
+    # MongoDB.database_key -> face_id -> (read_at, profile or None)
+    _profiles: Dict[Tuple, "OrderedDict[str, tuple]"] = {}
+    # Bumped by every invalidation, reads started before one are not cached
+    _generations: Dict[Tuple, int] = {}
+    _lock = threading.RLock()
+
+    @classmethod
+    def configure(cls, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        with cls._lock:
+            if max_entries is not None:
+                cls.max_entries = max_entries
+            if ttl is not None:
+                cls.ttl = ttl
+            for profiles in cls._profiles.values():
+                while len(profiles) > cls.max_entries:
+                    profiles.popitem(last=False)
+
+    @classmethod
+    def get_profiles(cls, mongo_client, db_name: str, face_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Profiles of face_ids
+
+        Returns:
+        - {face_id: face_identities document with the fields above, or None}
+        """
+        face_ids = list(dict.fromkeys(face_ids))
+        key = MongoDB.database_key(db_name)
+        now = time.monotonic()
+
+        found = {}
+        with cls._lock:
+            profiles = cls._profiles.setdefault(key, OrderedDict())
+            generation = cls._generations.get(key, 0)
+            for face_id in face_ids:
+                entry = profiles.get(face_id)
+                if entry is None:
+                    continue
+                if now - entry[0] > cls.ttl:
+                    del profiles[face_id]
+                    continue
+                profiles.move_to_end(face_id)
+                found[face_id] = entry[1]
+        misses = [face_id for face_id in face_ids if face_id not in found]
+
+        if misses:
+            face_identities = mongo_client.find_iter(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": misses}
+                },
+                projection=cls.fields
+            )
+            if not face_identities["status"]:
+                raise RuntimeError(f"Failed to load face_identities: {face_identities.get('error')}")
+            loaded = {}
+            for face in face_identities["result"]:
+                loaded.setdefault(face["face_id"], face)
+            with cls._lock:
+                # A write during the read may have changed these faces, keep them uncached
+                cacheable = cls._generations.get(key, 0) == generation
+                profiles = cls._profiles.setdefault(key, OrderedDict())
+                for face_id in misses:
+                    found[face_id] = loaded.get(face_id)
+                    if cacheable:
+                        profiles[face_id] = (now, found[face_id])
+                        profiles.move_to_end(face_id)
+                while len(profiles) > cls.max_entries:
+                    profiles.popitem(last=False)
+
+        return {face_id: found[face_id] for face_id in face_ids}
+
+    @classmethod
+    def invalidate(cls, db_name: Optional[str] = None, face_ids: Optional[Iterable[str]] = None):
+        """Drop cached profiles, all of them unless face_ids is given"""
+        with cls._lock:
+            keys = [MongoDB.database_key(db_name)] if db_name is not None else list(cls._profiles)
+            for key in keys:
+                cls._generations[key] = cls._generations.get(key, 0) + 1
+                profiles = cls._profiles.get(key)
+                if profiles is None:
+                    continue
+                if face_ids is None:
+                    profiles.clear()
+                    continue
+                for face_id in face_ids:
+                    profiles.pop(face_id, None)
+
+    @classmethod
+    def invalidate_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """MongoDB write listener dropping profiles changed through face_identities writes"""
+        if col_name != "face_identities":
+            return
+        if query is not None:
+            face_id = query.get("face_id")
+            cls.invalidate(db_name, [face_id] if isinstance(face_id, str) else None)
+            return
+        face_ids = [document.get("face_id") for document in documents or []]
+        if None in face_ids:
+            cls.invalidate(db_name)
+            return
+        cls.invalidate(db_name, face_ids)
+
+
+MongoDB.add_write_listener(ProfileCache.invalidate_on_write)
@@ -0,0 +1,317 @@
+from typing import Dict, List, Any, Iterable, Optional
+import argparse
+import datetime
+
+from db import MongoDB
+from identity_cache import IdentitySnapshot
+from time_buckets import as_utc, bucket_event_faces, empty_block_stats, summarize_block_faces
+
+
+class HourlyRollup:
+    """
+    Materialized per-(camera_id, hour) aggregates of face_events
+
+    Each hourly_rollups document holds the distinct face_ids of one camera in
+    one hour. The collection is maintained incrementally from a watermark
+    stored in rollup_state: every refresh rebuilds the hours from the
+    watermark's hour up to now and upserts them with $merge, so the open hour
+    is rewritten until it closes. Refreshes run from `python rollups.py
+    refresh`, e.g. from cron. Writes to face_events through MongoDB rewind the
+    watermark to the earliest hour they touch, so late events are picked up by
+    the next refresh and the rollups are not served for those hours meanwhile.
+    Requires the unique (camera_id, hour) index created by
+    distill_db_init_2.init_hourly_rollups_collection.
+    """
+    collection = "hourly_rollups"
+    state_collection = "rollup_state"
+    # Base times whose blocks can be assembled from whole hours
+    base_times = ["daily", "weekly", "monthly", "yearly"]
+
+    @classmethod
+    def floor_hour(cls, dt: datetime.datetime) -> datetime.datetime:
+        return dt.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def get_watermark(cls, mongo_client, db_name: str) -> Optional[datetime.datetime]:
+        """Timestamp up to which hourly_rollups reflects face_events, naive UTC"""
+        state = mongo_client.find_one(
+            db_name=db_name,
+            col_name=cls.state_collection,
+            query={"name": cls.collection},
+            projection={"_id": 0, "watermark": 1}
+        )
+        if not state["status"]:
+            return None
+        return state["result"].get("watermark")
+
+    @classmethod
+    def build_pipeline(cls, since: datetime.datetime, until: datetime.datetime) -> List[Dict[str, Any]]:
+        """Aggregation recomputing every (camera_id, hour) row in [since, until)"""
+        return [
+            {"$match": {"timestamp": {"$gte": since, "$lt": until}}},
+            {
+                "$group": {
+                    "_id": {
+                        "camera_id": "$camera_id",
+                        "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}
+                    },
+                    "face_ids": {"$addToSet": "$face_id"}
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "camera_id": "$_id.camera_id",
+                    "hour": "$_id.hour",
+                    "face_ids": 1,
+                    "updated_at": "$$NOW"
+                }
+            },
+            {
+                "$merge": {
+                    "into": cls.collection,
+                    "on": ["camera_id", "hour"],
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }
+            }
+        ]
+
+    @classmethod
+    def refresh(
+            cls,
+            mongo_client,
+            db_name: str,
+            since: Optional[datetime.datetime] = None,
+            until: Optional[datetime.datetime] = None
+        ) -> Dict[str, Any]:
+        """
+        Bring hourly_rollups up to date
+
+        Parameters:
+        - since: Recompute from this time instead of the stored watermark, used
+          to invalidate closed hours after late-arriving events were ingested
+        - until: Upper bound of the refresh, defaults to now
+
+        Returns:
+        - status dict with the new watermark
+        """
+        if until is None:
+            until = datetime.datetime.now(datetime.timezone.utc)
+        until = as_utc(until, naive=True)
+
+        watermark = cls.get_watermark(mongo_client, db_name)
+        if since is None:
+            since = watermark
+        if since is None:
+            first_event = mongo_client.aggregate(
+                db_name=db_name,
+                col_name="face_events",
+                query=[
+                    {"$sort": {"timestamp": 1}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "timestamp": 1}}
+                ]
+            )
+            if not first_event["status"]:
+                return first_event
+            if not first_event["result"]:
+                return {"status": True, "watermark": None}
+            since = first_event["result"][0]["timestamp"]
+        since = cls.floor_hour(as_utc(since, naive=True))
+
+        # Rebuilt hours are not served until the refresh completes
+        if watermark is not None and since < watermark:
+            mongo_client.update_one(
+                db_name=db_name,
+                col_name=cls.state_collection,
+                query={"name": cls.collection},
+                document={"watermark": since}
+            )
+            watermark = since
+        # Hours whose events were all deleted would otherwise keep their old rows
+        deleted = mongo_client.delete_many(
+            db_name=db_name,
+            col_name=cls.collection,
+            query={"hour": {"$gte": since, "$lt": until}}
+        )
+        if not deleted["status"]:
+            return deleted
+
+        result = mongo_client.aggregate(
+            db_name=db_name,
+            col_name="face_events",
+            query=cls.build_pipeline(since, until)
+        )
+        if not result["status"]:
+            return result
+
+        if watermark is None:
+            mongo_client.update_or_insert_data(
+                db_name=db_name,
+                col_name=cls.state_collection,
+                query={"name": cls.collection},
+                document={"name": cls.collection, "watermark": until}
+            )
+        else:
+            # Only advance if no write rewound the watermark during the refresh
+            mongo_client.update_one(
+                db_name=db_name,
+                col_name=cls.state_collection,
+                query={"name": cls.collection, "watermark": watermark},
+                document={"watermark": until}
+            )
+        return {"status": True, "watermark": until}
+
+    @classmethod
+    def rewind_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """
+        MongoDB write listener rewinding the watermark before written face_events
+
+        Inserts rewind it to the hour of their earliest timestamp. Updates and
+        deletes cannot be located, they drop the watermark so the next refresh
+        rebuilds every hour.
+        """
+        if col_name != "face_events" or MongoDB.client is None:
+            return
+        timestamps = [document.get("timestamp") for document in documents or []]
+        if query is not None or not timestamps or not all(isinstance(timestamp, datetime.datetime) for timestamp in timestamps):
+            MongoDB.delete_one(db_name, cls.state_collection, {"name": cls.collection})
+            return
+        hour = cls.floor_hour(as_utc(min(timestamps), naive=True))
+        MongoDB.update_one(
+            db_name,
+            cls.state_collection,
+            {"name": cls.collection, "watermark": {"$gt": hour}},
+            {"watermark": hour}
+        )
+
+
+MongoDB.add_write_listener(HourlyRollup.rewind_on_write)
+
+
+class RollupBlockEngine:
+    """
+    Compute time-block stats from hourly_rollups instead of raw face_events
+
+    Only applies when every block boundary falls on a whole hour, the base
+    time is at least daily and the rollups are refreshed past the end of the
+    query; run() returns None otherwise so callers fall back to another engine.
+    """
+    face_identity_fields = {"_id": 0, "face_id": 1, "first_seen": 1, "labels": 1}
+
+    def __init__(
+            self,
+            camera_ids: List[str],
+            time_blocks: List[Dict[str, datetime.datetime]],
+            base_time: str,
+            labels: Optional[List[str]] = None,
+            with_faces: bool = False,
+            use_identity_cache: bool = True
+        ):
+        """
+        Parameters:
+        - camera_ids: Cameras whose events are counted
+        - time_blocks: Blocks from generate_time_blocks
+        - base_time: Time unit the blocks were generated with
+        - labels: Only count faces whose identity carries all of these labels
+        - with_faces: Also return the face_ids of each block
+        - use_identity_cache: Read first_seen and labels from IdentitySnapshot
+        """
+        self.camera_ids = camera_ids
+        self.time_blocks = time_blocks
+        self.base_time = base_time
+        self.labels = labels
+        self.with_faces = with_faces
+        self.use_identity_cache = use_identity_cache
+
+    def applicable(self) -> bool:
+        """Whether the blocks can be assembled from whole rollup hours"""
+        if self.base_time not in HourlyRollup.base_times or not self.time_blocks:
+            return False
+        boundaries = [block["from"] for block in self.time_blocks] + [self.time_blocks[-1]["to"]]
+        return all(
+            as_utc(boundary, naive=True) == HourlyRollup.floor_hour(as_utc(boundary, naive=True))
+            for boundary in boundaries
+        )
+
+    def iter_hour_faces(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            for face_id in row["face_ids"]:
+                yield {"timestamp": row["hour"], "face_id": face_id}
+
+    def run(self, mongo_client, db_name: str, batch_size: int = 1000) -> Optional[Dict[str, Any]]:
+        """
+        Block stats from the rollups, or None if they cannot serve the query
+
+        Returns:
+        - Block stats in the same shape as TimeBucketPipeline.run
+        """
+        if not self.applicable():
+            return None
+        watermark = HourlyRollup.get_watermark(mongo_client, db_name)
+        if watermark is None or watermark < as_utc(self.time_blocks[-1]["to"], naive=True):
+            return None
+
+        rows = mongo_client.find_iter(
+            db_name=db_name,
+            col_name=HourlyRollup.collection,
+            query={
+                "camera_id": {"$in": self.camera_ids},
+                "hour": {"$gte": self.time_blocks[0]["from"], "$lt": self.time_blocks[-1]["to"]}
+            },
+            batch_size=batch_size,
+            projection={"_id": 0, "hour": 1, "face_ids": 1}
+        )
+        if not rows["status"]:
+            return None
+        block_faces = bucket_event_faces(self.iter_hour_faces(rows["result"]), self.time_blocks)
+
+        unique_face_ids = list(set().union(*block_faces))
+        if not unique_face_ids:
+            return empty_block_stats(len(self.time_blocks), self.with_faces)
+
+        if self.use_identity_cache:
+            face_identities = IdentitySnapshot.get_identities(mongo_client, db_name, unique_face_ids)
+        else:
+            face_identities = mongo_client.find(
+                db_name=db_name,
+                col_name="face_identities",
+                query={
+                    "face_id": {"$in": unique_face_ids}
+                },
+                projection=self.face_identity_fields
+            )["result"]
+
+        first_seen_map = {}
+        for face in face_identities:
+            if self.labels and not set(self.labels).issubset(face.get("labels") or []):
+                continue
+            first_seen = face.get("first_seen")
+            first_seen_map[face["face_id"]] = as_utc(first_seen, naive=False) if first_seen else None
+        if self.labels:
+            block_faces = [faces & first_seen_map.keys() for faces in block_faces]
+        return summarize_block_faces(self.time_blocks, block_faces, first_seen_map, self.with_faces)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the hourly_rollups collection")
+    parser.add_argument("command", choices=["refresh"], help="refresh: bring hourly_rollups up to date")
+    parser.add_argument("--host", default="localhost", help="MongoDB host")
+    parser.add_argument("--port", type=int, default=27017, help="MongoDB port")
+    parser.add_argument("--db", default="distill_db", help="Database name")
+    parser.add_argument("--username", default="", help="MongoDB username")
+    parser.add_argument("--password", default="", help="MongoDB password")
+    parser.add_argument("--auth", default="admin", help="Authentication database")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="Rebuild from this time instead of the watermark")
+    args = parser.parse_args()
+
+    mongo_client = MongoDB()
+    mongo_client.setup_db(
+        username=args.username,
+        password=args.password,
+        host=args.host,
+        port=args.port,
+        auth=args.auth,
+    )
+    print(HourlyRollup.refresh(mongo_client, args.db, since=args.since))
@@ -1,58 +1,106 @@
-from functools import wraps
-from typing import Dict, List, Any, Callable, Type, get_type_hints
 from datetime import datetime
 import inspect
 from db import MongoDB
-
-class ValidateParams:
-    def __init__(self, required_params_getter: Callable):
-        self.required_params_getter = required_params_getter
-
-    def validate_type(self, value: Any, expected_type: Type) -> bool:
-        if expected_type == datetime and isinstance(value, str):
-            try:
-                datetime.fromisoformat(value)
-                return True
-            except ValueError:
-                return False
-        return isinstance(value, expected_type)
-
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(instance, *args, **kwargs):
-            params: Dict[str, Any] = kwargs
-            
-            # Get required params and their types from instance
-            required_params = self.required_params_getter(instance)
-            param_types = get_type_hints(instance.__class__)
-            
-            # Check for missing parameters
-            missing_params = [
-                param for param in required_params 
-                if param not in params
-            ]
-            
-            if missing_params:
-                raise ValueError(
-                    f"Missing required parameters: {', '.join(missing_params)}"
-                )
-            
-            # Validate and assign parameters
-            for key, value in params.items():
-                if key in param_types:
-                    if not self.validate_type(value, param_types[key]):
-                        raise TypeError(
-                            f"Parameter '{key}' must be of type {param_types[key].__name__}"
-                        )
-                setattr(instance, key, value)
-                
-            return func(instance, *args, **kwargs)
-        return wrapper
+from identity_search import IdentitySearch
+from keyset_cursor import decode_cursor, encode_cursor, face_id_bound, keyset_match
+from topology_cache import CameraTopology
+from validation import ValidateParams
 
 class CustomerEvent:
+    # Parameter types checked by ValidateParams, datetimes are parsed before run()
+    params_visitDateFrom: datetime
+    params_visitDateTo: datetime
+    params_groupIds: list
+    # Fields read by this class, used as query projections
+    face_event_fields = {"_id": 0, "face_id": 1, "track_id": 1, "event_id": 1}
+    face_identity_fields = {"_id": 0, "face_id": 1, "username": 1, "last_seen": 1, "labels": 1}
+    # Identities per batched last-event query
+    last_event_batch_size = 500
+
     def __init__(self):
         self.required_params = ["params_visitDateFrom", "params_visitDateTo", "host", "port"]
 
+    def last_events(self, mongo_client, db_name, face_identities):
+        """
+        Event at last_seen of each face identity, keyed by face_id
+
+        One $or query per last_event_batch_size identities replaces a find
+        per identity, every branch is served by the (face_id, timestamp) index.
+        """
+        last_events = {}
+        for offset in range(0, len(face_identities), self.last_event_batch_size):
+            batch = face_identities[offset:offset + self.last_event_batch_size]
+            face_events = mongo_client.find(
+                db_name=db_name,
+                col_name="face_events",
+                query={
+                    "$or": [
+                        {"face_id": face_identity["face_id"], "timestamp": face_identity["last_seen"]}
+                        for face_identity in batch
+                    ]
+                },
+                projection=self.face_event_fields
+            )["result"]
+            for face_event in face_events:
+                # First match wins, as with the former per-identity find
+                last_events.setdefault(face_event["face_id"], face_event)
+        return last_events
+
+    def build_listing_pipeline(self, group_camera_ids, visit_date_from, visit_date_to, sort_by, order, skip, limit, cursor=None, face_ids=None):
+        """
+        One aggregation listing the faces of every group, sorted and paged on the server
+
+        The events of all cameras are matched once and grouped by (face_id,
+        group_id), the group of each event coming from a camera -> group
+        mapping inlined into the pipeline. The rows are sorted with face_id and
+        group_id breaking ties and only the requested page leaves the server.
+        With a decoded keyset cursor the page starts after the cursor's row
+        instead of at skip, face_ids restricts the listing to these faces.
+        """
+        face_id = {}
+        if face_ids is not None:
+            face_id["$in"] = face_ids
+        face_id.update(face_id_bound(sort_by, order, cursor) or {})
+
+        match = {
+            "camera_id": {"$in": [camera_id for camera_ids in group_camera_ids.values() for camera_id in camera_ids]},
+            "timestamp": {
+                "$gte": visit_date_from,
+                "$lte": visit_date_to
+            }
+        }
+        if face_id:
+            match["face_id"] = face_id
+        camera_group = {
+            "$switch": {
+                "branches": [
+                    {"case": {"$in": ["$camera_id", camera_ids]}, "then": group_id}
+                    for group_id, camera_ids in group_camera_ids.items()
+                    if camera_ids
+                ],
+                "default": None
+            }
+        }
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {"face_id": "$face_id", "group_id": camera_group},
+                    "visit_count": {"$sum": 1}
+                }
+            },
+            {"$project": {"_id": "$_id.face_id", "group_id": "$_id.group_id", "visit_count": 1}}
+        ]
+
+        direction = -1 if order == "desc" else 1
+        sort = {sort_by: direction}
+        sort.setdefault("_id", 1)
+        sort.setdefault("group_id", 1)
+        if cursor is not None:
+            pipeline.append({"$match": keyset_match(sort_by, order, cursor)})
+        pipeline.extend([{"$sort": sort}, {"$skip": skip}, {"$limit": limit}])
+        return pipeline
+
     @ValidateParams(lambda self: self.required_params)
     def run(self, *args, **kwargs):
         mongo_client = MongoDB()
@@ -64,74 +112,73 @@ class CustomerEvent:
             auth=kwargs["auth"],
         )
 
-        # Query groups
-        group_list = mongo_client.find(
-            db_name=kwargs["db"],
-            col_name="cam_groups",
-            query={"group_id": {"$in": kwargs.get("params_groupIds", [])}}
-        )["result"]
-
-        # Query cameras
-        camera_group_lists = [
-            {
-                "camera": mongo_client.find(
+        # Query groups and cameras from the topology cache
+        group_list = CameraTopology.groups(mongo_client, kwargs["db"], kwargs.get("params_groupIds", []))
+        group_camera_ids = CameraTopology.group_camera_ids(mongo_client, kwargs["db"], kwargs.get("params_groupIds", []))
+        # params_cursor switches to keyset pagination, "" requests the first page
+        cursor_mode = "params_cursor" in kwargs
+        if not any(group_camera_ids.values()):
+            return {"items": [], "nextCursor": None} if cursor_mode else []
+
+        # Search runs on the indexed search tokens and narrows the listing before pagination
+        search = IdentitySearch.match(kwargs.get("params_search", ""))
+        face_ids = None
+        if search is not None:
+            face_ids = [
+                face_identity["face_id"]
+                for face_identity in mongo_client.find(
                     db_name=kwargs["db"],
-                    col_name="cameras",
-                    query={"group_id": group_id}
-                )["result"],
-                "group_id": group_id
-            }
-            for group_id in kwargs.get("params_groupIds", [])
-        ]
-
-        face_events_list = []
-        for camera_group_list in camera_group_lists:
-            camera_ids = [camera["camera_id"] for camera in camera_group_list["camera"]]
-            face_events_query = mongo_client.aggregate(
-                db_name=kwargs["db"],
-                col_name="face_events",
-                query=[
-                    {
-                        "$match": {
-                            "camera_id": {"$in": camera_ids},
-                            "timestamp": {
-                                "$gte": datetime.fromisoformat(kwargs["params_visitDateFrom"]),
-                                "$lte": datetime.fromisoformat(kwargs["params_visitDateTo"])
-                            }
-                        }
-                    },
-                    {
-                        "$group": {
-                            "_id": "$face_id",
-                            "visit_count": {"$sum": 1},
-                            "group_id": {"$first": camera_group_list["group_id"]}
-                        }
-                    }
-                ]
-            )["result"]
-
-            face_events_list.extend(face_events_query)
+                    col_name="face_identities",
+                    query=search,
+                    projection={"_id": 0, "face_id": 1}
+                )["result"]
+            ]
 
-        # Sorting and pagination
-        face_events_list.sort(key=lambda x: x.get(kwargs["params_sortBy"]), reverse=kwargs.get("params_order", "asc") == "desc")
-        face_events_list = face_events_list[0:int(kwargs["params_pageSize"]) * int(kwargs["params_page"])]
+        # Sorting and pagination run on the server, only the requested page is returned
+        page_size = int(kwargs["params_pageSize"])
+        sort_by = kwargs["params_sortBy"]
+        order = kwargs.get("params_order", "asc")
+        if cursor_mode:
+            cursor = decode_cursor(kwargs["params_cursor"], sort_by, order) if kwargs["params_cursor"] else None
+            # One extra row tells whether there is a next page
+            skip, limit = 0, page_size + 1
+        else:
+            cursor = None
+            skip, limit = (int(kwargs["params_page"]) - 1) * page_size, page_size
+        face_events_list = mongo_client.aggregate(
+            db_name=kwargs["db"],
+            col_name="face_events",
+            query=self.build_listing_pipeline(
+                group_camera_ids,
+                kwargs["params_visitDateFrom"],
+                kwargs["params_visitDateTo"],
+                sort_by,
+                order,
+                skip,
+                limit,
+                cursor,
+                face_ids
+            )
+        )["result"]
+        next_cursor = None
+        if cursor_mode and len(face_events_list) > page_size:
+            face_events_list = face_events_list[:page_size]
+            next_cursor = encode_cursor(sort_by, order, face_events_list[-1])
 
         face_id_lists = [item["_id"] for item in face_events_list]
         face_identities_list = mongo_client.find(
             db_name=kwargs["db"],
             col_name="face_identities",
-            query={"face_id": {"$in": face_id_lists}}
+            query={"face_id": {"$in": face_id_lists}},
+            projection=self.face_identity_fields
         )["result"]
 
+        last_events = self.last_events(mongo_client, kwargs["db"], face_identities_list)
         for face_identity in face_identities_list:
-            face_events_query = mongo_client.find(
-                db_name=kwargs["db"],
-                col_name="face_events",
-                query={"face_id": face_identity["face_id"], "timestamp": face_identity["last_seen"]}
-            )["result"]
-            if face_events_query:
-                face_identity["track_id"] = face_events_query[0].get("track_id")
-                face_identity["event_id"] = face_events_query[0].get("event_id")
+            last_event = last_events.get(face_identity["face_id"])
+            if last_event:
+                face_identity["track_id"] = last_event.get("track_id")
+                face_identity["event_id"] = last_event.get("event_id")
 
         results_face_event = face_events_list.copy()
         for item in results_face_event:
@@ -149,6 +196,8 @@ class CustomerEvent:
                     item["fullName"] = face_identity["username"]
                     break
 
+        if cursor_mode:
+            return {"items": results_face_event, "nextCursor": next_cursor}
         return results_face_event
 
 
@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+import argparse
+import datetime
+
+from db import MongoDB
+
+
+class Sessionizer:
+    """
+    Split face events into visits in a single pass
+
+    Events are consumed in timestamp order, across cameras and faces. A face's
+    visit stays open while its events are at most gap apart and is emitted as
+    soon as a later event shows it can no longer be extended. Open visits are
+    kept in last-seen order, so closing them is O(1) per event and memory is
+    bounded by the faces seen within the last gap, not by the event count.
+
+    Each visit is {"face_id", "start", "end", "dwell_seconds", "event_count",
+    "cameras"}, cameras being the camera path with consecutive repeats merged
+    and capped at max_path entries.
+    """
+    default_gap = datetime.timedelta(minutes=30)
+    default_max_path = 100
+
+    def __init__(self, gap: Optional[datetime.timedelta] = None, max_path: Optional[int] = None):
+        self.gap = gap if gap is not None else self.default_gap
+        self.max_path = max_path if max_path is not None else self.default_max_path
+        self.open_visits: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def close(self, visit: Dict[str, Any]) -> Dict[str, Any]:
+        visit["dwell_seconds"] = (visit["end"] - visit["start"]).total_seconds()
+        return visit
+
+    def feed(self, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Add one event, returns the visits it closes"""
+        timestamp = event["timestamp"]
+        closed = []
+        # Open visits are ordered by their last event, stale ones are at the front
+        while self.open_visits:
+            visit = next(iter(self.open_visits.values()))
+            if timestamp - visit["end"] <= self.gap:
+                break
+            self.open_visits.popitem(last=False)
+            closed.append(self.close(visit))
+
+        face_id = event["face_id"]
+        camera_id = event.get("camera_id")
+        visit = self.open_visits.pop(face_id, None)
+        if visit is None:
+            visit = {
+                "face_id": face_id,
+                "start": timestamp,
+                "end": timestamp,
+                "event_count": 0,
+                "cameras": []
+            }
+        visit["end"] = timestamp
+        visit["event_count"] += 1
+        cameras = visit["cameras"]
+        if (not cameras or cameras[-1] != camera_id) and len(cameras) < self.max_path:
+            cameras.append(camera_id)
+        self.open_visits[face_id] = visit
+        return closed
+
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """Close every open visit, e.g. at the end of the input"""
+        while self.open_visits:
+            yield self.close(self.open_visits.popitem(last=False)[1])
+
+
+def sessionize(
+        events: Iterable[Dict[str, Any]],
+        gap: Optional[datetime.timedelta] = None,
+        max_path: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+    """
+    Visits of a timestamp-ordered event stream, see Sessionizer
+
+    Parameters:
+    - events: face_events with face_id, camera_id and timestamp, sorted by timestamp
+    - gap: Longest pause between two events of the same visit
+    - max_path: Longest camera path kept per visit
+    """
+    sessionizer = Sessionizer(gap, max_path)
+    for event in events:
+        yield from sessionizer.feed(event)
+    yield from sessionizer.flush()
+
+
+def build_session_pipeline(
+        match: Dict[str, Any],
+        gap: Optional[datetime.timedelta] = None,
+        max_path: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+    """
+    Aggregation computing the visits of the face_events matching match
+
+    $setWindowFields numbers each face's visits by comparing every event with
+    the face's previous one, the events are then grouped per visit. Produces
+    the same visits as sessionize, ordered by start rather than by closing.
+    """
+    gap = gap if gap is not None else Sessionizer.default_gap
+    max_path = max_path if max_path is not None else Sessionizer.default_max_path
+    return [
+        {"$match": match},
+        {
+            "$setWindowFields": {
+                "partitionBy": "$face_id",
+                "sortBy": {"timestamp": 1},
+                "output": {
+                    "previous": {"$shift": {"output": "$timestamp", "by": -1}}
+                }
+            }
+        },
+        {
+            "$set": {
+                "new_visit": {
+                    "$cond": [
+                        {
+                            "$or": [
+                                {"$eq": [{"$ifNull": ["$previous", None]}, None]},
+                                {"$gt": [{"$subtract": ["$timestamp", "$previous"]}, gap.total_seconds() * 1000]}
+                            ]
+                        },
+                        1,
+                        0
+                    ]
+                }
+            }
+        },
+        {
+            "$setWindowFields": {
+                "partitionBy": "$face_id",
+                "sortBy": {"timestamp": 1},
+                "output": {
+                    "visit": {"$sum": "$new_visit", "window": {"documents": ["unbounded", "current"]}}
+                }
+            }
+        },
+        # Keeps the pushed camera path in event order
+        {"$sort": {"face_id": 1, "timestamp": 1}},
+        {
+            "$group": {
+                "_id": {"face_id": "$face_id", "visit": "$visit"},
+                "start": {"$min": "$timestamp"},
+                "end": {"$max": "$timestamp"},
+                "event_count": {"$sum": 1},
+                "cameras": {"$push": "$camera_id"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "face_id": "$_id.face_id",
+                "start": 1,
+                "end": 1,
+                "dwell_seconds": {"$divide": [{"$subtract": ["$end", "$start"]}, 1000]},
+                "event_count": 1,
+                "cameras": {
+                    "$slice": [
+                        {
+                            "$reduce": {
+                                "input": "$cameras",
+                                "initialValue": [],
+                                "in": {
+                                    "$cond": [
+                                        {"$eq": [{"$arrayElemAt": ["$$value", -1]}, "$$this"]},
+                                        "$$value",
+                                        {"$concatArrays": ["$$value", ["$$this"]]}
+                                    ]
+                                }
+                            }
+                        },
+                        max_path
+                    ]
+                }
+            }
+        },
+        {"$sort": {"start": 1, "face_id": 1}}
+    ]
+
+
+def face_visits(
+        mongo_client,
+        db_name: str,
+        query: Dict[str, Any],
+        gap: Optional[datetime.timedelta] = None,
+        engine: str = "pipeline",
+        batch_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+    """
+    Visits of the face_events matching query
+
+    "pipeline" sessionizes on the server with build_session_pipeline, "stream"
+    (and the fallback when the aggregation fails, e.g. before MongoDB 5.0)
+    streams the events in timestamp order through sessionize.
+    """
+    if engine == "pipeline":
+        visits = mongo_client.aggregate_iter(
+            db_name=db_name,
+            col_name="face_events",
+            query=build_session_pipeline(query, gap),
+            batch_size=batch_size
+        )
+        if visits["status"]:
+            return visits["result"]
+
+    face_events = mongo_client.find_iter(
+        db_name=db_name,
+        col_name="face_events",
+        query=query,
+        projection={"_id": 0, "face_id": 1, "camera_id": 1, "timestamp": 1},
+        sort_data=[("timestamp", 1)],
+        batch_size=batch_size
+    )
+    if not face_events["status"]:
+        raise RuntimeError(f"Failed to read face_events: {face_events.get('error')}")
+    return sessionize(face_events["result"], gap)
+
+
+def dwell_distribution(visits: Iterable[Dict[str, Any]], bucket: datetime.timedelta = datetime.timedelta(minutes=5)) -> Dict[int, int]:
+    """Visit count per dwell bucket, keyed by the bucket's lower bound in minutes"""
+    bucket_seconds = bucket.total_seconds()
+    distribution: Dict[int, int] = {}
+    for visit in visits:
+        lower = int(visit["dwell_seconds"] // bucket_seconds * bucket_seconds // 60)
+        distribution[lower] = distribution.get(lower, 0) + 1
+    return dict(sorted(distribution.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dwell time distribution of every visit in a time range")
+    parser.add_argument("--host", default="localhost", help="MongoDB host")
+    parser.add_argument("--port", type=int, default=27017, help="MongoDB port")
+    parser.add_argument("--db", default="distill_db", help="Database name")
+    parser.add_argument("--username", default="", help="MongoDB username")
+    parser.add_argument("--password", default="", help="MongoDB password")
+    parser.add_argument("--auth", default="admin", help="Authentication database")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, required=True, help="Start of the range")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, required=True, help="End of the range, exclusive")
+    parser.add_argument("--cameras", nargs="*", help="Only these camera_ids, the whole store by default")
+    parser.add_argument("--gap-minutes", type=float, help="Longest pause within a visit")
+    parser.add_argument("--bucket-minutes", type=float, default=5, help="Width of a dwell bucket")
+    parser.add_argument("--engine", choices=["pipeline", "stream"], default="pipeline", help="Sessionize on the server or the client")
+    args = parser.parse_args()
+
+    mongo_client = MongoDB()
+    mongo_client.setup_db(
+        username=args.username,
+        password=args.password,
+        host=args.host,
+        port=args.port,
+        auth=args.auth,
+    )
+    query = {"timestamp": {"$gte": args.since, "$lt": args.until}}
+    if args.cameras:
+        query["camera_id"] = {"$in": args.cameras}
+    gap = datetime.timedelta(minutes=args.gap_minutes) if args.gap_minutes is not None else None
+    visits = face_visits(mongo_client, args.db, query, gap, engine=args.engine)
+    print(dwell_distribution(visits, datetime.timedelta(minutes=args.bucket_minutes)))
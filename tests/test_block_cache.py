@@ -0,0 +1,111 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block_cache import BlockResultCache
+from db import MongoDB
+
+
+DB = "distill_db"
+CAMERAS = ["C-1", "C-2"]
+START = datetime.datetime(2025, 2, 11)
+TIME_BLOCKS = [
+    {"from": START + datetime.timedelta(days=day), "to": START + datetime.timedelta(days=day + 1)}
+    for day in range(3)
+]
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(MongoDB, "target", ("localhost", 27017))
+    BlockResultCache.clear()
+    yield BlockResultCache
+    BlockResultCache.clear()
+
+
+class Engine:
+    """Compute callable recording the blocks it was asked for"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, time_blocks):
+        self.calls.append([block["from"].day for block in time_blocks])
+        return {
+            "blocks": [{"count": block["from"].day} for block in time_blocks],
+            "distinct_faces": len(time_blocks)
+        }
+
+
+def cached(engine, metric="CustomerCountMetric", db_name=DB):
+    return BlockResultCache.cached_block_stats(db_name, metric, CAMERAS, TIME_BLOCKS, "daily", engine)
+
+
+def test_closed_blocks_are_served_from_the_cache():
+    engine = Engine()
+    first = cached(engine)
+    second = cached(engine)
+    assert engine.calls == [[11, 12, 13]]
+    assert second["blocks"] == first["blocks"]
+
+
+def test_inserted_event_drops_its_block():
+    engine = Engine()
+    cached(engine)
+    MongoDB.notify_write(DB, "face_events", None, [{"camera_id": "C-1", "timestamp": START + datetime.timedelta(days=1, hours=9)}])
+    cached(engine)
+    assert engine.calls == [[11, 12, 13], [12]]
+
+
+def test_inserted_event_of_another_camera_or_database_keeps_the_blocks():
+    engine = Engine()
+    cached(engine)
+    MongoDB.notify_write(DB, "face_events", None, [{"camera_id": "C-9", "timestamp": START + datetime.timedelta(hours=9)}])
+    MongoDB.notify_write("other_db", "face_events", None, [{"camera_id": "C-1", "timestamp": START + datetime.timedelta(hours=9)}])
+    cached(engine)
+    assert engine.calls == [[11, 12, 13]]
+
+
+@pytest.mark.parametrize("documents", [[{"camera_id": "C-9"}], None])
+def test_event_update_or_delete_drops_every_block_of_the_database(documents):
+    engine = Engine()
+    other = Engine()
+    cached(engine)
+    cached(other, db_name="other_db")
+    MongoDB.notify_write(DB, "face_events", {"track_id": "T-1"}, documents)
+    cached(engine)
+    cached(other, db_name="other_db")
+    assert engine.calls == [[11, 12, 13], [11, 12, 13]]
+    assert other.calls == [[11, 12, 13]]
+
+
+def test_relabelled_identity_drops_only_the_metrics_reading_labels():
+    customers = Engine()
+    employees = Engine()
+    cached(customers)
+    cached(employees, metric="EmployeeCountMetric")
+    MongoDB.notify_write(DB, "face_identities", {"face_id": "F-1"}, [{"labels": ["staff"]}])
+    cached(customers)
+    cached(employees, metric="EmployeeCountMetric")
+    assert customers.calls == [[11, 12, 13]]
+    assert employees.calls == [[11, 12, 13], [11, 12, 13]]
+
+
+def test_inserted_identity_drops_the_blocks_from_its_first_seen():
+    engine = Engine()
+    cached(engine)
+    MongoDB.notify_write(DB, "face_identities", None, [{"face_id": "F-9", "first_seen": START + datetime.timedelta(days=1, hours=9)}])
+    cached(engine)
+    assert engine.calls == [[11, 12, 13], [12, 13]]
+
+
+def test_unrelated_identity_fields_keep_the_blocks():
+    engine = Engine()
+    cached(engine)
+    MongoDB.notify_write(DB, "face_identities", {"face_id": "F-1"}, [{"metadata.notes": "x"}])
+    cached(engine)
+    assert engine.calls == [[11, 12, 13]]
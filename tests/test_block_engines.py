@@ -0,0 +1,143 @@
+import datetime
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from time_buckets import BlockBucketer, as_utc, bucket_event_faces, summarize_block_faces
+
+np = pytest.importorskip("numpy")
+
+from numpy_engine import BlockProcessPool, EventColumns, NumpyBlockEngine
+
+
+UTC = datetime.timezone.utc
+START = datetime.datetime(2025, 2, 11, 3, 30, tzinfo=UTC)
+DUE = datetime.datetime(2025, 2, 25, tzinfo=UTC)
+
+
+def time_blocks(width):
+    """Contiguous blocks of width from START, the last one cut at DUE"""
+    blocks = []
+    current = START
+    while current < DUE:
+        blocks.append({"from": current, "to": min(current + width, DUE)})
+        current += width
+    return blocks
+
+
+def make_events(count=3000, seed=7):
+    """
+    Events as pymongo returns them, naive UTC, some timezone aware
+
+    Includes events before the first block, on block starts and at the due
+    time, which falls outside the last block.
+    """
+    generator = random.Random(seed)
+    span = (DUE - START).total_seconds()
+    events = []
+    for index in range(count):
+        timestamp = START + datetime.timedelta(seconds=generator.uniform(-3600, span))
+        events.append({
+            "face_id": f"F-{generator.randint(1, 60)}",
+            "camera_id": f"C-{generator.randint(1, 4)}",
+            "timestamp": timestamp if index % 5 == 0 else as_utc(timestamp, naive=True)
+        })
+    for timestamp in (START, START + datetime.timedelta(days=1), DUE):
+        events.append({"face_id": "F-1", "camera_id": "C-1", "timestamp": as_utc(timestamp, naive=True)})
+    return events
+
+
+def make_identities():
+    """Identities of part of the faces, some without first_seen, as pymongo returns them"""
+    generator = random.Random(11)
+    identities = []
+    for number in range(1, 51):
+        first_seen = None
+        if number % 7:
+            first_seen = as_utc(START + datetime.timedelta(hours=generator.uniform(-48, 14 * 24)), naive=True)
+        identities.append({"face_id": f"F-{number}", "first_seen": first_seen, "labels": ["staff"] if number % 3 == 0 else []})
+    # First seen exactly at a block start, where F-1 also has an event
+    identities[0]["first_seen"] = as_utc(START + datetime.timedelta(days=1), naive=True)
+    return identities
+
+
+def reference_block_faces(events, blocks):
+    """Distinct faces per block by comparing every event with every block"""
+    block_faces = [set() for _ in blocks]
+    for event in events:
+        timestamp = as_utc(event["timestamp"], naive=False)
+        for index, block in enumerate(blocks):
+            if block["from"] <= timestamp < block["to"]:
+                block_faces[index].add(event["face_id"])
+    return block_faces
+
+
+def reference_stats(blocks, events, identities, labels=None):
+    block_faces = reference_block_faces(events, blocks)
+    if labels:
+        allowed = {identity["face_id"] for identity in identities if set(labels).issubset(identity["labels"])}
+        block_faces = [faces & allowed for faces in block_faces]
+    first_seen_map = {
+        identity["face_id"]: as_utc(identity["first_seen"], naive=False) if identity["first_seen"] else None
+        for identity in identities
+    }
+    return summarize_block_faces(blocks, block_faces, first_seen_map, with_faces=True)
+
+
+def normalized(stats):
+    """Block stats with the faces of each block sorted, engines return them in any order"""
+    return {
+        "blocks": [dict(block_stats, faces=sorted(block_stats["faces"])) for block_stats in stats["blocks"]],
+        "distinct_faces": stats["distinct_faces"]
+    }
+
+
+WIDTHS = {"hourly": datetime.timedelta(hours=1), "daily": datetime.timedelta(days=1), "weekly": datetime.timedelta(weeks=1)}
+
+
+@pytest.mark.parametrize("base_time", list(WIDTHS))
+def test_bucketer_matches_the_reference(base_time):
+    blocks = time_blocks(WIDTHS[base_time])
+    events = make_events()
+    expected = reference_block_faces(events, blocks)
+
+    one_by_one = BlockBucketer(blocks)
+    for event in events:
+        one_by_one.feed(event)
+    assert one_by_one.block_faces == expected
+    assert bucket_event_faces(iter(events), blocks) == expected
+
+
+@pytest.mark.parametrize("base_time", list(WIDTHS))
+@pytest.mark.parametrize("labels", [None, ["staff"]])
+def test_numpy_engine_matches_summarize_block_faces(base_time, labels):
+    blocks = time_blocks(WIDTHS[base_time])
+    events = make_events()
+    identities = make_identities()
+    engine = NumpyBlockEngine(["C-1", "C-2", "C-3", "C-4"], blocks, START, DUE, labels=labels, with_faces=True)
+    stats = engine.compute(EventColumns.from_events(events), identities)
+    assert normalized(stats) == normalized(reference_stats(blocks, events, identities, labels))
+
+
+def test_block_process_pool_matches_summarize_block_faces():
+    blocks = time_blocks(WIDTHS["hourly"])
+    assert len(blocks) >= BlockProcessPool.min_blocks
+    events = make_events()
+    identities = make_identities()
+    engine = NumpyBlockEngine(["C-1", "C-2", "C-3", "C-4"], blocks, START, DUE, with_faces=True, block_workers=2)
+    try:
+        stats = engine.compute(EventColumns.from_events(events), identities)
+    finally:
+        BlockProcessPool.shutdown()
+    assert normalized(stats) == normalized(reference_stats(blocks, events, identities))
+
+
+def test_numpy_engine_without_events():
+    blocks = time_blocks(WIDTHS["daily"])
+    engine = NumpyBlockEngine(["C-1"], blocks, START, DUE, with_faces=True)
+    stats = engine.compute(EventColumns.from_events([]), make_identities())
+    assert stats == summarize_block_faces(blocks, [set() for _ in blocks], {}, with_faces=True)
@@ -0,0 +1,136 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import MongoDB
+from identity_cache import IdentitySnapshot
+
+
+DB = "distill_db"
+LONG_AGO = datetime.datetime(2025, 2, 11)
+
+
+def matches(document, query):
+    """Evaluate the subset of MongoDB query syntax used by IdentitySnapshot"""
+    if "$or" in query:
+        return any(matches(document, branch) for branch in query["$or"])
+    for key, condition in query.items():
+        value = document.get(key)
+        if "$in" in condition and value not in condition["$in"]:
+            return False
+        if "$gt" in condition and (value is None or not value > condition["$gt"]):
+            return False
+    return True
+
+
+class Client:
+    """face_identities held in memory behind the MongoDB find/find_iter results"""
+
+    def __init__(self, identities):
+        self.identities = {identity["face_id"]: identity for identity in identities}
+        self.reads = []
+        self.fail = False
+
+    def read(self, name, col_name, query, projection):
+        self.reads.append((name, query))
+        if self.fail:
+            return {"status": False, "error": "unavailable"}
+        assert col_name == "face_identities"
+        return {
+            "status": True,
+            "result": [
+                {field: identity[field] for field in projection if projection[field] and field in identity}
+                for identity in self.identities.values() if matches(identity, query)
+            ]
+        }
+
+    def find(self, db_name, col_name, query, projection=None):
+        return self.read("find", col_name, query, projection)
+
+    def find_iter(self, db_name, col_name, query, projection=None, batch_size=1000):
+        result = self.read("find_iter", col_name, query, projection)
+        if result["status"]:
+            result["result"] = iter(result["result"])
+        return result
+
+    def touch(self, face_id, **fields):
+        """Change an identity the way ingestion does, moving last_seen to now"""
+        self.identities[face_id].update(fields, last_seen=IdentitySnapshot._now() + datetime.timedelta(seconds=1))
+
+
+@pytest.fixture(autouse=True)
+def snapshot(monkeypatch):
+    monkeypatch.setattr(MongoDB, "target", ("localhost", 27017))
+    monkeypatch.setattr(IdentitySnapshot, "_snapshots", {})
+    monkeypatch.setattr(IdentitySnapshot, "_watermarks", {})
+    monkeypatch.setattr(IdentitySnapshot, "_refreshed_at", {})
+    return IdentitySnapshot
+
+
+@pytest.fixture
+def client():
+    return Client([
+        {"face_id": face_id, "first_seen": LONG_AGO, "last_seen": LONG_AGO, "labels": []}
+        for face_id in ("F-1", "F-2", "F-3")
+    ])
+
+
+def labels(identities):
+    return {identity["face_id"]: identity["labels"] for identity in identities}
+
+
+def test_misses_are_loaded_once(client):
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1", "F-2", "F-9"])) == {"F-1": [], "F-2": []}
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1", "F-9"])) == {"F-1": []}
+    assert [name for name, _ in client.reads] == ["find"]
+
+
+def test_refresh_updates_only_cached_faces_changed_since_the_watermark(client):
+    IdentitySnapshot.get_identities(client, DB, ["F-1", "F-2"])
+    client.touch("F-1", labels=["staff"])
+    client.touch("F-3", labels=["staff"])
+    assert IdentitySnapshot.refresh(client, DB, force=True) == 1
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1", "F-2"])) == {"F-1": ["staff"], "F-2": []}
+    assert [name for name, _ in client.reads] == ["find", "find_iter"]
+    # F-3 was not cached, it is loaded on its first lookup
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-3"])) == {"F-3": ["staff"]}
+
+
+def test_refresh_reads_from_the_previous_watermark(client):
+    IdentitySnapshot.get_identities(client, DB, ["F-1"])
+    IdentitySnapshot.refresh(client, DB, force=True)
+    IdentitySnapshot.refresh(client, DB, force=True)
+    first, second = [query for name, query in client.reads if name == "find_iter"]
+    assert first["$or"][0]["last_seen"]["$gt"] < second["$or"][0]["last_seen"]["$gt"]
+    # Nothing changed since the first refresh
+    assert IdentitySnapshot.refresh(client, DB, force=True) == 0
+
+
+def test_refresh_waits_for_the_interval(client, monkeypatch):
+    IdentitySnapshot.get_identities(client, DB, ["F-1"])
+    client.touch("F-1", labels=["staff"])
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1"])) == {"F-1": []}
+    monkeypatch.setattr(IdentitySnapshot, "refresh_interval", 0.0)
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1"])) == {"F-1": ["staff"]}
+
+
+def test_failed_refresh_keeps_the_watermark(client):
+    IdentitySnapshot.get_identities(client, DB, ["F-1"])
+    client.touch("F-1", labels=["staff"])
+    client.fail = True
+    assert IdentitySnapshot.refresh(client, DB, force=True) == 0
+    client.fail = False
+    assert IdentitySnapshot.refresh(client, DB, force=True) == 1
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1"])) == {"F-1": ["staff"]}
+
+
+def test_identity_writes_drop_the_written_faces(client):
+    IdentitySnapshot.get_identities(client, DB, ["F-1", "F-2"])
+    client.identities["F-1"]["labels"] = ["staff"]
+    MongoDB.notify_write(DB, "face_identities", {"face_id": "F-1"}, [{"labels": ["staff"]}])
+    assert labels(IdentitySnapshot.get_identities(client, DB, ["F-1", "F-2"])) == {"F-1": ["staff"], "F-2": []}
+    assert client.reads[-1] == ("find", {"face_id": {"$in": ["F-1"]}})
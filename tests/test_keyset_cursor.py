@@ -0,0 +1,117 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyset_cursor import decode_cursor, encode_cursor, face_id_bound, keyset_match
+
+
+SORT_BYS = ["visit_count", "_id", "group_id"]
+ORDERS = ["asc", "desc"]
+SORTS = list(itertools.product(SORT_BYS, ORDERS))
+
+ROWS = [
+    {"_id": face_id, "group_id": group_id, "visit_count": visit_count}
+    for face_id, group_id, visit_count in itertools.product(["F1", "F2", "F3"], ["G1", "G2"], [1, 2])
+    # One row per (face, group), visit counts repeat across faces
+    if visit_count == (int(face_id[1]) + int(group_id[1])) % 2 + 1
+]
+
+
+def listing_order(rows, sort_by, order):
+    """Rows in the order of the listing $sort: sort_by, then _id and group_id ascending"""
+    rows = sorted(rows, key=lambda row: (row["_id"], row["group_id"]))
+    return sorted(rows, key=lambda row: row[sort_by], reverse=order == "desc")
+
+
+def matches(row, query):
+    """Evaluate the subset of MongoDB query syntax produced by keyset_match"""
+    if "$or" in query:
+        return any(matches(row, branch) for branch in query["$or"])
+    for key, condition in query.items():
+        if isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator == "$gt" and not row[key] > value:
+                    return False
+                if operator == "$lt" and not row[key] < value:
+                    return False
+        elif row[key] != condition:
+            return False
+    return True
+
+
+@pytest.mark.parametrize("sort_by,order", SORTS)
+def test_cursor_round_trip(sort_by, order):
+    row = ROWS[0]
+    cursor = decode_cursor(encode_cursor(sort_by, order, row), sort_by, order)
+    assert cursor == {
+        "sort_by": sort_by,
+        "order": order,
+        "value": row[sort_by],
+        "face_id": row["_id"],
+        "group_id": row["group_id"]
+    }
+
+
+@pytest.mark.parametrize("sort_by,order", SORTS)
+def test_decode_rejects_other_sort(sort_by, order):
+    token = encode_cursor(sort_by, order, ROWS[0])
+    other_order = "asc" if order == "desc" else "desc"
+    with pytest.raises(ValueError):
+        decode_cursor(token, sort_by, other_order)
+    other_sort_by = next(other for other in SORT_BYS if other != sort_by)
+    with pytest.raises(ValueError):
+        decode_cursor(token, other_sort_by, order)
+
+
+def test_decode_rejects_invalid_token():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", "_id", "asc")
+
+
+def test_order_defaults_to_asc():
+    token = encode_cursor("_id", None, ROWS[0])
+    assert decode_cursor(token, "_id", "asc")["order"] == "asc"
+
+
+@pytest.mark.parametrize("sort_by,order", SORTS)
+def test_keyset_match_keeps_exactly_the_following_rows(sort_by, order):
+    ordered = listing_order(ROWS, sort_by, order)
+    for index, row in enumerate(ordered):
+        cursor = decode_cursor(encode_cursor(sort_by, order, row), sort_by, order)
+        query = keyset_match(sort_by, order, cursor)
+        after = [candidate for candidate in ordered if matches(candidate, query)]
+        assert after == ordered[index + 1:]
+
+
+@pytest.mark.parametrize("sort_by,order", SORTS)
+def test_keyset_match_writes_each_key_once_per_branch(sort_by, order):
+    cursor = decode_cursor(encode_cursor(sort_by, order, ROWS[0]), sort_by, order)
+    branches = keyset_match(sort_by, order, cursor)["$or"]
+    assert len(branches) == (2 if sort_by in ("_id", "group_id") else 3)
+    for branch in branches:
+        # The last key of a branch is the one compared, all others are equalities
+        *equalities, compared = branch.items()
+        assert all(not isinstance(value, dict) for _, value in equalities)
+        assert isinstance(compared[1], dict)
+
+
+@pytest.mark.parametrize("sort_by,order", SORTS)
+def test_face_id_bound(sort_by, order):
+    assert face_id_bound(sort_by, order, None) is None
+    cursor = decode_cursor(encode_cursor(sort_by, order, ROWS[2]), sort_by, order)
+    bound = face_id_bound(sort_by, order, cursor)
+    if sort_by != "_id":
+        assert bound is None
+        return
+    assert bound == {"$lte" if order == "desc" else "$gte": ROWS[2]["_id"]}
+    # The bound never drops a face still to be listed
+    ordered = listing_order(ROWS, sort_by, order)
+    query = keyset_match(sort_by, order, cursor)
+    for row in ordered:
+        if matches(row, query):
+            operator, value = next(iter(bound.items()))
+            assert row["_id"] >= value if operator == "$gte" else row["_id"] <= value
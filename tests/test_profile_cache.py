@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import MongoDB
+from profile_cache import ProfileCache
+
+
+DB = "distill_db"
+
+
+class Client:
+    """face_identities held in memory behind the MongoDB find_iter result"""
+
+    def __init__(self):
+        self.identities = {
+            face_id: {"face_id": face_id, "username": face_id.lower(), "labels": [], "metadata": {}}
+            for face_id in ("F-1", "F-2")
+        }
+        self.reads = []
+
+    def find_iter(self, db_name, col_name, query, projection=None, batch_size=1000):
+        face_ids = query["face_id"]["$in"]
+        self.reads.append(face_ids)
+        return {"status": True, "result": iter([dict(self.identities[face_id]) for face_id in face_ids if face_id in self.identities])}
+
+
+@pytest.fixture(autouse=True)
+def profiles(monkeypatch):
+    monkeypatch.setattr(MongoDB, "target", ("localhost", 27017))
+    monkeypatch.setattr(ProfileCache, "_profiles", {})
+    monkeypatch.setattr(ProfileCache, "_generations", {})
+    return ProfileCache
+
+
+def usernames(profiles):
+    return {face_id: profile and profile["username"] for face_id, profile in profiles.items()}
+
+
+def test_misses_are_read_with_one_query():
+    client = Client()
+    assert usernames(ProfileCache.get_profiles(client, DB, ["F-1", "F-9", "F-1"])) == {"F-1": "f-1", "F-9": None}
+    assert usernames(ProfileCache.get_profiles(client, DB, ["F-9", "F-2", "F-1"])) == {"F-9": None, "F-2": "f-2", "F-1": "f-1"}
+    assert client.reads == [["F-1", "F-9"], ["F-2"]]
+
+
+def test_identity_writes_drop_the_written_profiles():
+    client = Client()
+    ProfileCache.get_profiles(client, DB, ["F-1", "F-2"])
+    client.identities["F-1"]["username"] = "renamed"
+    MongoDB.notify_write(DB, "face_identities", {"face_id": "F-1"}, [{"username": "renamed"}])
+    assert usernames(ProfileCache.get_profiles(client, DB, ["F-1", "F-2"])) == {"F-1": "renamed", "F-2": "f-2"}
+    assert client.reads[-1] == ["F-1"]
+
+
+def test_writes_to_other_databases_keep_the_profiles():
+    client = Client()
+    ProfileCache.get_profiles(client, DB, ["F-1"])
+    MongoDB.notify_write("other_db", "face_identities", {"face_id": "F-1"}, [{"username": "renamed"}])
+    ProfileCache.get_profiles(client, DB, ["F-1"])
+    assert client.reads == [["F-1"]]
+
+
+def test_profiles_expire_after_ttl(monkeypatch):
+    client = Client()
+    ProfileCache.get_profiles(client, DB, ["F-1"])
+    monkeypatch.setattr(ProfileCache, "ttl", -1.0)
+    ProfileCache.get_profiles(client, DB, ["F-1"])
+    assert client.reads == [["F-1"], ["F-1"]]
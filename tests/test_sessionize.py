@@ -0,0 +1,170 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sessionize import Sessionizer, build_session_pipeline, dwell_distribution, sessionize
+
+
+GAP = datetime.timedelta(minutes=30)
+START = datetime.datetime(2025, 2, 11, 9, 0)
+
+
+def at(minutes, face_id="F-1", camera_id="C-1"):
+    return {"face_id": face_id, "camera_id": camera_id, "timestamp": START + datetime.timedelta(minutes=minutes)}
+
+
+def evaluate(expression, document, variables=None):
+    """Evaluate the subset of aggregation expressions produced by build_session_pipeline"""
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        return variables[expression[2:]]
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = document
+        for key in expression[1:].split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+    if isinstance(expression, list):
+        return [evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if not next(iter(expression), "").startswith("$"):
+        return {key: evaluate(value, document, variables) for key, value in expression.items()}
+    operator, operand = next(iter(expression.items()))
+    if operator == "$reduce":
+        value = evaluate(operand["initialValue"], document, variables)
+        for this in evaluate(operand["input"], document, variables):
+            value = evaluate(operand["in"], document, dict(variables, value=value, this=this))
+        return value
+    if operator == "$cond":
+        condition, then, otherwise = operand
+        return evaluate(then if evaluate(condition, document, variables) else otherwise, document, variables)
+    args = evaluate(operand, document, variables)
+    if operator == "$or":
+        return any(args)
+    if operator == "$eq":
+        return args[0] == args[1]
+    if operator == "$gt":
+        # null sorts below every number
+        if args[0] is None or args[1] is None:
+            return args[0] is not None
+        return args[0] > args[1]
+    if operator == "$ifNull":
+        return args[1] if args[0] is None else args[0]
+    if operator == "$subtract":
+        if None in args:
+            return None
+        difference = args[0] - args[1]
+        return difference.total_seconds() * 1000 if isinstance(difference, datetime.timedelta) else difference
+    if operator == "$divide":
+        return args[0] / args[1]
+    if operator == "$arrayElemAt":
+        return args[0][args[1]] if -len(args[0]) <= args[1] < len(args[0]) else None
+    if operator == "$concatArrays":
+        return [item for array in args for item in array]
+    if operator == "$slice":
+        return args[0][:args[1]]
+    raise NotImplementedError(operator)
+
+
+def run_pipeline(pipeline, documents):
+    """Run the stages produced by build_session_pipeline over documents"""
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            documents = [document for document in documents if all(document.get(key) == value for key, value in spec.items())]
+        elif name == "$setWindowFields":
+            (sort_key, _), = spec["sortBy"].items()
+            partitions = {}
+            for document in sorted(documents, key=lambda document: document[sort_key]):
+                partitions.setdefault(evaluate(spec["partitionBy"], document), []).append(document)
+            documents = []
+            for partition in partitions.values():
+                for index, document in enumerate(partition):
+                    document = dict(document)
+                    for field, window in spec["output"].items():
+                        if "$shift" in window:
+                            shifted = index + window["$shift"]["by"]
+                            document[field] = evaluate(window["$shift"]["output"], partition[shifted]) if 0 <= shifted < len(partition) else None
+                        else:
+                            assert window["window"] == {"documents": ["unbounded", "current"]}
+                            document[field] = sum(evaluate(window["$sum"], previous) for previous in partition[:index + 1])
+                    documents.append(document)
+        elif name == "$set":
+            documents = [dict(document, **{field: evaluate(value, document) for field, value in spec.items()}) for document in documents]
+        elif name == "$sort":
+            for key, direction in reversed(list(spec.items())):
+                documents = sorted(documents, key=lambda document: document[key], reverse=direction < 0)
+        elif name == "$group":
+            groups = {}
+            for document in documents:
+                key = evaluate(spec["_id"], document)
+                group = groups.setdefault(repr(key), {"_id": key})
+                for field, accumulator in spec.items():
+                    if field == "_id":
+                        continue
+                    (operator, argument), = accumulator.items()
+                    value = evaluate(argument, document)
+                    if operator == "$push":
+                        group.setdefault(field, []).append(value)
+                    elif operator == "$sum":
+                        group[field] = group.get(field, 0) + value
+                    elif operator == "$min":
+                        group[field] = min(group.get(field, value), value)
+                    elif operator == "$max":
+                        group[field] = max(group.get(field, value), value)
+            documents = list(groups.values())
+        elif name == "$project":
+            documents = [
+                {
+                    field: document[field] if value == 1 else evaluate(value, document)
+                    for field, value in spec.items() if value != 0
+                }
+                for document in documents
+            ]
+        else:
+            raise NotImplementedError(name)
+    return documents
+
+
+EVENT_SETS = {
+    "exactly the gap stays one visit": [at(0), at(30), at(60)],
+    "just over the gap splits": [at(0), at(30), at(60.5)],
+    "interleaved faces": [
+        at(0, "F-1"), at(10, "F-2"), at(25, "F-1", "C-2"), at(50, "F-2"),
+        at(56, "F-1", "C-2"), at(80.5, "F-2"), at(120, "F-1")
+    ],
+    "camera path keeps order and merges repeats": [
+        at(0, camera_id="C-1"), at(5, camera_id="C-1"), at(10, camera_id="C-2"),
+        at(15, camera_id="C-1"), at(100, camera_id="C-3")
+    ],
+}
+
+
+@pytest.mark.parametrize("name", list(EVENT_SETS))
+def test_sessionize_and_pipeline_split_the_same_visits(name):
+    events = EVENT_SETS[name]
+    streamed = sorted(sessionize(events, GAP), key=lambda visit: (visit["start"], visit["face_id"]))
+    aggregated = run_pipeline(build_session_pipeline({}, GAP), [dict(event) for event in events])
+    assert aggregated == streamed
+
+
+def test_gap_boundary():
+    visits = list(sessionize([at(0), at(30), at(60.5)], GAP))
+    assert [(visit["event_count"], visit["dwell_seconds"]) for visit in visits] == [(2, 1800.0), (1, 0.0)]
+
+
+def test_feed_records_the_event_without_consuming_the_result():
+    sessionizer = Sessionizer(GAP)
+    sessionizer.feed(at(0))
+    closed = sessionizer.feed(at(45, "F-2"))
+    assert [visit["face_id"] for visit in closed] == ["F-1"]
+    assert [visit["face_id"] for visit in sessionizer.flush()] == ["F-2"]
+
+
+def test_dwell_distribution():
+    visits = [{"dwell_seconds": seconds} for seconds in (0, 299, 300, 1200)]
+    assert dwell_distribution(visits) == {0: 2, 5: 1, 20: 1}
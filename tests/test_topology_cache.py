@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import MongoDB
+from topology_cache import CameraTopology
+
+
+DB = "distill_db"
+
+
+class Client:
+    """cam_groups and cameras held in memory behind the MongoDB find result"""
+
+    def __init__(self):
+        self.collections = {
+            "cam_groups": [{"group_id": "G-1", "name": "Entrance"}, {"group_id": "G-2", "name": "Floor"}],
+            "cameras": [
+                {"camera_id": "C-1", "group_id": "G-1"},
+                {"camera_id": "C-2", "group_id": "G-2"},
+                {"camera_id": "C-3", "group_id": "G-2"}
+            ]
+        }
+        self.reads = 0
+
+    def find(self, db_name, col_name, query, projection=None):
+        self.reads += 1
+        return {"status": True, "result": [dict(document) for document in self.collections[col_name]]}
+
+
+@pytest.fixture(autouse=True)
+def topology(monkeypatch):
+    monkeypatch.setattr(MongoDB, "target", ("localhost", 27017))
+    monkeypatch.setattr(CameraTopology, "_snapshots", {})
+    return CameraTopology
+
+
+def test_topology_is_read_once():
+    client = Client()
+    assert CameraTopology.group_camera_ids(client, DB, ["G-2", "G-9"]) == {"G-2": ["C-2", "C-3"], "G-9": []}
+    assert CameraTopology.camera_ids(client, DB, ["G-1", "G-2", "G-1"]) == ["C-1", "C-2", "C-3"]
+    assert [group["name"] for group in CameraTopology.groups(client, DB, ["G-2", "G-9"])] == ["Floor"]
+    assert client.reads == 2
+
+
+def test_camera_writes_reload_the_topology():
+    client = Client()
+    version = CameraTopology.get(client, DB)["version"]
+    client.collections["cameras"].append({"camera_id": "C-4", "group_id": "G-1"})
+    MongoDB.notify_write(DB, "cameras", None, [{"camera_id": "C-4", "group_id": "G-1"}])
+    assert CameraTopology.camera_ids(client, DB, ["G-1"]) == ["C-1", "C-4"]
+    assert CameraTopology.get(client, DB)["version"] > version
+
+
+def test_other_writes_keep_the_topology():
+    client = Client()
+    CameraTopology.get(client, DB)
+    MongoDB.notify_write(DB, "face_events", None, [{"camera_id": "C-1"}])
+    MongoDB.notify_write("other_db", "cameras", {"camera_id": "C-1"}, None)
+    CameraTopology.get(client, DB)
+    assert client.reads == 2
+
+
+def test_targets_keep_separate_snapshots(monkeypatch):
+    client = Client()
+    CameraTopology.get(client, DB)
+    monkeypatch.setattr(MongoDB, "target", ("replica", 27017))
+    CameraTopology.get(client, DB)
+    assert client.reads == 4
@@ -0,0 +1,80 @@
+import datetime
+import os
+import sys
+from typing import List
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import ValidateParams
+
+
+class Report:
+    param_startTime: datetime.datetime
+    param_groupIds: List[str]
+    param_pageSize: int
+
+    def __init__(self):
+        self.required_params = ["param_startTime", "param_groupIds"]
+
+    @ValidateParams(lambda self: self.required_params)
+    def run(self, **kwargs):
+        return kwargs
+
+
+def run(**params):
+    return Report().run(**dict({"param_startTime": "2025-02-11T03:30:00Z", "param_groupIds": ["G-1"]}, **params))
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("2025-02-11T03:30:00Z", datetime.datetime(2025, 2, 11, 3, 30, tzinfo=datetime.timezone.utc)),
+    ("2025-02-11T10:30:00+07:00", datetime.datetime(2025, 2, 11, 10, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=7)))),
+    ("2025-02-11T03:30:00", datetime.datetime(2025, 2, 11, 3, 30)),
+    (datetime.datetime(2025, 2, 11, 3, 30), datetime.datetime(2025, 2, 11, 3, 30)),
+])
+def test_datetimes_are_parsed(value, expected):
+    parsed = run(param_startTime=value)["param_startTime"]
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+def test_converted_values_are_assigned_to_the_instance():
+    report = Report()
+    report.run(param_startTime="2025-02-11T03:30:00Z", param_groupIds=["G-1"])
+    assert report.param_startTime == datetime.datetime(2025, 2, 11, 3, 30, tzinfo=datetime.timezone.utc)
+    assert report.param_groupIds == ["G-1"]
+
+
+@pytest.mark.parametrize("value", ["11/02/2025", "", 1739244600, None])
+def test_invalid_datetimes_are_rejected(value):
+    with pytest.raises(TypeError, match="Parameter 'param_startTime' must be of type datetime"):
+        run(param_startTime=value)
+
+
+@pytest.mark.parametrize("key,value,type_name", [
+    ("param_groupIds", "G-1", "list"),
+    ("param_groupIds", None, "list"),
+    ("param_pageSize", "10", "int"),
+])
+def test_wrong_types_are_rejected(key, value, type_name):
+    with pytest.raises(TypeError, match=f"Parameter '{key}' must be of type {type_name}"):
+        run(**{key: value})
+
+
+def test_optional_parameters_may_be_left_out():
+    assert "param_pageSize" not in run()
+    assert run(param_pageSize=10)["param_pageSize"] == 10
+
+
+def test_missing_parameters_are_listed():
+    with pytest.raises(ValueError, match="Missing required parameters: param_startTime, param_groupIds"):
+        Report().run(param_pageSize=10)
+
+
+def test_validator_follows_the_required_params():
+    report = Report()
+    report.run(param_startTime="2025-02-11T03:30:00Z", param_groupIds=["G-1"])
+    report.required_params = ["param_startTime", "param_groupIds", "param_pageSize"]
+    with pytest.raises(ValueError, match="Missing required parameters: param_pageSize"):
+        report.run(param_startTime="2025-02-11T03:30:00Z", param_groupIds=["G-1"])
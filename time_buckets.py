@@ -0,0 +1,349 @@
+from bisect import bisect_right
+from typing import Dict, List, Any, Iterable, Optional
+import datetime
+
+
+# Block widths that can be computed arithmetically from the block start
+FIXED_BLOCK_MS = {
+    "hourly": 3600 * 1000,
+    "daily": 24 * 3600 * 1000,
+    "weekly": 7 * 24 * 3600 * 1000,
+}
+
+
+def empty_block_stats(block_count: int, with_faces: bool = False) -> Dict[str, Any]:
+    """Block stats with every block at zero"""
+    stats = {
+        "blocks": [{"count": 0, "new": 0, "old": 0} for _ in range(block_count)],
+        "distinct_faces": 0
+    }
+    if with_faces:
+        for block_stats in stats["blocks"]:
+            block_stats["faces"] = []
+    return stats
+
+
+def as_utc(dt: datetime.datetime, naive: bool) -> datetime.datetime:
+    """Express dt in UTC, either timezone aware or naive as pymongo returns it"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    dt = dt.astimezone(datetime.timezone.utc)
+    return dt.replace(tzinfo=None) if naive else dt
+
+
+class BlockBucketer:
+    """
+    Assign events to time blocks one at a time
+
+    Each event is located with a binary search over the block starts, so the
+    cost is O(events * log(blocks)) whatever the order of the events. Block
+    boundaries are converted once to both naive and aware UTC so event
+    timestamps are compared as they come from pymongo, without per-event
+    timezone handling. Several bucketers can be fed from one event stream.
+
+    block_faces holds the distinct face_ids seen in each block, aligned with
+    time_blocks.
+    """
+
+    def __init__(self, time_blocks: List[Dict[str, datetime.datetime]]):
+        self.block_faces = [set() for _ in time_blocks]
+        self.bounds = {
+            naive: (
+                [as_utc(block["from"], naive) for block in time_blocks],
+                as_utc(time_blocks[-1]["to"], naive)
+            )
+            for naive in (True, False)
+        } if time_blocks else None
+
+    def feed(self, event: Dict[str, Any]):
+        """Add one event with face_id and timestamp"""
+        self.feed_many((event,))
+
+    def feed_many(self, events: Iterable[Dict[str, Any]]):
+        """Add events with face_id and timestamp"""
+        if self.bounds is None:
+            return
+        block_faces, bounds = self.block_faces, self.bounds
+        for event in events:
+            timestamp = event["timestamp"]
+            starts, end = bounds[timestamp.tzinfo is None]
+            if timestamp >= end:
+                continue
+            index = bisect_right(starts, timestamp) - 1
+            if index >= 0:
+                block_faces[index].add(event["face_id"])
+
+
+def bucket_event_faces(
+        events: Iterable[Dict[str, Any]],
+        time_blocks: List[Dict[str, datetime.datetime]]
+    ) -> List[set]:
+    """
+    Assign events to time blocks in a single pass, see BlockBucketer
+
+    Parameters:
+    - events: Iterable of documents with face_id and timestamp
+    - time_blocks: Contiguous blocks from generate_time_blocks
+
+    Returns:
+    - Distinct face_ids seen in each block, aligned with time_blocks
+    """
+    bucketer = BlockBucketer(time_blocks)
+    bucketer.feed_many(events)
+    return bucketer.block_faces
+
+
+def summarize_block_faces(
+        time_blocks: List[Dict[str, datetime.datetime]],
+        block_faces: List[Iterable[str]],
+        first_seen_map: Dict[str, Optional[datetime.datetime]],
+        with_faces: bool = False
+    ) -> Dict[str, Any]:
+    """
+    Reduce per-block distinct face sets to block stats
+
+    Parameters:
+    - time_blocks: Blocks from generate_time_blocks
+    - block_faces: Distinct face_ids seen in each block, aligned with time_blocks
+    - first_seen_map: face_id -> timezone aware first_seen
+    - with_faces: Also return the face_ids of each block
+
+    Returns:
+    - Block stats in the same shape as TimeBucketPipeline.run
+    """
+    stats = empty_block_stats(len(time_blocks), with_faces)
+    all_faces = set()
+    for block, faces, block_stats in zip(time_blocks, block_faces, stats["blocks"]):
+        if with_faces:
+            block_stats["faces"] = list(faces)
+        for face_id in faces:
+            block_stats["count"] += 1
+            first_seen = first_seen_map.get(face_id)
+            if first_seen is None:
+                continue
+            if block["from"] <= first_seen < block["to"]:
+                block_stats["new"] += 1
+            elif first_seen < block["from"]:
+                block_stats["old"] += 1
+        all_faces.update(faces)
+    stats["distinct_faces"] = len(all_faces)
+    return stats
+
+
+class TimeBucketPipeline:
+    """
+    Compile a time-block metric query into a single face_events aggregation
+
+    Events are assigned to the blocks of generate_time_blocks() on the server,
+    de-duplicated per (block, face_id), joined once per face to
+    face_identities and reduced to one row per block, so only block counts
+    cross the wire instead of every matching event. With faces, the face_ids
+    would not fit in one result document, so one row per face is streamed
+    instead and reduced to block stats on the client.
+    """
+
+    def __init__(
+            self,
+            camera_ids: List[str],
+            time_blocks: List[Dict[str, datetime.datetime]],
+            base_time: str,
+            labels: Optional[List[str]] = None,
+            with_faces: bool = False,
+            face_ids: Optional[List[str]] = None
+        ):
+        """
+        Parameters:
+        - camera_ids: Cameras whose events are counted
+        - time_blocks: Blocks from generate_time_blocks
+        - base_time: Time unit the blocks were generated with
+        - labels: Only count faces whose identity carries all of these labels
+        - with_faces: Also return the face_ids of each block
+        - face_ids: Only match events of these faces, e.g. the faces resolved
+          for labels, so other events never leave the face_id index
+        """
+        self.camera_ids = camera_ids
+        self.time_blocks = time_blocks
+        self.base_time = base_time
+        self.labels = labels
+        self.with_faces = with_faces
+        self.face_ids = face_ids
+
+    def block_index_expression(self) -> Dict[str, Any]:
+        """
+        Expression mapping $timestamp to its block index
+
+        Blocks are anchored on startTime rather than on calendar boundaries, so
+        $dateTrunc cannot be used. Fixed width units are resolved arithmetically,
+        monthly and yearly blocks (few per query) through a $switch over the
+        block ends.
+        """
+        start = self.time_blocks[0]["from"]
+        if self.base_time in FIXED_BLOCK_MS:
+            return {
+                "$toInt": {
+                    "$floor": {
+                        "$divide": [
+                            {"$subtract": ["$timestamp", start]},
+                            FIXED_BLOCK_MS[self.base_time]
+                        ]
+                    }
+                }
+            }
+        return {
+            "$switch": {
+                "branches": [
+                    {"case": {"$lt": ["$timestamp", block["to"]]}, "then": index}
+                    for index, block in enumerate(self.time_blocks)
+                ],
+                "default": len(self.time_blocks) - 1
+            }
+        }
+
+    def build(self) -> List[Dict[str, Any]]:
+        """
+        Build the aggregation pipeline
+
+        Returns one document holding the block rows and the distinct face
+        count, or with faces one {"_id": face_id, "blocks", "first_seen"}
+        document per face.
+        """
+        froms = [block["from"] for block in self.time_blocks]
+        tos = [block["to"] for block in self.time_blocks]
+        first_seen_is_date = {"$eq": [{"$type": "$first_seen"}, "date"]}
+
+        match = {
+            "camera_id": {"$in": self.camera_ids},
+            "timestamp": {"$gte": froms[0], "$lt": tos[-1]}
+        }
+        if self.face_ids is not None:
+            match["face_id"] = {"$in": self.face_ids}
+
+        pipeline = [
+            {"$match": match},
+            # One row per face holding the blocks it appeared in
+            {
+                "$group": {
+                    "_id": "$face_id",
+                    "blocks": {"$addToSet": self.block_index_expression()}
+                }
+            },
+            {
+                "$lookup": {
+                    "from": "face_identities",
+                    "localField": "_id",
+                    "foreignField": "face_id",
+                    "pipeline": [{"$project": {"_id": 0, "first_seen": 1, "labels": 1}}],
+                    "as": "identity"
+                }
+            },
+        ]
+        if self.labels:
+            pipeline.append({"$match": {"identity.labels": {"$all": self.labels}}})
+        if self.with_faces:
+            pipeline.append({"$project": {"blocks": 1, "first_seen": {"$first": "$identity.first_seen"}}})
+            return pipeline
+        block_group = {
+            "_id": "$block",
+            "count": {"$sum": 1},
+            "new": {
+                "$sum": {
+                    "$cond": [
+                        {"$and": [
+                            first_seen_is_date,
+                            {"$gte": ["$first_seen", "$from"]},
+                            {"$lt": ["$first_seen", "$to"]}
+                        ]},
+                        1,
+                        0
+                    ]
+                }
+            },
+            "old": {
+                "$sum": {
+                    "$cond": [
+                        {"$and": [
+                            first_seen_is_date,
+                            {"$lt": ["$first_seen", "$from"]}
+                        ]},
+                        1,
+                        0
+                    ]
+                }
+            }
+        }
+        pipeline.append({
+            "$facet": {
+                "blocks": [
+                    {"$unwind": "$blocks"},
+                    {
+                        "$project": {
+                            "block": "$blocks",
+                            "first_seen": {"$first": "$identity.first_seen"},
+                            "from": {"$arrayElemAt": [froms, "$blocks"]},
+                            "to": {"$arrayElemAt": [tos, "$blocks"]}
+                        }
+                    },
+                    {"$group": block_group}
+                ],
+                "faces": [{"$count": "count"}]
+            }
+        })
+        return pipeline
+
+    def run(self, mongo_client, db_name: str, batch_size: int = 1000) -> Optional[Dict[str, Any]]:
+        """
+        Execute the pipeline
+
+        Returns:
+        - {"blocks": [{"count", "new", "old"[, "faces"]}, ...] aligned with
+           time_blocks, "distinct_faces": number of distinct faces over all blocks},
+          or None if the aggregation fails, e.g. before MongoDB 5.0
+        """
+        stats = empty_block_stats(len(self.time_blocks), self.with_faces)
+        if not self.time_blocks or not self.camera_ids or self.face_ids == []:
+            return stats
+
+        if self.with_faces:
+            return self.run_with_faces(mongo_client, db_name, batch_size)
+
+        rows = mongo_client.aggregate(
+            db_name=db_name,
+            col_name="face_events",
+            query=self.build()
+        )
+        if not rows["status"]:
+            return None
+        rows = rows["result"]
+        if not rows:
+            return stats
+
+        for row in rows[0]["blocks"]:
+            stats["blocks"][row["_id"]].update(
+                count=row["count"],
+                new=row["new"],
+                old=row["old"]
+            )
+        if rows[0]["faces"]:
+            stats["distinct_faces"] = rows[0]["faces"][0]["count"]
+        return stats
+
+    def run_with_faces(self, mongo_client, db_name: str, batch_size: int = 1000) -> Optional[Dict[str, Any]]:
+        """Execute the per-face pipeline through a cursor, None if the aggregation fails"""
+        rows = mongo_client.aggregate_iter(
+            db_name=db_name,
+            col_name="face_events",
+            query=self.build(),
+            batch_size=batch_size
+        )
+        if not rows["status"]:
+            return None
+
+        block_faces = [[] for _ in self.time_blocks]
+        first_seen_map = {}
+        for row in rows["result"]:
+            for index in row["blocks"]:
+                block_faces[index].append(row["_id"])
+            first_seen = row.get("first_seen")
+            if isinstance(first_seen, datetime.datetime):
+                first_seen_map[row["_id"]] = as_utc(first_seen, naive=False)
+        return summarize_block_faces(self.time_blocks, block_faces, first_seen_map, with_faces=True)
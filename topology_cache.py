@@ -0,0 +1,106 @@
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import threading
+import time
+
+from db import MongoDB
+
+
+class CameraTopology:
+    """
+    Versioned in-memory copy of cam_groups and cameras
+
+    Group -> camera resolution happens at the start of every metric and
+    endpoint while the topology rarely changes, so both collections are read
+    once per database and served from dicts. A snapshot is reloaded after ttl
+    seconds, and writes to cam_groups or cameras through MongoDB invalidate it
+    immediately. Every reload bumps the snapshot version.
+    """
+    ttl = 60.0
+    cam_group_fields = {"_id": 0}
+    camera_fields = {"_id": 0, "camera_id": 1, "group_id": 1}
+
+    # Keyed by MongoDB.database_key, same-named databases of other targets stay apart
+    _snapshots: Dict[Tuple, Dict[str, Any]] = {}
+    _version = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, ttl: Optional[float] = None):
+        if ttl is not None:
+            cls.ttl = ttl
+
+    @classmethod
+    def load(cls, mongo_client, db_name: str) -> Dict[str, Any]:
+        """Read both collections into a snapshot"""
+        groups = mongo_client.find(
+            db_name=db_name,
+            col_name="cam_groups",
+            query={},
+            projection=cls.cam_group_fields
+        )
+        cameras = mongo_client.find(
+            db_name=db_name,
+            col_name="cameras",
+            query={},
+            projection=cls.camera_fields
+        )
+        if not groups["status"] or not cameras["status"]:
+            raise RuntimeError(f"Failed to load camera topology: {groups.get('error') or cameras.get('error')}")
+
+        group_cameras: Dict[str, List[str]] = {}
+        for camera in cameras["result"]:
+            group_cameras.setdefault(camera.get("group_id"), []).append(camera["camera_id"])
+        return {
+            "groups": {group["group_id"]: group for group in groups["result"]},
+            "group_cameras": group_cameras,
+            "loaded_at": time.monotonic()
+        }
+
+    @classmethod
+    def get(cls, mongo_client, db_name: str) -> Dict[str, Any]:
+        """Current snapshot of db_name, reloaded when missing or expired"""
+        key = MongoDB.database_key(db_name)
+        with cls._lock:
+            snapshot = cls._snapshots.get(key)
+            if snapshot is not None and time.monotonic() - snapshot["loaded_at"] < cls.ttl:
+                return snapshot
+            snapshot = cls.load(mongo_client, db_name)
+            cls._version += 1
+            snapshot["version"] = cls._version
+            cls._snapshots[key] = snapshot
+            return snapshot
+
+    @classmethod
+    def group_camera_ids(cls, mongo_client, db_name: str, group_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """camera_ids of each group in group_ids"""
+        group_cameras = cls.get(mongo_client, db_name)["group_cameras"]
+        return {group_id: list(group_cameras.get(group_id, [])) for group_id in group_ids}
+
+    @classmethod
+    def camera_ids(cls, mongo_client, db_name: str, group_ids: Iterable[str]) -> List[str]:
+        """camera_ids of all groups in group_ids"""
+        group_cameras = cls.get(mongo_client, db_name)["group_cameras"]
+        return [camera_id for group_id in dict.fromkeys(group_ids) for camera_id in group_cameras.get(group_id, [])]
+
+    @classmethod
+    def groups(cls, mongo_client, db_name: str, group_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """cam_groups documents of the existing groups in group_ids"""
+        groups = cls.get(mongo_client, db_name)["groups"]
+        return [dict(groups[group_id]) for group_id in dict.fromkeys(group_ids) if group_id in groups]
+
+    @classmethod
+    def invalidate(cls, db_name: Optional[str] = None):
+        with cls._lock:
+            if db_name is None:
+                cls._snapshots.clear()
+            else:
+                cls._snapshots.pop(MongoDB.database_key(db_name), None)
+
+    @classmethod
+    def invalidate_on_write(cls, db_name: str, col_name: str, query: Optional[Dict[str, Any]], documents: Optional[List[Dict[str, Any]]]):
+        """MongoDB write listener dropping the snapshot on cam_groups and cameras writes"""
+        if col_name in ("cam_groups", "cameras"):
+            cls.invalidate(db_name)
+
+
+MongoDB.add_write_listener(CameraTopology.invalidate_on_write)
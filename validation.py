@@ -0,0 +1,100 @@
+from functools import wraps
+from typing import Dict, Any, Callable, Tuple, Type, get_origin, get_type_hints
+import datetime
+
+
+def parse_datetime_param(key: str, value: Any) -> datetime.datetime:
+    """ISO 8601 string (or datetime) parameter as a datetime, a trailing Z meaning UTC"""
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    raise TypeError(f"Parameter '{key}' must be of type datetime")
+
+
+def type_check(expected_type: Type) -> Callable[[str, Any], Any]:
+    """Converter checking a parameter against expected_type, returning it unchanged"""
+    # Generic aliases such as List[str] are checked against their origin
+    check_type = get_origin(expected_type) or expected_type
+
+    def check(key: str, value: Any) -> Any:
+        if not isinstance(value, check_type):
+            raise TypeError(f"Parameter '{key}' must be of type {check_type.__name__}")
+        return value
+    return check
+
+
+class CompiledValidator:
+    """
+    Parameter checks of one class, resolved once
+
+    Holds the required parameter names and a converter per annotated
+    parameter: datetime parameters are parsed, others are type checked.
+    """
+
+    def __init__(self, required_params: Tuple[str, ...], param_types: Dict[str, Type]):
+        self.required_params = required_params
+        self.converters = tuple(
+            (key, parse_datetime_param if expected_type is datetime.datetime else type_check(expected_type))
+            for key, expected_type in param_types.items()
+        )
+
+    def __call__(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Check params
+
+        Returns:
+        - The converted values of the annotated parameters present in params
+        """
+        missing_params = [
+            param for param in self.required_params
+            if param not in params
+        ]
+        if missing_params:
+            raise ValueError(
+                f"Missing required parameters: {', '.join(missing_params)}"
+            )
+
+        converted = {}
+        for key, convert in self.converters:
+            if key in params:
+                converted[key] = convert(key, params[key])
+        return converted
+
+
+class ValidateParams:
+    """
+    Decorator validating the keyword parameters of run()
+
+    Parameter types come from the class annotations. The checks of a class
+    are compiled into a CompiledValidator on its first call and cached, so a
+    call only tests the required keys and runs the converters. Converted
+    values, e.g. parsed datetimes, replace the raw ones in the kwargs passed
+    to run() and are assigned to the instance.
+    """
+
+    def __init__(self, required_params_getter: Callable):
+        self.required_params_getter = required_params_getter
+        self.validators: Dict[Tuple[type, Tuple[str, ...]], CompiledValidator] = {}
+
+    def validator(self, instance) -> CompiledValidator:
+        """Cached validator of the instance's class and required parameters"""
+        key = (instance.__class__, tuple(self.required_params_getter(instance)))
+        validator = self.validators.get(key)
+        if validator is None:
+            validator = CompiledValidator(key[1], get_type_hints(instance.__class__))
+            self.validators[key] = validator
+        return validator
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(instance, *args, **kwargs):
+            converted = self.validator(instance)(kwargs)
+            for key, value in converted.items():
+                setattr(instance, key, value)
+            kwargs.update(converted)
+            return func(instance, *args, **kwargs)
+        return wrapper